@@ -8,78 +8,29 @@
 # - 模型元数据 json：svm_pca_behavior_meta.json
 # - 原始数据 CSV（用于计算人群均值/标准差/百分位）
 # - （可选）文本模型 pkl：pipe_text_final.pkl / pipe_text_final2.pkl
-# ---------- START: paste this BEFORE any call to load_dataset ----------
-import os
-import traceback
-import pandas as pd
-import streamlit as st
-
-def _detect_file_format(path):
-    """Return 'csv', 'xls', 'xlsx', or None."""
-    with open(path, "rb") as f:
-        head = f.read(4096)
-    if head.startswith(b"PK\x03\x04"):
-        return "xlsx"
-    if head.startswith(b"\xD0\xCF\x11\xE0"):
-        return "xls"
-    try:
-        s = head.decode("utf-8", errors="ignore")
-        first = s.splitlines()[0] if s.splitlines() else ""
-        if "," in first or "\t" in first:
-            return "csv"
-    except Exception:
-        pass
-    return None
-
-def load_dataset(path):
-    """
-    Robust dataset loader.
-    - path: 文件路径，相对于 repo 根（或绝对路径）。
-    返回 pandas.DataFrame 或在失败时抛异常（会被 Streamlit 捕获并记录到日志）。
-    """
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"数据文件不存在：{path}")
-
-
-    fmt = _detect_file_format(path)
-
-    try:
-        # 优先按扩展名判断（更明确）
-        ext = os.path.splitext(path)[1].lower()
-        if ext == ".csv" or fmt == "csv":
-            df = pd.read_csv(path, low_memory=False)
-        elif ext == ".xls" or fmt == "xls":
-            # 需要 xlrd>=2.0.1 在 requirements.txt 中
-            df = pd.read_excel(path, engine="xlrd", low_memory=False)
-        elif ext == ".xlsx" or fmt == "xlsx":
-            # 需要 openpyxl 在 requirements.txt 中
-            df = pd.read_excel(path, engine="openpyxl", low_memory=False)
-        else:
-            # 兜底：先试 csv，再试 excel（xlrd/openpyxl）
-            try:
-                df = pd.read_csv(path, low_memory=False)
-            except Exception:
-                df = pd.read_excel(path, engine="xlrd", low_memory=False)
-        return df
-    except Exception as e:
-        tb = traceback.format_exc()
-        # 输出到部署日志（Streamlit 的后端日志），并在 UI 显示简短信息
-        print("load_dataset error traceback:\n", tb)
-        st.error("读取数据集失败（详细信息见部署日志）。")
-        raise
-
-
-
-
-
-
-
-# ---------- END: paste this BEFORE any call to load_dataset ----------
+# 存在模型清单 models.json（见 registry.py）时改为从清单中选择模型，模型在后台预加载并随文件变化热替换。
+#
+# 人群基线建议离线预先构建（与 pkl/json 放在一起，数据集变化后重新运行）：
+#   python baseline.py --data CNAH2003_public_use.xls --meta svm_pca_behavior_meta.json
+# 行为模型可导出为纯 NumPy 推理产物（存在且与 pkl 匹配时自动使用，推理不再需要 sklearn）：
+#   python compiled_model.py --model svm_pca_behavior_pipeline.pkl --check CNAH2003_public_use.xls
+# 重训（并行交叉验证 + 全量拟合，一次生成上述全部产物并更新 models.json）：
+#   python train_runner.py --models svm text --full
+# CNN / BiGRU 序列模型（需要 torch）由 train_runner --full 导出为 TorchScript（seq_*.ts，见 seq_serving.py），
+# 结果页可选择 SVM / CNN / RNN 或多选集成；推理线程数由环境变量 DEYU_TORCH_THREADS 控制。
+# 批量筛查页可在后台进程池中为每名受访者生成 HTML 个人报告并打包下载（见 reports.py，DEYU_REPORT_WORKERS）。
 
 # Consolidated, safe imports and environment captions
+# 启动时只导入页面骨架需要的模块；sklearn / plotly.express / joblib 等重依赖推迟到真正用到的分支里
+# （版本号从包元数据读取，不导入包本身）。导入耗时预算见 python bench.py --import-check。
 import platform
+import time
 import os
 import json
+import functools
+from importlib.machinery import ModuleSpec
+from importlib.metadata import PackageNotFoundError, version as _dist_version
+from importlib.util import find_spec
 from pathlib import Path
 import traceback
 
@@ -87,30 +38,34 @@ import numpy as np
 import pandas as pd
 import streamlit as st
 
-# joblib（可能不存在），统一用 _joblib 变量
-try:
-    import joblib as _joblib
-except Exception:
-    _joblib = None
-
-# sklearn / plotly 等可选依赖，优雅处理缺失情况
-try:
-    import sklearn
-    SKLEARN_VERSION = sklearn.__version__
-except Exception:
-    sklearn = None
-    SKLEARN_VERSION = None
+# Streamlit 把本脚本注册为 __main__（带 __file__、无 __spec__），spawn 出的报告工作进程会据此以 __mp_main__
+# 把整个页面脚本重新执行一遍（加载数据集、模型）。声明主模块名为 __main__ 后 multiprocessing 不再重新导入它，
+# 工作进程只导入 reports。
+if __spec__ is None:
+    __spec__ = ModuleSpec("__main__", None)
+
+from baseline import artifact_path_for, build_baseline, load_baseline
+from batch import read_columns, remove_files, save_upload, score_upload
+from compiled_model import load_serving_model
+from dataset import file_fingerprint, load_population
+from longitudinal import DEFAULT_DB, LongitudinalStore
+from registry import DEFAULT_MANIFEST, ModelRegistry
+from reports import ReportService, records_from_upload
+from result_cache import ResultCache, feature_key, normalize_text, text_key
+from scoring import RISK_HIGH, RISK_WARN, DeviationScorer, fuse, load_meta_file, verdict_text
+from text_model import load_text_model, predict_text_proba
+import tracing
+
+
+def _pkg_version(name):
+    try:
+        return _dist_version(name)
+    except PackageNotFoundError:
+        return None
 
-try:
-    import plotly
-    import plotly.graph_objects as go
-    import plotly.express as px
-    PLOTLY_VERSION = plotly.__version__
-except Exception:
-    plotly = None
-    go = None
-    px = None
-    PLOTLY_VERSION = None
+SKLEARN_VERSION = _pkg_version("scikit-learn")
+PLOTLY_VERSION = _pkg_version("plotly")
+HAS_JOBLIB = find_spec("joblib") is not None
 
 # sidebar 显示 Python / 库版本（安全拼接，不会引用未定义变量）
 st.sidebar.caption(f"Python: {platform.python_version()}")
@@ -121,19 +76,6 @@ if PLOTLY_VERSION:
     env_caps += f" | plotly {PLOTLY_VERSION}"
 st.sidebar.caption(env_caps)
 
-
-
-# —— 安全导入：joblib 不在环境时自动回退到 pickle（仅此为新增，其他逻辑不变）
-try:
-    import joblib as _joblib
-except Exception:
-    _joblib = None
-import pickle as _pickle
-
-import streamlit as st
-import plotly.graph_objects as go
-import plotly.express as px
-
 st.set_page_config(page_title="多模态青少年抑郁风险预测模型 ", page_icon="🧠", layout="wide")
 
 # ========= 仅新增：把 Qxx 显示为中文题干 =========
@@ -208,183 +150,207 @@ def label_for(col_name: str) -> str:
     return f"{text}（{col_name}）" if text else str(col_name)
 # =========（新增部分结束，其它一律不动）=========
 
+@st.cache_resource(show_spinner=False)
+def get_model_registry(manifest_path: str):
+    # 每个进程一个注册表：后台线程预加载清单中的模型，并在 pkl 变化时热替换
+    return ModelRegistry(manifest_path).start()
+
 # ========= Sidebar: 资源加载 =========
 st.sidebar.header("⚙️ 配置 / 资源")
-model_path = st.sidebar.text_input("行为模型文件（.pkl）", "svm_pca_behavior_pipeline.pkl")
-meta_path  = st.sidebar.text_input("行为模型元数据（.json）", "svm_pca_behavior_meta.json")
+manifest_path = st.sidebar.text_input("模型清单（.json，可选；存在时从清单选择模型）", DEFAULT_MANIFEST)
+registry = None
+if manifest_path and os.path.exists(manifest_path):
+    try:
+        registry = get_model_registry(manifest_path)
+    except Exception as e:
+        st.sidebar.error(f"读取模型清单失败：{type(e).__name__}: {e}")
+model_name = text_name = None
+if registry is not None and registry.names("behavior"):
+    model_name = st.sidebar.selectbox("行为模型", registry.names("behavior"))
+    text_choices = ["（不使用）"] + registry.names("text")
+    text_name = st.sidebar.selectbox("（可选）文本模型", text_choices)
+    text_name = None if text_name == text_choices[0] else text_name
+    model_path = registry.entries[model_name].path
+    meta_path = registry.entries[model_name].meta_path
+    text_model_path = registry.entries[text_name].path if text_name else ""
+else:
+    registry = None
+    model_path = st.sidebar.text_input("行为模型文件（.pkl）", "svm_pca_behavior_pipeline.pkl")
+    meta_path  = st.sidebar.text_input("行为模型元数据（.json）", "svm_pca_behavior_meta.json")
+    seq_paths = st.sidebar.text_input("（可选）序列模型（TorchScript .ts，逗号分隔）", "seq_cnn.ts, seq_rnn.ts")
+    text_model_path = st.sidebar.text_input("（可选）文本模型（.pkl）", "")
 data_path  = st.sidebar.text_input("数据集 CSV（用于计算人群基线）", "CNAH2003_public_use.xls")
-text_model_path = st.sidebar.text_input("（可选）文本模型（.pkl）", "")
+history_db = st.sidebar.text_input("纵向记录库（SQLite，填写学生编号时使用）", DEFAULT_DB)
 
 st.sidebar.markdown("---")
 st.sidebar.caption("提示：先在 Notebook 导出 pkl/json；数据集仅用于计算平均/标准差/百分位。")
+trace_on = st.sidebar.checkbox("⏱ 性能诊断（记录本次运行各阶段耗时）", value=tracing.ENV_ENABLED)
+tracing.begin_run(trace_on)
 
 # ========= 工具函数 =========
+@tracing.traced("load_meta", cached=True)
 @st.cache_data(show_spinner=False)
 def load_meta(meta_path: str):
+    tracing.note_miss()
     try:
-        meta = json.load(open(meta_path, "r", encoding="utf-8"))
-        feats = meta.get("features", [])
-        return meta, feats
+        return load_meta_file(meta_path)
     except Exception as e:
         st.sidebar.error(f"读取 meta 失败：{e}")
         return {}, []
 
+@tracing.traced("load_model", cached=True)
 @st.cache_resource(show_spinner=False)
-def load_model(model_path: str):
+def load_model(model_path: str, mtime: float):
+    # mtime 只参与缓存键：pkl 被覆盖后下一次 rerun 重新加载
+    tracing.note_miss()
     try:
-        if _joblib is not None:
-            return _joblib.load(model_path)
-        # 回退到 pickle（若 joblib 缺失）
-        with open(model_path, "rb") as f:
-            return _pickle.load(f)
+        return load_serving_model(model_path)   # 有编译产物时用纯 NumPy 推理；否则 joblib 优先，缺失时回退到 pickle
     except Exception as e:
         msg = f"加载模型失败：{type(e).__name__}: {e}"
-        if _joblib is None:
+        if not HAS_JOBLIB:
             msg += "（当前环境未安装 joblib，已尝试使用 pickle 但仍失败。请在 requirements.txt 中添加 joblib）"
         st.sidebar.error(msg)
         return None
 
-#数据
-# 替换你原来的读取代码为下面这段
-import os
-import traceback
-import pandas as pd
-import streamlit as st
-
-data_path = "CNAH2003_public_use.xls"  # 确认路径（相对于 repo 根）
-
-def detect_file_format(path):
-    with open(path, "rb") as f:
-        head = f.read(4096)
-    # XLSX (zip archive)
-    if head.startswith(b"PK\x03\x04"):
-        return "xlsx"
-    # Old BIFF Compound File (xls)
-    if head.startswith(b"\xD0\xCF\x11\xE0"):
-        return "xls"
-    # Heuristic for CSV / text: first line contains commas or tabs and ASCII letters
-    try:
-        s = head.decode("utf-8", errors="ignore")
-        first = s.splitlines()[0] if s.splitlines() else ""
-        if "," in first or "\t" in first:
-            return "csv"
-    except Exception:
-        pass
-    return None
-
-if not os.path.exists(data_path):
-    st.error(f"数据文件不存在：{data_path}。请确认已 push 到 repo 根目录，或使用正确的相对路径。")
-    raise FileNotFoundError(data_path)
-
-fmt = detect_file_format(data_path)
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    # 进程级的模型输出缓存（各会话共享）：键含模型文件版本与规范化输入，见 result_cache.py
+    return ResultCache()
 
+def model_file_id(path: str) -> str:
+    # 缓存键里的模型版本：路径 + (mtime, size)，pkl/ts 被覆盖后旧结果不再命中
+    st_ = os.stat(path)
+    return f"{os.path.abspath(path)}@{st_.st_mtime_ns}:{st_.st_size}"
 
-try:
-    if fmt == "csv" or os.path.splitext(data_path)[1].lower() == ".csv":
-        df = pd.read_csv(data_path, low_memory=False)
-    elif fmt == "xls":
-        # .xls 需要 xlrd>=2.0.1 已在 requirements.txt
-        df = pd.read_excel(data_path, engine="xlrd", low_memory=False)
-    elif fmt == "xlsx":
-        # .xlsx 需要 openpyxl
-        df = pd.read_excel(data_path, engine="openpyxl", low_memory=False)
+@st.cache_resource(show_spinner=False)
+def get_report_service():
+    # 进程级的报告服务：共享的工作进程池在后台渲染，各会话的任务排队，不阻塞脚本线程（见 reports.py）
+    return ReportService()
+
+def show_report_job(job):
+    if job is None:
+        return
+    if job.status in ("queued", "parsing"):
+        st.progress(0.0, text=f"正在读取上传文件…（{job.seconds:.0f}s）")
+    elif job.finished is None:
+        st.progress(job.progress, text=f"正在生成个人报告：{job.done} / {job.total}（{job.seconds:.0f}s）")
+    elif job.status == "done":
+        st.success(f"已生成 {job.total - job.failed} 份个人报告，用时 {job.seconds:.1f}s"
+                   + (f"；{job.failed} 份失败（见 zip 内 index.html）" if job.failed else ""))
+        with open(job.zip_path, "rb") as f:
+            st.download_button("下载个人报告（zip）", data=f.read(), file_name=f"{job.title or 'reports'}_reports.zip",
+                               mime="application/zip", key=f"report_zip_{job.id}")
     else:
-        # 兜底尝试：先用 csv，再用 excel
-        try:
-            df = pd.read_csv(data_path, low_memory=False)
-        except Exception:
-            df = pd.read_excel(data_path, engine="xlrd", low_memory=False)
+        st.error(f"生成个人报告失败：{job.error or job.status}")
 
-except Exception as e:
-    # 在 app 页面显示友好信息，并将完整 traceback 输出到日志（streamlit 日志 / 部署日志可见）
-    st.error("读取数据集失败：详细错误已记录到日志（查看 Manage App -> Logs）。")
-    tb = traceback.format_exc()
-    print(tb)          # 会进入部署日志
-    raise
-
-
-
-def numeric_bounds(s: pd.Series):
-    x = pd.to_numeric(s, errors="coerce")
-    x = x[np.isfinite(x)]
-    if x.empty:
-        return 0.0, 1.0, 0.5
-    lo, hi = np.nanpercentile(x, [1, 99])
-    mu, sd = np.nanmean(x), np.nanstd(x)
-    default = float(mu) if np.isfinite(mu) else float(np.nanmedian(x))
-    if not np.isfinite(lo) or not np.isfinite(hi) or lo >= hi:
-        lo, hi = float(x.min()), float(x.max())
-    if not np.isfinite(default):
-        default = (lo + hi) / 2.0
-    return float(lo), float(hi), float(default)
-
-def compute_baseline(df: pd.DataFrame, features: list):
-    feats_present = [c for c in features if c in df.columns]
-    base = {}
-    for c in feats_present:
-        s = df[c]
-        if s.dtype.kind in "biufc":  # numeric-like
-            x = pd.to_numeric(s, errors="coerce")
-            mu = float(np.nanmean(x))
-            sd = float(np.nanstd(x))
-            qs = {int(q): float(np.nanpercentile(x, q)) for q in range(1,100)}
-            base[c] = {"kind": "num", "mean": mu, "std": sd, "quantiles": qs}
-        else:
-            vals = s.dropna().astype(str).value_counts().index.tolist()
-            vals = vals[:50] if len(vals) > 50 else vals
-            base[c] = {"kind": "cat", "choices": vals}
+@st.fragment(run_every=1.0)
+def report_progress_live(job_id: str):
+    # 只重跑这个片段：每秒刷新一次进度；任务结束后整页重跑一次，切换到静态的下载按钮
+    job = get_report_service().get(job_id)
+    show_report_job(job)
+    if job is None or job.finished is not None:
+        st.rerun()
+
+@st.cache_resource(show_spinner=False)
+def get_history_store(db_path: str):
+    # 每个进程一个连接（内部加锁），各会话共享
+    return LongitudinalStore(db_path)
+
+@tracing.traced("text_model_load", cached=True)
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_text_model(text_model_path: str, mtime: float):
+    tracing.note_miss()
+    # 键为 (路径, mtime)：同一文件只反序列化一次，pkl 被覆盖后自动重新加载
+    return load_text_model(text_model_path)
+
+@tracing.traced("load_dataset", cached=True)
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_reference_population(data_path: str, columns: tuple, mtime: float):
+    tracing.note_miss()
+    # 只含模型特征列的紧凑参照人群（int8 + 缺失掩码），以只读 mmap 打开：
+    # 同一节点上的多个 app 副本共享页缓存，不再各自常驻一份 DataFrame。
+    # cache_resource 不做序列化拷贝；mtime 只参与缓存键：源文件被替换后自动失效
+    return load_population(data_path, list(columns))
+
+@tracing.traced("get_baseline", cached=True)
+@st.cache_resource(show_spinner=False)
+def get_baseline(meta_path: str, data_path: str, features: tuple, mtime: float, artifact_mtime: float):
+    tracing.note_miss()
+    # 优先读取离线构建的基线产物（python baseline.py）；缺失或与数据集 sha1 不匹配时才现算
+    # artifact_mtime 只参与缓存键：sketch.py fold 重写产物后，运行中的 app 自动换用新基线
+    sha1 = file_fingerprint(data_path)
+    base = load_baseline(artifact_path_for(meta_path), sha1, list(features))
+    if base is None:
+        pop = get_reference_population(data_path, features, mtime)
+        with tracing.span("compute_baseline", rows=len(pop)):
+            base = build_baseline(pop, list(features), dataset_sha1=sha1)
     return base
 
-def zscore(x, mu, sd):
-    if sd is None or sd == 0 or not np.isfinite(sd):
-        return np.nan
-    return (x - mu) / sd
-
-def empirical_percentile(x, qs: dict):
-    if not qs:
-        return np.nan
-    items = sorted(qs.items(), key=lambda kv: kv[0])
-    loq, hiq = 1, 99
-    for q, v in items:
-        if x >= v:
-            loq = q
-        else:
-            hiq = q
-            break
-    v_lo = qs.get(loq, None)
-    v_hi = qs.get(hiq, None)
-    if v_lo is None or v_hi is None or v_hi == v_lo:
-        return float(loq)
-    frac = (x - v_lo) / (v_hi - v_lo)
-    return float(np.clip(loq + frac * (hiq - loq), 1, 99))
+def show_chart(fig, name: str):
+    # 每个 st.plotly_chart 单独计时（图表序列化 + 发送到前端）
+    with tracing.span("plotly_chart", chart=name):
+        st.plotly_chart(fig, use_container_width=True)
 
 # ========= 加载资源 =========
 meta, model_features = load_meta(meta_path)
-pipe = load_model(model_path)
+if registry is not None:
+    try:
+        with tracing.span("load_model", cache="hit" if registry.is_loaded(model_name) else "miss"):
+            pipe = registry.get(model_name).model
+    except Exception as e:
+        st.sidebar.error(f"加载模型失败：{type(e).__name__}: {e}")
+        st.stop()
+else:
+    pipe = load_model(model_path, os.path.getmtime(model_path) if os.path.exists(model_path) else 0.0)
 if pipe is None:
     st.stop()
 
-df_all = load_dataset(data_path)
-if df_all is None:
-    st.stop()
+# 结果页可选的行为模型后端（SVM / CNN / RNN …）：清单模式下为全部行为模型条目，否则为侧边栏填写的文件
+if registry is not None:
+    backend_names = registry.names("behavior")
+    primary_backend = model_name
+else:
+    backend_names = [model_path] + [p for p in (x.strip() for x in seq_paths.split(","))
+                                    if p and p != model_path and os.path.exists(p)]
+    primary_backend = model_path
+
+def get_backend(name):
+    if name == primary_backend:
+        return pipe
+    if registry is not None:
+        with tracing.span("load_model", cache="hit" if registry.is_loaded(name) else "miss"):
+            return registry.get(name).model
+    return load_model(name, os.path.getmtime(name))
+
+def backend_path(name):
+    return registry.entries[name].path if registry is not None else name
+
+def backend_label(name):
+    path = backend_path(name)
+    return f"{Path(name).stem}（{'TorchScript' if str(path).endswith('.ts') else 'SVM'}）"
+
+if registry is not None:
+    with st.sidebar.expander("📦 模型清单状态", expanded=False):
+        st.dataframe(pd.DataFrame(registry.status()), use_container_width=True, hide_index=True)
+        st.caption(f"已热替换 {registry.swaps} 次；最多同时加载 {registry.max_loaded} 个模型。")
 
-# 仅用模型特征参与统计（保持你原有结构，函数名相同无副作用）
-def compute_baseline(df, features):
-    feats_present = [c for c in features if c in df.columns]
-    base = {}
-    for c in feats_present:
-        s = df[c]
-        if s.dtype.kind in "biufc":
-            x = pd.to_numeric(s, errors="coerce")
-            mu, sd = float(np.nanmean(x)), float(np.nanstd(x))
-            qs = {int(q): float(np.nanpercentile(x, q)) for q in range(1,100)}
-            base[c] = {"kind": "num", "mean": mu, "std": sd, "quantiles": qs}
-        else:
-            vals = s.dropna().astype(str).value_counts().index.tolist()
-            base[c] = {"kind": "cat", "choices": vals[:50]}
-    return base
+if not os.path.exists(data_path):
+    st.error(f"数据文件不存在：{data_path}。请确认已 push 到 repo 根目录，或使用正确的相对路径。")
+    st.stop()
+try:
+    # 基线产物里已包含统计量与分布直方图；只有产物缺失/过期时才会读取整份数据集
+    baseline_artifact = artifact_path_for(meta_path)
+    base_stats = get_baseline(meta_path, data_path, tuple(model_features), os.path.getmtime(data_path),
+                              baseline_artifact.stat().st_mtime if baseline_artifact.exists() else 0.0)
+except Exception:
+    tb = traceback.format_exc()
+    # 输出到部署日志（Streamlit 的后端日志），并在 UI 显示简短信息
+    print("load_dataset error traceback:\n", tb)
+    st.error("读取数据集失败（详细信息见部署日志）。")
+    st.stop()
 
-baseline = compute_baseline(df_all, model_features)
+baseline = base_stats.as_dict()
+scorer = DeviationScorer(base_stats)
 feats_present = [c for c in model_features if c in baseline]
 missing = [c for c in model_features if c not in feats_present]
 if missing:
@@ -394,7 +360,7 @@ if missing:
 st.title("🧠 多模态青少年抑郁风险预测模型 by Deyu")
 st.markdown("本demo基于预训练的RNN模型。数据来源：WHO 2003 GLOBAL SCHOOL-BASED STUDENT HEALTH SURVEY。左侧配置 pkl/json/CSV 路径；填写问卷后生成 **回归概率、异常指标、z Score、Precentile、分布定位** 等可视化，结果可选导出。By Deyu UCSD（dew026@ucsd.edu）。")
 
-tab_form, tab_result = st.tabs(["行为问卷输入", "结果与可视化"])
+tab_form, tab_result, tab_batch = st.tabs(["行为问卷输入", "结果与可视化", "批量筛查"])
 
 # ========= 问卷输入 =========
 with tab_form:
@@ -405,7 +371,8 @@ with tab_form:
         info = baseline[c]
         with cols[i % 2]:
             if info["kind"] == "num":
-                lo, hi, default = numeric_bounds(df_all[c])
+                with tracing.span("numeric_bounds"):
+                    lo, hi, default = base_stats.numeric_bounds(c)
                 step = 1.0 if (hi - lo) > 5 else 0.1
                 # 使用中文题干
                 val = st.slider(label_for(c), min_value=float(np.floor(lo)), max_value=float(np.ceil(hi)),
@@ -422,45 +389,176 @@ with tab_form:
     st.caption("如提供文本模型 pkl，此处文本将得到一个“文本风险概率”，再与行为概率加权融合。")
     text_input = st.text_area("输入最近一周的情况（可选）", height=140, placeholder="例：最近作息不规律，晚上刷手机到很晚；上课容易分心……")
     w_behavior = st.slider("融合加权（行为概率权重）", 0.0, 1.0, 0.7, 0.05)
+    student_id = st.text_input("（可选）学生编号：填写后本次结果会记入纵向记录，并显示该生的风险趋势", "").strip()
     submitted = st.button("生成预测与风险图表", type="primary")
 
+# ========= 批量筛查 =========
+with tab_batch:
+    st.subheader("批量筛查：上传多名受访者的问卷导出")
+    st.caption(f"文件需包含模型特征列（共 {len(model_features)} 个，如 {', '.join(model_features[:6])} …），缺失列按缺失值处理；"
+               f"判定阈值与单人结果相同（≥{RISK_WARN:.0%} 预警，≥{RISK_HIGH:.0%} 高风险）。")
+    up = st.file_uploader("上传 CSV / XLS / XLSX", type=["csv", "xls", "xlsx"], key="batch_upload")
+    if up is not None:
+        # 表头每个上传文件只读一次（csv 只读首行），之后的 rerun 直接用 session_state 里的列名
+        if st.session_state.get("batch_upload_columns", (None,))[0] != up.file_id:
+            st.session_state["batch_upload_columns"] = (up.file_id, read_columns(up))
+        upload_cols = st.session_state["batch_upload_columns"][1]
+        score_id = st.selectbox("编号列（原样带到评分结果里，便于对应到学生）",
+                                ["（行号）"] + [c for c in upload_cols if c not in set(model_features)],
+                                key="batch_id_col")
+    if up is not None and st.button("开始批量评分", key="batch_run"):
+        status = st.empty()
+        raw_path = out_path = None
+        try:
+            # 上传与结果都落盘，会话里只保存路径与统计信息，内存不随行数增长
+            raw_path = save_upload(up, suffix=Path(up.name).suffix)
+            with tracing.span("batch_score") as sp:
+                out_path, stats = score_upload(pipe, raw_path, model_features, scorer,
+                                               id_cols=None if score_id == "（行号）" else [score_id],
+                                               progress=lambda n: status.caption(f"已评分 {n} 行…"))
+                sp.set(rows=stats["rows"])
+            prev = st.session_state.get("batch_result")
+            prev_job = get_report_service().get(st.session_state.get("report_job"))
+            if prev is not None and not (prev_job is not None and prev_job.status in ("queued", "parsing")):
+                remove_files(prev["raw_path"], prev["path"])    # 仍在读取旧文件的报告任务结束前保留
+            # 列名随结果一起保存：报告区每次 rerun 直接使用，不再重新解析上传文件
+            st.session_state["batch_result"] = {"name": up.name, "path": out_path, "raw_path": raw_path,
+                                                "stats": stats, "id_col": score_id, "columns": list(upload_cols)}
+        except Exception as e:
+            remove_files(raw_path)
+            print("batch scoring error traceback:\n", traceback.format_exc())
+            st.error(f"批量评分失败：{type(e).__name__}: {e}")
+        status.empty()
+
+    result = st.session_state.get("batch_result")
+    if result is not None and not Path(result["path"]).exists():
+        st.session_state.pop("batch_result")    # 临时文件已过期清理
+        result = None
+    if result is not None:
+        name, stats = result["name"], result["stats"]
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("受访者", f"{stats['rows']}")
+        m2.metric("吞吐（行/秒）", f"{stats['rows_per_sec']:.0f}")
+        m3.metric("🔴 高风险", f"{stats['verdict_counts'].get('high', 0)}")
+        m4.metric("🟡 预警", f"{stats['verdict_counts'].get('warn', 0)}")
+        st.caption(f"{name}：用时 {stats['seconds']:.2f}s。下方仅预览前 200 行，完整结果请下载。")
+        st.dataframe(pd.read_csv(result["path"], nrows=200), use_container_width=True)
+        with open(result["path"], "rb") as f:
+            st.download_button("下载批量评分结果（CSV）", data=f,
+                               file_name=f"{Path(name).stem}_scored.csv", mime="text/csv")
+
+        st.markdown("---")
+        st.subheader("个人报告（HTML，打包为 zip）")
+        st.caption("每名受访者一份：风险仪表盘、z 分数、百分位与 |z| ≥ 2 的异常指标；在后台生成，期间可继续使用本页面。"
+                   "报告可在浏览器中打印为 PDF。")
+        id_options = ["（行号）"] + [c for c in result["columns"] if c not in set(model_features)]
+        id_col = st.selectbox("报告编号列", id_options, key="report_id_col",
+                              index=id_options.index(result["id_col"]) if result["id_col"] in id_options else 0)
+        if st.button("生成个人报告", key="report_run"):
+            # 解析整份上传与构建记录也在后台线程里进行，脚本线程只提交任务
+            records = functools.partial(records_from_upload, result["raw_path"], result["path"],
+                                        list(model_features), None if id_col == "（行号）" else id_col)
+            with tracing.span("report_submit", rows=stats["rows"]):
+                st.session_state["report_job"] = get_report_service().submit(
+                    records, base_stats, labels={c: label_for(c) for c in model_features}, title=Path(name).stem)
+        job_id = st.session_state.get("report_job")
+        if job_id is not None:
+            job = get_report_service().get(job_id)
+            if job is not None and job.finished is None:
+                report_progress_live(job_id)
+            else:
+                show_report_job(job)
+
+# ========= 行为模型后端选择 =========
+with tab_result:
+    chosen_backends = st.multiselect("行为模型后端（多选时取各后端概率的平均作为集成结果）", backend_names,
+                                     default=[primary_backend], format_func=backend_label)
+    chosen_backends = chosen_backends or [primary_backend]
+    # 选中即加载（序列模型加载时已做预热），提交时不再承担首次调用开销
+    for name in chosen_backends:
+        if get_backend(name) is None:
+            st.stop()
+
 # ========= 预测与可视化 =========
+# 最近一次提交保存在 session_state：之后调整融合权重、切换后端、展开图表引起的 rerun 继续显示结果，
+# 模型输出走结果缓存（只重算融合），纵向记录只在真正点击提交时写入。
 if submitted:
+    st.session_state["last_submission"] = {"input": dict(user_input), "text": text_input, "student_id": student_id,
+                                           "figs": {}}
+sub = st.session_state.get("last_submission")
+if sub is not None:
+    # 只有生成结果时才需要画图：plotly 在这里第一次导入
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    result_cache = get_result_cache()
+    sub_input, sub_text = sub["input"], sub["text"]
     with tab_result:
         st.subheader("预测结果")
-        X_one = pd.DataFrame([{c: user_input.get(c, np.nan) for c in model_features}])
-        try:
-            proba_behavior = float(pipe.predict_proba(X_one)[0, 1])
-        except Exception as e:
-            st.error(f"行为概率计算失败：{e}")
+        if not submitted and feature_key("", user_input, feats_present) != feature_key("", sub_input, feats_present):
+            st.info("问卷已修改：下方仍是上一次提交的结果，点击“生成预测与风险图表”更新。")
+        latency_rows, probas = [], []
+        for name in chosen_backends:
+            m = get_backend(name)
+            feats = list(getattr(m, "features", None) or model_features)
+            key = feature_key(model_file_id(backend_path(name)), sub_input, feats)
+            try:
+                with tracing.span("predict_behavior", backend=backend_label(name)) as sp:
+                    t0 = time.perf_counter()
+                    X_one = pd.DataFrame([{c: sub_input.get(c, np.nan) for c in feats}])
+                    p, hit = result_cache.get_or_compute(key, lambda: float(m.predict_proba(X_one)[0, 1]))
+                    ms = (time.perf_counter() - t0) * 1000.0
+                    sp.set(cache="hit" if hit else "miss", ms_model=ms)
+            except Exception as e:
+                st.warning(f"{backend_label(name)} 计算失败：{e}")
+                continue
+            probas.append(p)
+            encoder = getattr(m, "encoder", None)
+            unknown = encoder.unknown_columns(sub_input) if encoder is not None else []
+            if unknown:
+                st.warning(f"{backend_label(name)}：{', '.join(unknown)} 的取值不在训练时的类别中，已按缺失处理。")
+            warm = getattr(m, "warmup_ms", None)
+            latency_rows.append({"后端": backend_label(name), "风险概率": round(p, 4), "推理耗时 (ms)": round(ms, 2),
+                                 "缓存": "命中" if hit else "计算",
+                                 "加载预热 (ms)": None if warm is None else round(warm, 1)})
+        if not probas:
+            st.error("行为概率计算失败：所选后端均不可用")
             st.stop()
+        proba_behavior = float(np.mean(probas))
+        if len(latency_rows) > 1:
+            st.caption(f"行为概率为 {len(latency_rows)} 个后端的平均（集成）。")
+        st.dataframe(pd.DataFrame(latency_rows), use_container_width=True, hide_index=True)
 
         proba_text = None
-        if text_model_path and Path(text_model_path).exists() and text_input.strip():
+        if text_model_path and Path(text_model_path).exists() and sub_text.strip():
             try:
-                if _joblib is not None:
-                    pipe_text = _joblib.load(text_model_path)
-                else:
-                    with open(text_model_path, "rb") as f:
-                        pipe_text = _pickle.load(f)
-                proba_text = float(pipe_text.predict_proba(pd.Series([text_input]))[0, 1])
+                def run_text_model():
+                    if registry is not None and text_name:
+                        with tracing.span("text_model_load", cache="hit" if registry.is_loaded(text_name) else "miss"):
+                            pipe_text = registry.get(text_name).model
+                    else:
+                        pipe_text = get_text_model(text_model_path, os.path.getmtime(text_model_path))
+                    # 模型输入与缓存键用同一份规范化文本，保证命中时结果与重算一致
+                    return float(predict_text_proba(pipe_text, [normalize_text(sub_text)])[0])
+                with tracing.span("predict_text") as sp:
+                    proba_text, hit = result_cache.get_or_compute(
+                        text_key(model_file_id(text_model_path), sub_text), run_text_model)
+                    sp.set(cache="hit" if hit else "miss")
             except Exception as e:
                 st.warning(f"文本模型不可用：{e}")
+        cs = result_cache.stats()
+        if cs["hit_rate"] is not None:
+            st.caption(f"结果缓存：命中率 {cs['hit_rate']:.0%}（命中 {cs['hits']} / 查询 {cs['hits'] + cs['misses']}，"
+                       f"条目 {cs['entries']}/{cs['max_entries']}）")
 
+        proba_final = fuse(proba_behavior, proba_text, w_behavior)
         if proba_text is not None:
             w_text = 1.0 - w_behavior
-            proba_final = w_behavior * proba_behavior + w_text * proba_text
             st.caption(f"融合概率 = 行为 {w_behavior:.2f} × {proba_behavior:.3f} + 文本 {w_text:.2f} × {proba_text:.3f}")
         else:
-            proba_final = proba_behavior
             st.caption("未提供文本模型或文本为空：仅使用行为概率。")
 
-        if proba_final >= 0.6:
-            verdict = "🔴 高风险（建议尽快联系专业人士/学校心理中心）"
-        elif proba_final >= 0.3:
-            verdict = "🟡 预警（建议进行线上随访或干预）"
-        else:
-            verdict = "🟢 安全（建议维持良好作息与支持）"
+        verdict = verdict_text(proba_final)
 
         g = go.Figure(go.Indicator(
             mode="gauge+number",
@@ -478,39 +576,68 @@ if submitted:
             },
             title={'text': "总体风险概率"}
         ))
-        st.plotly_chart(g, use_container_width=True)
+        show_chart(g, "gauge")
         st.success(f"判定：{verdict}")
 
+        sid = sub["student_id"]
+        if sid:
+            st.markdown("---")
+            st.subheader(f"纵向趋势 · 学生 {sid}")
+            try:
+                store = get_history_store(history_db)
+                if submitted:
+                    trend = store.record(sid, proba_final, proba_behavior=proba_behavior,
+                                         proba_text=proba_text, w_behavior=w_behavior)
+                else:
+                    trend = store.stats(sid)
+                t1, t2, t3, t4 = st.columns(4)
+                t1.metric("累计筛查次数", f"{trend['n']}")
+                t2.metric("风险 EWMA", f"{trend['ewma']*100:.1f}%")
+                t3.metric(f"本周均值（{trend['week']}）", f"{trend['week_mean']*100:.1f}%",
+                          delta=None if trend["wow_delta"] is None else f"{trend['wow_delta']*100:+.1f}%",
+                          delta_color="inverse")
+                band_days = {b: v / 86400.0 for b, v in trend["time_in_band"].items()}
+                t4.metric("处于预警/高风险（天）", f"{band_days['warn']:.1f} / {band_days['high']:.1f}")
+                hist = store.history(sid)
+                if len(hist) > 1:
+                    figt = px.line(hist, x="time", y="proba_final", markers=True, range_y=[0, 1],
+                                   title="融合风险概率（最近记录）")
+                    figt.add_hrect(y0=RISK_WARN, y1=RISK_HIGH, fillcolor="#FFF9C4", opacity=0.4, line_width=0)
+                    figt.add_hrect(y0=RISK_HIGH, y1=1.0, fillcolor="#FFEBEE", opacity=0.4, line_width=0)
+                    show_chart(figt, "trend")
+                else:
+                    st.caption("这是该生的第一条记录；再次筛查后将显示趋势线。")
+            except Exception as e:
+                print("history store error traceback:\n", traceback.format_exc())
+                st.warning(f"纵向记录不可用：{type(e).__name__}: {e}")
+
         st.markdown("---")
         st.subheader("个体位置 · 偏差与百分位")
 
-        rows = []
-        for c in feats_present:
-            info = baseline[c]
-            val = user_input.get(c, None)
-            if val is None or (isinstance(val, float) and not np.isfinite(val)):
-                continue
-            if info["kind"] == "num":
-                mu, sd = info.get("mean"), info.get("std")
-                z = zscore(float(val), mu, sd)
-                pct = empirical_percentile(float(val), info.get("quantiles", {}))
-                rows.append({"feature": c, "value": val, "mean": mu, "std": sd, "z": z, "percentile": pct})
-        rep = pd.DataFrame(rows).sort_values("z", key=lambda s: np.abs(s), ascending=False)
+        # 向量化：一次计算全部数值特征的 z 分数与百分位；偏差报告与下面的图只取决于提交内容，每次提交只构建一次
+        figs = sub["figs"]
+        if "rep" not in figs:
+            with tracing.span("deviation_report"):
+                figs["rep"] = scorer.report({c: sub_input.get(c) for c in feats_present if baseline[c]["kind"] == "num"})
+        rep = figs["rep"].copy()
 
         if rep.empty:
             st.info("暂无可计算 z 分数的数值型特征（可能全部为分类题）。")
         else:
             topK = min(15, len(rep))
-            fig = px.bar(rep.head(topK), x="z", y="feature", orientation="h",
-                         color=rep.head(topK)["z"].apply(lambda v: "高于均值" if v>=0 else "低于均值"),
-                         color_discrete_map={"高于均值":"#EF553B", "低于均值":"#00CC96"},
-                         title=f"行为指标 z 分数（Top {topK} |z|）")
-            fig.update_layout(yaxis=dict(title="特征"), xaxis=dict(title="z 分数"))
-            st.plotly_chart(fig, use_container_width=True)
-
-            fig2 = px.bar(rep.head(topK), x="percentile", y="feature", orientation="h",
-                          range_x=[0,100], title="行为指标百分位（Top 影响项）")
-            st.plotly_chart(fig2, use_container_width=True)
+            if "zscore_bar" not in figs:
+                fig = px.bar(rep.head(topK), x="z", y="feature", orientation="h",
+                             color=rep.head(topK)["z"].apply(lambda v: "高于均值" if v>=0 else "低于均值"),
+                             color_discrete_map={"高于均值":"#EF553B", "低于均值":"#00CC96"},
+                             title=f"行为指标 z 分数（Top {topK} |z|）")
+                fig.update_layout(yaxis=dict(title="特征"), xaxis=dict(title="z 分数"))
+                figs["zscore_bar"] = fig
+            show_chart(figs["zscore_bar"], "zscore_bar")
+
+            if "percentile_bar" not in figs:
+                figs["percentile_bar"] = px.bar(rep.head(topK), x="percentile", y="feature", orientation="h",
+                                                range_x=[0,100], title="行为指标百分位（Top 影响项）")
+            show_chart(figs["percentile_bar"], "percentile_bar")
 
             rep["abs_z"] = rep["z"].abs()
             flagged = rep[rep["abs_z"] >= 2].copy()
@@ -527,12 +654,18 @@ if submitted:
             cols3 = st.columns(3)
             for i, c in enumerate(pick):
                 with cols3[i%3]:
-                    x = pd.to_numeric(df_all[c], errors="coerce")
-                    figd = px.histogram(x.dropna(), nbins=30, title=c)
-                    v = user_input.get(c, None)
-                    if v is not None and np.isfinite(float(v)):
-                        figd.add_vline(x=float(v), line_color="red")
-                    st.plotly_chart(figd, use_container_width=True)
+                    if f"hist_{c}" not in figs:
+                        # 预聚合的 30 个区间（基线构建时算好），图表数据量与人群规模无关
+                        counts, edges = base_stats.histogram(c)
+                        figd = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges),
+                                                marker_line_width=0))
+                        figd.update_layout(title=c, bargap=0, showlegend=False,
+                                           xaxis=dict(title=c), yaxis=dict(title="count"))
+                        v = sub_input.get(c, None)
+                        if v is not None and np.isfinite(float(v)):
+                            figd.add_vline(x=float(v), line_color="red")
+                        figs[f"hist_{c}"] = figd
+                    show_chart(figs[f"hist_{c}"], f"hist_{c}")
 
         if proba_text is not None:
             st.markdown("---")
@@ -545,3 +678,18 @@ if submitted:
         if rep is not None and not rep.empty:
             csv = rep.to_csv(index=False).encode("utf-8")
             st.download_button("下载个人偏差报告（CSV）", data=csv, file_name="individual_deviation_report.csv", mime="text/csv")
+
+# ========= 性能诊断（侧边栏，可选） =========
+run = tracing.end_run()
+if run is not None:
+    with st.sidebar.expander("⏱ 性能诊断", expanded=True):
+        rss = "—" if run.rss_end is None else f"{run.rss_end / 2**20:.0f} MB"
+        st.caption(f"本次运行 {run.total_ms:.0f} ms · 进程内存 {rss}")
+        summary = pd.DataFrame(run.summary())
+        if not summary.empty:
+            st.dataframe(summary.sort_values("total_ms", ascending=False).round(2),
+                         use_container_width=True, hide_index=True)
+        st.download_button("下载本次记录（JSONL）", data=tracing.log_lines(run).encode("utf-8"),
+                           file_name="trace.jsonl", mime="application/json")
+        st.download_button("下载累计指标（Prometheus）", data=tracing.prometheus_text().encode("utf-8"),
+                           file_name="deyu_metrics.prom", mime="text/plain")
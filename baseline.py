@@ -0,0 +1,246 @@
+# baseline.py — 人群基线（均值/标准差/1–99 分位/分布直方图/分类选项/滑块范围）的构建与持久化
+#
+# 一次向量化遍历特征矩阵得到全部统计量，保存为与模型 pkl/meta json 并列的 .npz 产物：
+#   python baseline.py --data CNAH2003_public_use.xls --meta svm_pca_behavior_meta.json
+# 产物记录数据集 sha1 与特征列表；app 启动时直接加载，二者不匹配时才在进程内重新计算。
+# 新一批问卷可用 sketch.py 的可合并摘要增量并入（python sketch.py fold --wave ...），不必重算全量。
+import argparse
+import json
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BASELINE_VERSION = 2
+QUANTILE_GRID = np.arange(1, 100)          # 1..99
+HIST_BINS = 30
+MAX_CHOICES = 50
+
+
+class Baseline:
+    """
+    数值特征按 num_features 顺序存成矩阵：
+    - mean/std: [F]，quantiles: [F, 99]，bounds: [F, 3]（lo, hi, default，对应 numeric_bounds）
+    - hist_counts: [F, 30]，hist_edges: [F, 31]（分布定位图用的预聚合直方图）
+    分类特征只保存 choices（按频数降序，最多 50 个）。
+    """
+
+    def __init__(self, features, num_features, mean, std, quantiles, bounds, choices,
+                 dataset_sha1=None, requested_features=None, hist_counts=None, hist_edges=None):
+        self.features = list(features)
+        self.requested_features = list(requested_features if requested_features is not None else features)
+        self.num_features = list(num_features)
+        self.mean = np.asarray(mean, dtype=float)
+        self.std = np.asarray(std, dtype=float)
+        self.quantiles = np.asarray(quantiles, dtype=float).reshape(len(self.num_features), len(QUANTILE_GRID))
+        self.bounds = np.asarray(bounds, dtype=float).reshape(len(self.num_features), 3)
+        F = len(self.num_features)
+        self.hist_counts = (np.zeros((F, HIST_BINS), dtype=np.int64) if hist_counts is None
+                            else np.asarray(hist_counts, dtype=np.int64).reshape(F, -1))
+        self.hist_edges = (np.tile(np.linspace(0.0, 1.0, HIST_BINS + 1), (F, 1)) if hist_edges is None
+                           else np.asarray(hist_edges, dtype=float).reshape(F, -1))
+        self.choices = dict(choices)
+        self.dataset_sha1 = dataset_sha1
+        self._num_index = {c: i for i, c in enumerate(self.num_features)}
+
+    def kind(self, c):
+        if c in self._num_index:
+            return "num"
+        if c in self.choices:
+            return "cat"
+        return None
+
+    def __contains__(self, c):
+        return self.kind(c) is not None
+
+    def numeric_bounds(self, c):
+        lo, hi, default = self.bounds[self._num_index[c]]
+        return float(lo), float(hi), float(default)
+
+    def histogram(self, c):
+        """(counts[30], edges[31])：与 np.histogram(x, bins=30) 相同，缺失值不计入。"""
+        i = self._num_index[c]
+        return self.hist_counts[i], self.hist_edges[i]
+
+    def as_dict(self):
+        """旧版 compute_baseline 的字典结构：{col: {"kind", "mean", "std", "quantiles"} | {"kind", "choices"}}。"""
+        base = {}
+        for c in self.features:
+            if c in self._num_index:
+                i = self._num_index[c]
+                qs = {int(q): float(v) for q, v in zip(QUANTILE_GRID, self.quantiles[i])}
+                base[c] = {"kind": "num", "mean": float(self.mean[i]), "std": float(self.std[i]), "quantiles": qs}
+            elif c in self.choices:
+                base[c] = {"kind": "cat", "choices": list(self.choices[c])}
+        return base
+
+
+# ========= 构建 =========
+def build_baseline(df, features: list, dataset_sha1=None) -> Baseline:
+    """df：pandas.DataFrame 或 dataset.ReferencePopulation（紧凑的参照人群，结果相同）。"""
+    if hasattr(df, "numeric_matrix"):
+        return _build_from_population(df, features, dataset_sha1)
+    feats_present = [c for c in features if c in df.columns]
+    num_features = [c for c in feats_present if df[c].dtype.kind in "biufc"]
+    choices = {}
+    for c in feats_present:
+        if c not in num_features:
+            vals = df[c].dropna().astype(str).value_counts().index.tolist()
+            choices[c] = vals[:MAX_CHOICES]
+    X = df[num_features].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float) if num_features else None
+    return _build(feats_present, num_features, X, choices, features, dataset_sha1)
+
+
+def _build_from_population(pop, features, dataset_sha1=None) -> Baseline:
+    feats_present = [c for c in features if c in pop]
+    num_features = [c for c in feats_present if c in set(pop.numeric_features)]
+    choices = {c: pop.choices(c, MAX_CHOICES) for c in feats_present if c not in num_features}
+    X = pop.numeric_matrix(num_features) if num_features else None
+    return _build(feats_present, num_features, X, choices, features, dataset_sha1 or pop.dataset_sha1)
+
+
+def _build(feats_present, num_features, X, choices, features, dataset_sha1) -> Baseline:
+    F = len(num_features)
+    if F == 0:
+        empty = np.zeros((0,))
+        return Baseline(feats_present, [], empty, empty, np.zeros((0, 99)), np.zeros((0, 3)), choices,
+                        dataset_sha1, features, np.zeros((0, HIST_BINS)), np.zeros((0, HIST_BINS + 1)))
+
+    X[~np.isfinite(X)] = np.nan
+    with warnings.catch_warnings():
+        # 全空列会触发 "All-NaN slice" / "Mean of empty slice"，结果按 NaN 处理
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(X, axis=0)
+        std = np.nanstd(X, axis=0)
+        quantiles = np.nanpercentile(X, QUANTILE_GRID, axis=0).T      # [F, 99]，一次排序得到全部分位
+        median = np.nanmedian(X, axis=0)
+        vmin, vmax = np.nanmin(X, axis=0), np.nanmax(X, axis=0)
+
+    bounds = slider_bounds(quantiles, mean, median, vmin, vmax, np.isnan(X).all(axis=0))
+    hist_counts, hist_edges = _histograms(X, vmin, vmax)
+
+    return Baseline(feats_present, num_features, mean, std, quantiles, bounds, choices, dataset_sha1, features,
+                    hist_counts, hist_edges)
+
+
+def slider_bounds(quantiles, mean, median, vmin, vmax, empty_col):
+    """[F, 3]（lo, hi, default）。与原 numeric_bounds 相同的规则：1/99 分位作为滑块范围，均值作为默认值。"""
+    lo, hi = quantiles[:, 0].copy(), quantiles[:, -1].copy()
+    bad = ~np.isfinite(lo) | ~np.isfinite(hi) | (lo >= hi)
+    lo[bad], hi[bad] = vmin[bad], vmax[bad]
+    default = np.where(np.isfinite(mean), mean, median)
+    default = np.where(np.isfinite(default), default, (lo + hi) / 2.0)
+    lo[empty_col], hi[empty_col], default[empty_col] = 0.0, 1.0, 0.5
+    return np.stack([lo, hi, default], axis=1)
+
+
+def histogram_edges(vmin, vmax, bins=HIST_BINS):
+    """[F, bins+1]：范围取 [min, max]，常数列取 [v-0.5, v+0.5]，全空列取 [0, 1]。"""
+    lo, hi = np.array(vmin, dtype=float), np.array(vmax, dtype=float)
+    empty_col = ~np.isfinite(lo)
+    lo[empty_col], hi[empty_col] = 0.0, 1.0
+    const = lo == hi
+    lo[const] -= 0.5
+    hi[const] += 0.5
+    return np.linspace(lo, hi, bins + 1, axis=1)
+
+
+def _histograms(X, vmin, vmax, bins=HIST_BINS):
+    """
+    所有列一次 bincount 得到等宽直方图，结果与逐列 np.histogram(col, bins) 相同：
+    最后一个区间为闭区间；全空列为 [0, 1] 上的零计数。
+    """
+    F = X.shape[1]
+    edges = histogram_edges(vmin, vmax, bins)                    # [F, bins+1]
+    lo, hi = edges[:, 0], edges[:, -1]
+
+    ok = ~np.isnan(X)
+    # 与 np.histogram 相同：先按比例算出区间号，再用边界修正浮点误差
+    idx = np.floor((X - lo) / (hi - lo) * bins)
+    idx = np.where(ok, idx, 0).astype(np.int64)
+    idx = np.clip(idx, 0, bins - 1)
+    cols = np.broadcast_to(np.arange(F), X.shape)
+    Xf = np.where(ok, X, 0.0)
+    idx[(Xf < edges[cols, idx]) & (idx > 0)] -= 1
+    up = np.minimum(idx + 1, bins)
+    idx[(Xf >= edges[cols, up]) & (idx < bins - 1)] += 1
+    flat = (idx + cols * bins)[ok]
+    counts = np.bincount(flat, minlength=F * bins).reshape(F, bins)
+    return counts, edges
+
+
+# ========= 持久化 =========
+def artifact_path_for(meta_path) -> Path:
+    """svm_pca_behavior_meta.json → svm_pca_behavior_baseline.npz（与模型文件放在一起）。"""
+    p = Path(meta_path)
+    stem = p.stem[:-len("_meta")] if p.stem.endswith("_meta") else p.stem
+    return p.with_name(f"{stem}_baseline.npz")
+
+
+def save_baseline(baseline: Baseline, path):
+    header = {
+        "version": BASELINE_VERSION,
+        "dataset_sha1": baseline.dataset_sha1,
+        "requested_features": baseline.requested_features,
+        "features": baseline.features,
+        "num_features": baseline.num_features,
+        "choices": baseline.choices,
+    }
+    path = Path(path)
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp.npz")
+    np.savez(tmp,
+             header=np.array(json.dumps(header, ensure_ascii=False)),
+             mean=baseline.mean, std=baseline.std,
+             quantiles=baseline.quantiles, bounds=baseline.bounds,
+             hist_counts=baseline.hist_counts, hist_edges=baseline.hist_edges)
+    os.replace(tmp, path)
+
+
+def load_baseline(path, dataset_sha1=None, features=None):
+    """
+    读取基线产物；文件不存在、版本不符、数据集 sha1 或特征列表不匹配时返回 None（由调用方回退到现算）。
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            header = json.loads(str(z["header"]))
+            if header.get("version") != BASELINE_VERSION:
+                return None
+            if dataset_sha1 is not None and header.get("dataset_sha1") != dataset_sha1:
+                return None
+            if features is not None and list(features) != header.get("requested_features"):
+                return None
+            return Baseline(header["features"], header["num_features"],
+                            z["mean"], z["std"], z["quantiles"], z["bounds"],
+                            header["choices"], header.get("dataset_sha1"), header.get("requested_features"),
+                            z["hist_counts"], z["hist_edges"])
+    except Exception as e:
+        print(f"load_baseline: 无法读取 {path}：{type(e).__name__}: {e}")
+        return None
+
+
+# ========= CLI：离线构建产物 =========
+def main(argv=None):
+    from dataset import file_fingerprint, load_population
+
+    ap = argparse.ArgumentParser(description="构建人群基线产物（.npz）")
+    ap.add_argument("--data", default="CNAH2003_public_use.xls")
+    ap.add_argument("--meta", default="svm_pca_behavior_meta.json")
+    ap.add_argument("--out", default=None, help="默认与 meta json 同目录：*_baseline.npz")
+    args = ap.parse_args(argv)
+
+    with open(args.meta, "r", encoding="utf-8") as f:
+        features = json.load(f).get("features", [])
+    pop = load_population(args.data, features)
+    b = build_baseline(pop, features, dataset_sha1=file_fingerprint(args.data))
+    out = Path(args.out) if args.out else artifact_path_for(args.meta)
+    save_baseline(b, out)
+    print(f"已保存基线产物：{out}（数值特征 {len(b.num_features)}，分类特征 {len(b.choices)}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# batch.py — 批量筛查：一次上传整班/整校的问卷导出，分块向量化评分
+#
+# 用法（命令行）：
+#   python batch.py class_export.csv -o scored.csv
+# 或在代码中：
+#   from batch import score_file
+#   stats = score_file(pipe, "class_export.csv", model_features, scorer, out="scored.csv")
+#
+# csv 按 chunksize 流式读取、逐块 predict_proba 并追加写出，内存占用与文件行数无关；
+# xls/xlsx 无法流式解析，整表读入后再分块评分。
+# app 里上传文件与评分结果都落到 .cache/batch/ 下的临时文件，会话里只保存路径与统计信息；
+# 超过 BATCH_TTL 秒的临时文件在下次评分时清理。
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import CACHE_DIR as _DATASET_CACHE_DIR
+from dataset import sniff_format
+from scoring import verdict_level
+
+DEFAULT_CHUNKSIZE = 5000
+FLAG_Z = 2.0   # 与结果页「异常指标（|z| ≥ 2）」一致
+BATCH_DIR = _DATASET_CACHE_DIR.parent / "batch"
+BATCH_TTL = 24 * 3600
+
+
+def _open_source(source):
+    """路径或上传的文件对象 → (可读对象, 格式)。"""
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f:
+            head = f.read(4096)
+        return source, sniff_format(head)
+    head = source.read(4096)
+    source.seek(0)
+    if isinstance(head, str):
+        head = head.encode("utf-8", errors="ignore")
+    return source, sniff_format(head)
+
+
+def iter_chunks(source, chunksize=DEFAULT_CHUNKSIZE):
+    """按块产出 DataFrame；保留原始列（评分时再按模型特征取列）。"""
+    src, fmt = _open_source(source)
+    if fmt in ("xls", "xlsx"):
+        engine = "xlrd" if fmt == "xls" else "openpyxl"
+        df = pd.read_excel(src, engine=engine)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+        return
+    # csv（或无法识别的文本）：流式读取
+    with pd.read_csv(src, chunksize=chunksize, low_memory=False) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def read_columns(source):
+    """只读表头：csv 用 nrows=0，xls/xlsx 只解析首行（不构建整表 DataFrame）。"""
+    src, fmt = _open_source(source)
+    if fmt in ("xls", "xlsx"):
+        engine = "xlrd" if fmt == "xls" else "openpyxl"
+        return list(pd.read_excel(src, engine=engine, nrows=0).columns)
+    return list(pd.read_csv(src, nrows=0).columns)
+
+
+def model_input(df: pd.DataFrame, model_features, scorer) -> pd.DataFrame:
+    """
+    模型输入：按模型特征取列，数值特征（scorer.features）统一转成数字，与 ScoringCore 相同。
+    学校导出里零星的文字、带空格的空白单元格记为缺失（由管道内的 imputer 填充），不会让整块评分失败。
+    """
+    X = df.reindex(columns=list(model_features))
+    for c in scorer.features:
+        if c in X.columns:
+            X[c] = pd.to_numeric(X[c], errors="coerce")
+    return X
+
+
+def score_frame(pipe, df: pd.DataFrame, model_features, scorer, id_cols=None) -> pd.DataFrame:
+    """
+    对一个 DataFrame 评分：行为概率、判定等级、最大 |z|、异常项个数，以及每个数值特征的 z / 百分位。
+    缺失的模型特征按缺失值处理（由管道内的 imputer 填充）。
+    """
+    X = model_input(df, model_features, scorer)
+    proba = pipe.predict_proba(X)[:, 1]
+    z, pct = scorer.score(scorer.matrix(df))
+    abs_z = np.abs(z)
+    with np.errstate(invalid="ignore"):
+        n_flagged = (abs_z >= FLAG_Z).sum(axis=1)
+    max_abs_z = np.full(len(df), np.nan)
+    has_z = np.isfinite(abs_z).any(axis=1)
+    if has_z.any():
+        max_abs_z[has_z] = np.nanmax(abs_z[has_z], axis=1)
+
+    cols = {}
+    for c in (id_cols or []):
+        if c in df.columns:
+            cols[c] = df[c].to_numpy()
+    cols["proba_behavior"] = proba
+    cols["verdict"] = verdict_level(proba)
+    cols["max_abs_z"] = max_abs_z
+    cols["n_flagged"] = n_flagged
+    for j, c in enumerate(scorer.features):
+        cols[f"z_{c}"] = z[:, j]
+    for j, c in enumerate(scorer.features):
+        cols[f"pct_{c}"] = pct[:, j]
+    return pd.DataFrame(cols, index=df.index)
+
+
+def score_file(pipe, source, model_features, scorer, out=None, chunksize=DEFAULT_CHUNKSIZE,
+               id_cols=None, progress=None):
+    """
+    分块评分整份文件。
+    - out: 输出 csv 路径或可写文本对象；None 时把结果拼成 DataFrame 放在返回值的 "result" 里（只适合小文件）。
+    - progress: 可选回调 progress(rows_done)，每块结束时调用一次。
+    返回统计信息 dict：rows / seconds / rows_per_sec / verdict_counts（以及 result）。
+    """
+    t0 = time.perf_counter()
+    rows = 0
+    counts = {"high": 0, "warn": 0, "safe": 0}
+    parts = []
+    sink = None
+    own_sink = False
+    if out is not None:
+        if hasattr(out, "write"):
+            sink = out
+        else:
+            sink = open(out, "w", encoding="utf-8", newline="")
+            own_sink = True
+    try:
+        for chunk in iter_chunks(source, chunksize=chunksize):
+            res = score_frame(pipe, chunk, model_features, scorer, id_cols=id_cols)
+            res.insert(0, "row", np.arange(rows, rows + len(res)))
+            for k, v in res["verdict"].value_counts().items():
+                counts[k] = counts.get(k, 0) + int(v)
+            if sink is not None:
+                res.to_csv(sink, index=False, header=(rows == 0))
+            else:
+                parts.append(res)
+            rows += len(res)
+            if progress is not None:
+                progress(rows)
+    finally:
+        if own_sink:
+            sink.close()
+
+    seconds = time.perf_counter() - t0
+    stats = {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds > 0 else float("nan"),
+        "verdict_counts": counts,
+    }
+    if sink is None:
+        stats["result"] = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    return stats
+
+
+def _temp_file(suffix):
+    """BATCH_DIR 下的临时文件（delete=False，由调用方删除）；顺带清理过期的旧文件。"""
+    BATCH_DIR.mkdir(parents=True, exist_ok=True)
+    cutoff = time.time() - BATCH_TTL
+    for old in BATCH_DIR.glob("deyu_batch_*"):
+        try:
+            if old.stat().st_mtime < cutoff:
+                old.unlink()
+        except OSError:
+            pass
+    return tempfile.NamedTemporaryFile("wb", prefix="deyu_batch_", suffix=suffix, dir=BATCH_DIR, delete=False)
+
+
+def save_upload(upload, suffix="") -> str:
+    """把上传的文件对象复制到临时文件，返回路径（之后的评分、报告都从磁盘读取）。"""
+    upload.seek(0)
+    with _temp_file(suffix) as f:
+        shutil.copyfileobj(upload, f)
+    return f.name
+
+
+def score_upload(pipe, source, model_features, scorer, chunksize=DEFAULT_CHUNKSIZE, id_cols=None, progress=None):
+    """
+    上传文件（路径或文件对象）→ (结果 csv 的临时文件路径, 统计信息)。
+    结果逐块写盘，内存占用与行数无关；文件由调用方删除。
+    """
+    with _temp_file(".csv") as f:
+        path = f.name
+    try:
+        stats = score_file(pipe, source, model_features, scorer, out=path,
+                           chunksize=chunksize, id_cols=id_cols, progress=progress)
+    except BaseException:
+        remove_files(path)
+        raise
+    return path, stats
+
+
+def remove_files(*paths):
+    for p in paths:
+        if p:
+            try:
+                os.unlink(p)
+            except OSError:
+                pass
+
+
+# ========= CLI =========
+def main(argv=None):
+    from baseline import artifact_path_for, load_baseline
+    from compiled_model import load_serving_model
+    from scoring import DeviationScorer
+
+    ap = argparse.ArgumentParser(description="批量筛查：对 csv/xls 中的全部受访者评分")
+    ap.add_argument("source")
+    ap.add_argument("-o", "--out", required=True, help="输出 csv 路径")
+    ap.add_argument("--model", default="svm_pca_behavior_pipeline.pkl")
+    ap.add_argument("--meta", default="svm_pca_behavior_meta.json")
+    ap.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    ap.add_argument("--id-col", action="append", default=[], help="原样带到输出里的标识列，可重复")
+    args = ap.parse_args(argv)
+
+    with open(args.meta, "r", encoding="utf-8") as f:
+        model_features = json.load(f).get("features", [])
+    base = load_baseline(artifact_path_for(args.meta))
+    if base is None:
+        raise SystemExit(f"未找到基线产物，请先运行 python baseline.py --meta {args.meta}")
+    pipe = load_serving_model(args.model)
+    stats = score_file(pipe, args.source, model_features, DeviationScorer(base), out=args.out,
+                       chunksize=args.chunksize, id_cols=args.id_col)
+    print(f"完成：{stats['rows']} 行，用时 {stats['seconds']:.2f}s，"
+          f"{stats['rows_per_sec']:.0f} 行/秒；判定分布 {stats['verdict_counts']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+# bench.py — 各阶段性能基准（无界面，可在 CI / 开发机上复现）
+#
+# 覆盖：数据集解析与缓存读取、参照人群构建/mmap 加载（含常驻字节数）、基线构建/加载、行为模型加载与推理、偏差评分、
+#       文本模型加载与批量打分、日记语料解析、Plotly 图表构建与序列化。
+# 数据：仓库自带的 CNAH2003_public_use.xls / svm_pca_behavior_pipeline.pkl / 日记样本，
+#       以及按行复制放大的合成副本（--scales 1,10,100）。
+#
+#   python bench.py --out bench_results.json
+#   python bench.py --compare old.json --out new.json     # p50 变慢超过 --threshold 倍时退出码为 1
+#   python bench.py --import-check                         # app 顶层导入耗时超出预算或提前导入重依赖时退出码为 1
+#   python -m pytest -q test_startup.py                    # 同一检查的测试版本（预算与推迟导入两项断言）
+#
+# 每个阶段报告 p50/p90/p99/均值延迟（ms）、吞吐（行/秒）与阶段内峰值 RSS（MB）。
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_DATA = ROOT / "CNAH2003_public_use.xls"
+DEFAULT_MODEL = ROOT / "svm_pca_behavior_pipeline.pkl"
+DEFAULT_META = ROOT / "svm_pca_behavior_meta.json"
+DEFAULT_DIARY = ROOT / "calendar_text_samples_zh (1).txt"
+APP_PATH = ROOT / "app_V3.py"
+
+# app 冷启动导入预算（ms，子进程中执行 app_V3.py 顶层全部 import 语句的中位数耗时）
+IMPORT_BUDGET_MS = float(os.environ.get("DEYU_IMPORT_BUDGET_MS", "1200"))
+# 这些包只能在用到的分支里导入，启动阶段出现在 sys.modules 里即视为回归
+# （streamlit 自身为注册图表主题会导入 plotly / plotly.graph_objects，所以只检查 plotly.express）
+DEFERRED_MODULES = ("sklearn", "plotly.express", "joblib", "scipy", "torch")
+
+
+# ========= 内存采样 =========
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return r / 2**20 if sys.platform == "darwin" else r / 1024
+
+
+class RssSampler:
+    """阶段执行期间每隔 interval 秒采样一次 RSS，记录峰值。"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+
+def measure(fn, repeats, warmup=1):
+    """运行 fn 若干次；返回 (每次耗时 ms 的数组, 阶段峰值 RSS MB, 最后一次返回值)。"""
+    out = None
+    for _ in range(warmup):
+        out = fn()
+    times = []
+    with RssSampler() as rss:
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            out = fn()
+            times.append((time.perf_counter() - t0) * 1000.0)
+    return np.asarray(times), rss.peak, out
+
+
+def summarize(stage, scale, times, peak_rss, rows=None):
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    mean = float(times.mean())
+    return {
+        "stage": stage,
+        "scale": scale,
+        "rows": rows,
+        "repeats": int(len(times)),
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p99_ms": float(p99),
+        "mean_ms": mean,
+        "throughput_rows_per_s": (rows / (mean / 1000.0)) if rows and mean > 0 else None,
+        "peak_rss_mb": float(peak_rss),
+    }
+
+
+# ========= 测试数据 =========
+def make_scaled_copies(data_path, scales, workdir):
+    """按行复制放大数据集（写成 csv）；scale=1 直接使用原文件。"""
+    from dataset import read_source
+
+    base = read_source(str(data_path))
+    paths = {}
+    for s in scales:
+        if s == 1:
+            paths[s] = Path(data_path)
+            continue
+        p = Path(workdir) / f"dataset_x{s}.csv"
+        pd.concat([base] * s, ignore_index=True).to_csv(p, index=False)
+        paths[s] = p
+    return paths
+
+
+def make_scaled_diary(diary_path, scales, workdir):
+    raw = Path(diary_path).read_bytes()
+    if not raw.endswith(b"\n\n"):
+        raw = raw.rstrip(b"\n") + b"\n\n"
+    paths = {}
+    for s in scales:
+        p = Path(workdir) / f"diary_x{s}.txt"
+        p.write_bytes(raw * s)
+        paths[s] = p
+    return paths
+
+
+def fit_text_model(diary_path, out_path):
+    """仓库没有附带文本模型 pkl：用日记样本就地训练一个与 Notebook 同结构的 TF-IDF + LR 供基准使用。"""
+    import joblib
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import FeatureUnion, Pipeline
+
+    from diary import clean_series, read_records
+
+    df = read_records(diary_path)
+    texts = clean_series(df["TEXT_ALL"])
+    pipe = Pipeline([
+        ("tfidf", FeatureUnion([("char", TfidfVectorizer(analyzer="char", ngram_range=(2, 5), sublinear_tf=True))])),
+        ("clf", LogisticRegression(class_weight="balanced", max_iter=2000)),
+    ])
+    pipe.fit(texts, df["label"].astype(int))
+    joblib.dump(pipe, out_path)
+    return out_path
+
+
+# ========= 各阶段 =========
+def bench_stages(args, workdir):
+    import warnings
+
+    import joblib
+
+    from baseline import artifact_path_for, build_baseline, load_baseline
+    from compiled_model import CompiledSVM, compiled_path_for
+    from dataset import ReferencePopulation, load_dataset, load_population, read_source
+    from diary import read_records
+    from scoring import DeviationScorer, load_meta_file
+    from text_model import _load_uncached, predict_text_proba
+
+    warnings.filterwarnings("ignore")     # sklearn 版本不一致的反序列化提示
+    scales = args.scales
+    r = args.repeats
+    results = []
+
+    times, peak, _ = measure_app_imports(max(r, 3))
+    results.append(summarize("app_imports", 1, times, peak))
+    print(f"  {'app_imports':<20} x1    p50 {results[-1]['p50_ms']:9.2f} ms", file=sys.stderr)
+
+    _, features = load_meta_file(args.meta)
+    data_paths = make_scaled_copies(args.data, scales, workdir)
+    diary_paths = make_scaled_diary(args.diary, scales, workdir)
+    cache_dir = Path(workdir) / "cache"
+
+    def add(stage, scale, fn, repeats, rows=None):
+        times, peak, out = measure(fn, repeats)
+        res = summarize(stage, scale, times, peak, rows)
+        results.append(res)
+        print(f"  {stage:<20} x{scale:<4} p50 {res['p50_ms']:9.2f} ms  p99 {res['p99_ms']:9.2f} ms  "
+              f"rss {res['peak_rss_mb']:7.1f} MB", file=sys.stderr)
+        return out
+
+    pipe = add("model_load", 1, lambda: joblib.load(args.model), r)
+    compiled = None
+    if compiled_path_for(args.model).exists():
+        compiled = add("compiled_load", 1, lambda: CompiledSVM.load(compiled_path_for(args.model)), r)
+    add("baseline_load", 1, lambda: load_baseline(artifact_path_for(args.meta)), r)
+    tmp_text = fit_text_model(args.diary, Path(workdir) / "text_model.pkl")
+    text_model = add("text_model_load", 1, lambda: _load_uncached(tmp_text), r)
+
+    for s in scales:
+        path = data_paths[s]
+        df = add("dataset_parse", s, lambda: read_source(str(path)), r)
+        n = len(df)
+        results[-1]["rows"] = n
+        results[-1]["throughput_rows_per_s"] = n / (results[-1]["mean_ms"] / 1000.0)
+        load_dataset(str(path), columns=features, cache_dir=cache_dir)     # 预热 Parquet 缓存
+        add("dataset_cached", s, lambda: load_dataset(str(path), columns=features, cache_dir=cache_dir), r, rows=n)
+        dff = df[[c for c in features if c in df.columns]]
+        base = add("baseline_build", s, lambda: build_baseline(dff, features), r, rows=n)
+        # 紧凑参照人群：构建（仅特征列 → int8 + 缺失掩码）、mmap 打开，以及从它构建基线；记录常驻字节数
+        pop = add("population_build", s, lambda: ReferencePopulation.from_frame(dff, features), r, rows=n)
+        results[-1]["bytes"] = int(pop.nbytes)
+        results[-1]["dataframe_bytes"] = int(dff.memory_usage(deep=True).sum())
+        load_population(str(path), features, cache_dir=cache_dir)
+        pop = add("population_load", s, lambda: load_population(str(path), features, cache_dir=cache_dir), r)
+        add("baseline_from_pop", s, lambda: build_baseline(pop, features), r, rows=n)
+        scorer = DeviationScorer(base)
+
+        one = dff.head(1)
+        rec = {c: float(v) for c, v in one.iloc[0].items() if pd.notna(v)}
+        if s == scales[0]:
+            # 单条请求的延迟与数据规模无关，只在第一个规模上测
+            add("predict_single", s, lambda: pipe.predict_proba(one), max(r, 20), rows=1)
+            if compiled is not None:
+                add("compiled_single", s, lambda: compiled.predict_proba(one), max(r, 20), rows=1)
+            add("deviation_single", s, lambda: scorer.report(rec), max(r, 20), rows=1)
+        add("predict_batch", s, lambda: pipe.predict_proba(dff), r, rows=n)
+        if compiled is not None:
+            add("compiled_batch", s, lambda: compiled.predict_proba(dff), r, rows=n)
+        add("deviation_batch", s, lambda: scorer.score(scorer.matrix(dff)), r, rows=n)
+
+        dpath = diary_paths[s]
+        ddf = add("diary_parse", s, lambda: read_records(dpath), r)
+        results[-1]["rows"] = len(ddf)
+        results[-1]["throughput_rows_per_s"] = len(ddf) / (results[-1]["mean_ms"] / 1000.0)
+        texts = ddf["TEXT_ALL"].tolist()
+        add("text_predict_batch", s, lambda: predict_text_proba(text_model, texts), r, rows=len(texts))
+
+        if s == scales[0]:
+            add("render_figures", s, lambda: _render_figures(scorer.report(rec), base), r)
+    return results
+
+
+def _render_figures(rep, base):
+    """与结果页相同的一组图：仪表盘 + z 分数条形图 + 百分位条形图 + 6 个预聚合分布图，序列化为 JSON。"""
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    figs = [go.Figure(go.Indicator(mode="gauge+number", value=42.0, gauge={"axis": {"range": [0, 100]}}))]
+    top = rep.head(15)
+    figs.append(px.bar(top, x="z", y="feature", orientation="h"))
+    figs.append(px.bar(top, x="percentile", y="feature", orientation="h", range_x=[0, 100]))
+    for c in base.num_features[:6]:
+        counts, edges = base.histogram(c)
+        figs.append(go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges))))
+    return sum(len(f.to_json()) for f in figs)
+
+
+# ========= 启动导入耗时 =========
+_IMPORT_PROBE = """
+import json, os, sys, time
+t0 = time.perf_counter()
+exec(compile(sys.argv[1], "<app imports>", "exec"), {})
+ms = (time.perf_counter() - t0) * 1000.0
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+deferred = sys.argv[2].split(",")
+print(json.dumps({"ms": ms, "rss_mb": rss, "loaded": [m for m in deferred if m in sys.modules]}))
+"""
+
+
+def app_import_source(app_path=APP_PATH):
+    """app 顶层的全部 import 语句，包括包在 try/except 里的可选导入（不执行页面代码）。"""
+    import ast
+    src = Path(app_path).read_text(encoding="utf-8")
+
+    def is_import(n):
+        if isinstance(n, (ast.Import, ast.ImportFrom)):
+            return True
+        return isinstance(n, ast.Try) and any(isinstance(b, (ast.Import, ast.ImportFrom)) for b in n.body)
+
+    nodes = [n for n in ast.parse(src).body if is_import(n)]
+    return "\n".join(ast.get_source_segment(src, n) for n in nodes)
+
+
+def measure_app_imports(runs=5, app_path=APP_PATH):
+    """每次在全新子进程里执行一遍 app 的顶层导入；返回 (耗时 ms 数组, 峰值 RSS MB, 提前导入的重依赖)。"""
+    src = app_import_source(app_path)
+    times, rss, loaded = [], 0.0, set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _IMPORT_PROBE, src, ",".join(DEFERRED_MODULES)],
+                             cwd=Path(app_path).parent, capture_output=True, text=True, check=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(r["ms"])
+        rss = max(rss, r["rss_mb"])
+        loaded.update(r["loaded"])
+    return np.asarray(times), rss, sorted(loaded)
+
+
+def import_check(budget_ms=IMPORT_BUDGET_MS, runs=5):
+    times, rss, loaded = measure_app_imports(runs)
+    p50 = float(np.median(times))
+    print(f"app 顶层导入：p50 {p50:.0f} ms（预算 {budget_ms:.0f} ms），RSS {rss:.0f} MB", file=sys.stderr)
+    failed = False
+    if loaded:
+        print(f"启动阶段提前导入了应推迟的模块：{', '.join(loaded)}", file=sys.stderr)
+        failed = True
+    if p50 > budget_ms:
+        print(f"导入耗时超出预算 {p50 - budget_ms:.0f} ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+# ========= 比较 =========
+def compare(old, new, threshold, min_delta_ms=1.0):
+    """按 (stage, scale) 对比 p50；返回变慢超过 threshold 倍且绝对差超过 min_delta_ms 的条目。"""
+    old_idx = {(r["stage"], r["scale"]): r for r in old["results"]}
+    regressions = []
+    print(f"{'stage':<20} {'scale':>5} {'old p50':>10} {'new p50':>10} {'ratio':>7}")
+    for r in new["results"]:
+        o = old_idx.get((r["stage"], r["scale"]))
+        if o is None or o["p50_ms"] <= 0:
+            continue
+        ratio = r["p50_ms"] / o["p50_ms"]
+        slower = ratio > threshold and r["p50_ms"] - o["p50_ms"] > min_delta_ms
+        mark = "  <-- regression" if slower else ""
+        print(f"{r['stage']:<20} {r['scale']:>5} {o['p50_ms']:>10.2f} {r['p50_ms']:>10.2f} {ratio:>7.2f}{mark}")
+        if slower:
+            regressions.append((r["stage"], r["scale"], ratio))
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="各阶段性能基准")
+    ap.add_argument("--data", default=str(DEFAULT_DATA))
+    ap.add_argument("--model", default=str(DEFAULT_MODEL))
+    ap.add_argument("--meta", default=str(DEFAULT_META))
+    ap.add_argument("--diary", default=str(DEFAULT_DIARY))
+    ap.add_argument("--scales", default="1,10,100", help="数据放大倍数，逗号分隔")
+    ap.add_argument("--repeats", type=int, default=5)
+    ap.add_argument("--out", default=None, help="结果 JSON 路径（默认输出到 stdout）")
+    ap.add_argument("--compare", default=None, help="与之前的结果 JSON 比较")
+    ap.add_argument("--threshold", type=float, default=1.25, help="p50 变慢超过该倍数视为回归")
+    ap.add_argument("--min-delta-ms", type=float, default=1.0, help="绝对差低于该值的变化视为噪声")
+    ap.add_argument("--import-check", action="store_true", help="只检查 app 启动导入耗时与重依赖，然后退出")
+    ap.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = ap.parse_args(argv)
+    if args.import_check:
+        return import_check(args.import_budget_ms, max(args.repeats, 3))
+    args.scales = [int(x) for x in str(args.scales).split(",") if x.strip()]
+
+    with tempfile.TemporaryDirectory(prefix="deyu_bench_") as workdir:
+        results = bench_stages(args, workdir)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "scales": args.scales,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        regressions = compare(old, report, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"{len(regressions)} 个阶段 p50 变慢超过 {args.threshold:.2f} 倍", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
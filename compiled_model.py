@@ -0,0 +1,330 @@
+# compiled_model.py — 行为模型（中位数插补 → 标准化 → PCA → RBF-SVC + Platt 概率）的纯 NumPy 推理
+#
+# 导出（需要 sklearn，离线运行一次；产物与 pkl 放在一起：*_pipeline.pkl → *_compiled.npz）：
+#   python compiled_model.py --model svm_pca_behavior_pipeline.pkl --check CNAH2003_public_use.xls
+# 推理（只需要 numpy）：
+#   model = CompiledSVM.load("svm_pca_behavior_compiled.npz")
+#   model.predict_proba(X)          # 与 pipe.predict_proba(X) 相同的 [n, 2] 输出
+#
+# 插补/标准化/PCA 在加载时合并为一次仿射变换；核矩阵按 ‖x‖² + ‖sv‖² − 2x·sv 计算。
+# 概率与 sklearn 自带的 libsvm 一致：成对概率 r = 1 / (1 + exp(A·dec + B))（截断到 [1e-7, 1 − 1e-7]），
+# 再走 multiclass_probability 的迭代求解（二分类也不走捷径，eps = 0.005/k，所以结果与 r 相差可达 ~3e-3）。
+# 只支持上面这一种结构（仓库里的 svm_pca_behavior_pipeline.pkl）；其他结构导出时直接报错。
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+COMPILED_VERSION = 1
+MIN_PROB = 1e-7          # libsvm svm_predict_probability 中的 min_prob
+BLOCK_ROWS = 2048        # 核矩阵按行分块计算，峰值内存约 BLOCK_ROWS × 支持向量数 × 8 字节 × 3
+
+
+def compiled_path_for(model_path) -> Path:
+    """svm_pca_behavior_pipeline.pkl → svm_pca_behavior_compiled.npz。"""
+    p = Path(model_path)
+    stem = p.stem[:-len("_pipeline")] if p.stem.endswith("_pipeline") else p.stem
+    return p.with_name(f"{stem}_compiled.npz")
+
+
+def _sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# ========= 导出（需要 sklearn） =========
+def _unpack_pipeline(pipe):
+    """检查结构并取出各步骤；不支持的结构抛 ValueError。"""
+    steps = dict(getattr(pipe, "named_steps", {}))
+    if list(steps) != ["prep", "pca", "svc"]:
+        raise ValueError(f"只支持 prep → pca → svc 三步的 Pipeline，实际为 {list(steps)}")
+    prep, pca, svc = steps["prep"], steps["pca"], steps["svc"]
+
+    num = [(tr, list(cols)) for name, tr, cols in prep.transformers_
+           if name != "remainder" and len(cols) > 0]
+    if len(num) != 1 or getattr(prep, "remainder", "drop") != "drop":
+        raise ValueError("ColumnTransformer 只能有一个非空的数值分支且 remainder='drop'")
+    branch, columns = num[0]
+    sub = dict(branch.named_steps)
+    if list(sub) != ["impute", "scale"]:
+        raise ValueError(f"数值分支只支持 impute → scale，实际为 {list(sub)}")
+    imp, scaler = sub["impute"], sub["scale"]
+    if not (isinstance(imp.missing_values, float) and np.isnan(imp.missing_values)) or imp.add_indicator:
+        raise ValueError("插补器只支持 missing_values=NaN 且不加缺失指示列")
+
+    if getattr(pca, "whiten", False):
+        raise ValueError("暂不支持 whiten=True 的 PCA")
+    if svc.kernel != "rbf" or len(svc.classes_) != 2 or np.size(svc.probA_) != 1:
+        raise ValueError("只支持二分类、probability=True 的 RBF SVC")
+    return columns, imp, scaler, pca, svc
+
+
+def export_pipeline(pipe, out_path, source_sha1=None, sklearn_version=None):
+    """把拟合好的 pipeline 参数写成 .npz（header JSON + 数组）。"""
+    columns, imp, scaler, pca, svc = _unpack_pipeline(pipe)
+    F = len(columns)
+    mean = scaler.mean_ if scaler.with_mean else np.zeros(F)
+    scale = scaler.scale_ if scaler.with_std else np.ones(F)
+    header = {
+        "version": COMPILED_VERSION,
+        "source_sha1": source_sha1,
+        "sklearn_version": sklearn_version,
+        "features": columns,
+        "classes": [c.item() if hasattr(c, "item") else c for c in svc.classes_],
+        "gamma": float(svc._gamma),
+    }
+    out_path = Path(out_path)
+    tmp = out_path.with_name(out_path.name + f".{os.getpid()}.tmp.npz")
+    np.savez(tmp,
+             header=np.array(json.dumps(header, ensure_ascii=False)),
+             impute=np.asarray(imp.statistics_, dtype=float),
+             scale_mean=np.asarray(mean, dtype=float),
+             scale_scale=np.asarray(scale, dtype=float),
+             pca_mean=np.asarray(pca.mean_, dtype=float),
+             pca_components=np.asarray(pca.components_, dtype=float),
+             support_vectors=np.asarray(svc.support_vectors_, dtype=float),
+             # libsvm 内部符号（sklearn 的公开 dual_coef_/intercept_ 在二分类时取了相反数）
+             dual_coef=np.asarray(svc._dual_coef_, dtype=float).ravel(),
+             intercept=np.asarray(svc._intercept_, dtype=float).ravel(),
+             prob_a=np.asarray(svc.probA_, dtype=float).ravel(),
+             prob_b=np.asarray(svc.probB_, dtype=float).ravel())
+    os.replace(tmp, out_path)
+    return out_path
+
+
+# ========= 推理（只需要 numpy） =========
+class CompiledSVM:
+    """与 sklearn pipeline 相同接口的子集：features / classes_ / predict_proba / predict / decision_function。"""
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.features = list(header["features"])
+        self.feature_names_in_ = np.asarray(self.features, dtype=object)
+        self.classes_ = np.asarray(header["classes"])
+        self.source_sha1 = header.get("source_sha1")
+        self.gamma = float(header["gamma"])
+        self.impute = arrays["impute"]
+        # (x − μ)/σ − m，再乘 PCAᵀ  →  x @ W + b
+        comps = arrays["pca_components"]
+        self.W = (comps / arrays["scale_scale"]).T                                    # [F, K]
+        self.b = -((arrays["scale_mean"] / arrays["scale_scale"] + arrays["pca_mean"]) @ comps.T)
+        self.sv = arrays["support_vectors"]                                          # [S, K]
+        self.sv_sq = np.einsum("ij,ij->i", self.sv, self.sv)
+        self.dual_coef = arrays["dual_coef"]
+        self.intercept = float(arrays["intercept"][0])
+        self.prob_a = float(arrays["prob_a"][0])
+        self.prob_b = float(arrays["prob_b"][0])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            header = json.loads(str(z["header"]))
+            if header.get("version") != COMPILED_VERSION:
+                raise ValueError(f"{path}: 产物版本 {header.get('version')} 与当前 {COMPILED_VERSION} 不一致")
+            arrays = {k: z[k] for k in z.files if k != "header"}
+        return cls(header, arrays)
+
+    def _matrix(self, X):
+        """
+        dict（单条记录）/ DataFrame 按特征名取值，缺失的键或列视为缺失；ndarray 按 features 顺序。
+        非有限值视为缺失，用训练时的中位数插补。
+        """
+        if isinstance(X, dict):
+            X = np.array([[_to_float(X.get(c)) for c in self.features]])
+        elif hasattr(X, "columns"):
+            X = X.reindex(columns=self.features)
+            if not all(dt.kind in "biuf" for dt in X.dtypes):
+                import pandas as pd
+                X = X.apply(pd.to_numeric, errors="coerce")
+            X = X.to_numpy(dtype=float)
+        else:
+            X = np.array(X, dtype=float, ndmin=2)
+            if X.shape[1] != len(self.features):
+                raise ValueError(f"需要 {len(self.features)} 列特征，实际 {X.shape[1]} 列")
+        bad = ~np.isfinite(X)
+        if bad.any():
+            X = np.where(bad, self.impute, X)
+        return X
+
+    def transform(self, X):
+        """插补 + 标准化 + PCA 之后的 [n, K] 矩阵。"""
+        return self._matrix(X) @ self.W + self.b
+
+    def decision_function(self, X):
+        """与 sklearn SVC.decision_function 相同的符号（> 0 偏向 classes_[1]）。"""
+        return -self._libsvm_decision(self.transform(X))
+
+    def _libsvm_decision(self, Z):
+        out = np.empty(len(Z))
+        for i in range(0, len(Z), BLOCK_ROWS):
+            z = Z[i:i + BLOCK_ROWS]
+            d2 = z @ self.sv.T
+            d2 *= -2.0
+            d2 += np.einsum("ij,ij->i", z, z)[:, None]
+            d2 += self.sv_sq[None, :]
+            np.maximum(d2, 0.0, out=d2)
+            d2 *= -self.gamma
+            np.exp(d2, out=d2)
+            out[i:i + BLOCK_ROWS] = d2 @ self.dual_coef
+        return out + self.intercept
+
+    def predict_proba(self, X):
+        dec = self._libsvm_decision(self.transform(X))
+        # libsvm sigmoid_predict：两个分支只是为了数值稳定，结果都等于 1 / (1 + exp(A·dec + B))
+        f = self.prob_a * dec + self.prob_b
+        e = np.exp(-np.abs(f))
+        r01 = np.where(f >= 0, e / (1.0 + e), 1.0 / (1.0 + e))
+        r01 = np.minimum(np.maximum(r01, MIN_PROB), 1.0 - MIN_PROB)
+        return _multiclass_probability_2(r01)
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _multiclass_probability_2(r01, max_iter=100):
+    """
+    libsvm multiclass_probability 在 k=2 时的逐行向量化版本（运算顺序与 C 代码一致）。
+    r01 为类别 0 相对类别 1 的成对概率；返回 [n, 2]。
+    """
+    r10 = 1.0 - r01
+    k = 2
+    eps = 0.005 / k
+    # Q[t][t] = Σ_{j≠t} r[j][t]²，Q[0][1] = Q[1][0] = −r[1][0]·r[0][1]
+    q00, q11 = r10 * r10, r01 * r01
+    q01 = -r10 * r01
+    p0 = np.full_like(r01, 1.0 / k)
+    p1 = np.full_like(r01, 1.0 / k)
+    active = np.ones(r01.shape, dtype=bool)
+    for _ in range(max_iter):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        err = np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp))
+        active &= ~(err < eps)
+        if not active.any():
+            break
+        for t in (0, 1):
+            qtt = q00 if t == 0 else q11
+            qpt = qp0 if t == 0 else qp1
+            diff = (-qpt + pqp) / qtt
+            if t == 0:
+                p0n = p0 + diff
+                p1n = p1
+            else:
+                p0n = p0
+                p1n = p1 + diff
+            pqpn = (pqp + diff * (diff * qtt + 2 * qpt)) / (1 + diff) / (1 + diff)
+            qt0, qt1 = (q00, q01) if t == 0 else (q01, q11)
+            qp0n = (qp0 + diff * qt0) / (1 + diff)
+            qp1n = (qp1 + diff * qt1) / (1 + diff)
+            p0n, p1n = p0n / (1 + diff), p1n / (1 + diff)
+            p0 = np.where(active, p0n, p0)
+            p1 = np.where(active, p1n, p1)
+            qp0 = np.where(active, qp0n, qp0)
+            qp1 = np.where(active, qp1n, qp1)
+            pqp = np.where(active, pqpn, pqp)
+    return np.column_stack([p0, p1])
+
+
+def load_compiled_for(model_path, source_sha1=None):
+    """
+    model_path 旁边存在与之匹配的 *_compiled.npz 时返回 CompiledSVM，否则返回 None。
+    source_sha1 为 None 时现算 pkl 的 sha1 比对，保证 pkl 更新后不会用到过期的产物。
+    """
+    path = compiled_path_for(model_path)
+    if not path.exists():
+        return None
+    try:
+        model = CompiledSVM.load(path)
+    except Exception as e:
+        print(f"load_compiled_for: 无法读取 {path}：{type(e).__name__}: {e}")
+        return None
+    if source_sha1 is None:
+        source_sha1 = _sha1_file(model_path)
+    return model if model.source_sha1 == source_sha1 else None
+
+
+def load_serving_model(model_path):
+    """
+    服务端加载行为模型：.ts 为序列模型（seq_serving.py，TorchScript）；
+    pkl 优先用编译产物（不需要 sklearn），没有或过期时回退到 pkl。
+    """
+    if str(model_path).endswith(".ts"):
+        from seq_serving import load_seq_model
+        return load_seq_model(model_path)
+    model = load_compiled_for(model_path)
+    if model is not None:
+        return model
+    from scoring import load_model_file
+    return load_model_file(model_path)
+
+
+# ========= CLI =========
+def main(argv=None):
+    import time
+    import warnings
+
+    ap = argparse.ArgumentParser(description="导出行为模型的纯 NumPy 推理产物")
+    ap.add_argument("--model", default="svm_pca_behavior_pipeline.pkl")
+    ap.add_argument("--out", default=None, help="默认与 pkl 同目录：*_compiled.npz")
+    ap.add_argument("--check", default=None, help="用该数据集逐行比对 sklearn 与导出结果")
+    ap.add_argument("--tol", type=float, default=1e-9)
+    args = ap.parse_args(argv)
+
+    from scoring import load_model_file
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        pipe = load_model_file(args.model)
+    trained = next((getattr(w.message, "original_sklearn_version", None) for w in caught
+                    if getattr(w.message, "original_sklearn_version", None)), None)
+    if trained is None:
+        from importlib.metadata import version
+        trained = version("scikit-learn")
+    out = Path(args.out) if args.out else compiled_path_for(args.model)
+    export_pipeline(pipe, out, source_sha1=_sha1_file(args.model), sklearn_version=trained)
+    model = CompiledSVM.load(out)
+    print(f"已导出：{out}（特征 {len(model.features)}，支持向量 {len(model.sv)}）")
+
+    if args.check:
+        from dataset import load_dataset
+        df = load_dataset(args.check, columns=model.features)
+        X = df.reindex(columns=model.features)
+        # 额外随机挖空 20% 的值，覆盖插补路径
+        rng = np.random.default_rng(0)
+        Xm = X.mask(rng.random(X.shape) < 0.2)
+        worst = 0.0
+        for data in (X, Xm):
+            ref = pipe.predict_proba(data)
+            got = model.predict_proba(data)
+            worst = max(worst, float(np.abs(ref - got).max()))
+            if not np.array_equal(pipe.predict(data), model.predict(data)):
+                print("警告：predict 结果存在不一致")
+        one = X.head(1)
+        t0 = time.perf_counter()
+        for _ in range(200):
+            pipe.predict_proba(one)
+        t_ref = (time.perf_counter() - t0) / 200 * 1000
+        t0 = time.perf_counter()
+        for _ in range(200):
+            model.predict_proba(one)
+        t_new = (time.perf_counter() - t0) / 200 * 1000
+        print(f"比对 {2 * len(X)} 行：最大概率误差 {worst:.2e}；单行延迟 sklearn {t_ref:.3f} ms → 编译 {t_new:.3f} ms")
+        if worst > args.tol:
+            raise SystemExit(f"误差超过容差 {args.tol:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+# dataset.py — 数据集读取层（与 Streamlit 无关，可在 app / 脚本中复用）
+#
+# 第一次读取 xls/xlsx/csv 源文件时，把整张表转换成列式 Parquet 缓存，
+# 之后按「文件内容 sha1」命中缓存，只读取需要的列（通常是 meta.json 里的模型特征）。
+# 源文件被替换（内容变化）后自动重新转换；未安装 pyarrow 时退化为直接解析源文件。
+#
+# 缓存目录默认为 repo 根下的 .cache/dataset，可用环境变量 DEYU_CACHE_DIR 修改。
+#
+# app 常驻的参照人群（基线、滑块范围、直方图的来源）用 ReferencePopulation 表示：只保留模型特征列，
+# Likert 整数码存成 int8 + 缺失掩码，写入 .cache/population/<sha1>-<特征列哈希>/ 后以只读 mmap 打开，
+# 同一节点上的多个 app 副本共享同一份页缓存。
+import hashlib
+import json
+import os
+import traceback
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = Path(os.environ.get("DEYU_CACHE_DIR", Path(__file__).resolve().parent / ".cache")) / "dataset"
+_MANIFEST = "manifest.json"
+
+
+def _detect_file_format(path):
+    """Return 'csv', 'xls', 'xlsx', or None."""
+    with open(path, "rb") as f:
+        head = f.read(4096)
+    return sniff_format(head)
+
+
+def sniff_format(head: bytes):
+    """按文件头字节判断格式（也用于上传的内存文件）：'csv' / 'xls' / 'xlsx' / None。"""
+    if head.startswith(b"PK\x03\x04"):
+        return "xlsx"
+    if head.startswith(b"\xD0\xCF\x11\xE0"):
+        return "xls"
+    try:
+        s = head.decode("utf-8", errors="ignore")
+        first = s.splitlines()[0] if s.splitlines() else ""
+        if "," in first or "\t" in first:
+            return "csv"
+    except Exception:
+        pass
+    return None
+
+
+def read_source(path, usecols=None):
+    """直接解析源文件（不经过缓存）。usecols 仅对 csv 生效，excel 读完后再裁列。"""
+    fmt = _detect_file_format(path)
+    ext = os.path.splitext(path)[1].lower()
+    if usecols is not None:
+        wanted = set(usecols)
+        usecols = lambda c: c in wanted  # noqa: E731  缺失的列直接忽略，而不是报错
+    # 注意：仓库里的 CNAH2003_public_use.xls 实际内容是 csv，因此内容嗅探优先于扩展名
+    if fmt == "csv" or (fmt is None and ext == ".csv"):
+        df = pd.read_csv(path, low_memory=False, usecols=usecols)
+    elif fmt == "xls" or (fmt is None and ext == ".xls"):
+        # 需要 xlrd>=2.0.1 在 requirements.txt 中
+        df = pd.read_excel(path, engine="xlrd")
+    elif fmt == "xlsx" or (fmt is None and ext == ".xlsx"):
+        # 需要 openpyxl 在 requirements.txt 中
+        df = pd.read_excel(path, engine="openpyxl")
+    else:
+        # 兜底：先试 csv，再试 excel（xlrd）
+        try:
+            df = pd.read_csv(path, low_memory=False, usecols=usecols)
+        except Exception:
+            df = pd.read_excel(path, engine="xlrd")
+    if usecols is not None:
+        df = df[[c for c in df.columns if usecols(c)]]
+    return df
+
+
+# ========= 指纹：sha1 + mtime =========
+def _load_manifest(cache_dir: Path) -> dict:
+    try:
+        with open(cache_dir / _MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_manifest(cache_dir: Path, manifest: dict):
+    tmp = cache_dir / (_MANIFEST + f".{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, cache_dir / _MANIFEST)
+
+
+def _sha1_file(path, chunk=1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_fingerprint(path, cache_dir: Path = None) -> str:
+    """
+    返回源文件内容的 sha1。
+    mtime/size 未变时直接复用 manifest 里记录的 sha1，避免每次冷启动都重新哈希。
+    """
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    st_ = os.stat(path)
+    key = str(Path(path).resolve())
+    manifest = _load_manifest(cache_dir)
+    rec = manifest.get(key)
+    if rec and rec.get("mtime_ns") == st_.st_mtime_ns and rec.get("size") == st_.st_size:
+        return rec["sha1"]
+    sha1 = _sha1_file(path)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        manifest[key] = {"sha1": sha1, "mtime_ns": st_.st_mtime_ns, "size": st_.st_size}
+        _save_manifest(cache_dir, manifest)
+    except OSError:
+        pass  # 只读文件系统：不记录，下次重新哈希即可
+    return sha1
+
+
+# ========= 列式缓存 =========
+def _parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def cache_path_for(path, cache_dir: Path = None) -> Path:
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    return cache_dir / f"{file_fingerprint(path, cache_dir)}.parquet"
+
+
+def _write_cache(df: pd.DataFrame, target: Path):
+    # object 列里混有数字和字符串时 pyarrow 无法推断类型，统一转成字符串（缺失保持缺失）
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+    df.columns = [str(c) for c in df.columns]
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, target)  # 原子替换，多进程并发冷启动时不会读到半个文件
+
+
+def load_dataset(path, columns=None, cache_dir=None, use_cache=True):
+    """
+    Robust dataset loader.
+    - path: 文件路径，相对于 repo 根（或绝对路径）。
+    - columns: 只返回这些列（不存在的列忽略）；None 表示全部列。
+    - use_cache: False 时跳过 Parquet 缓存，直接解析源文件。
+    返回 pandas.DataFrame；失败时抛异常（由调用方决定如何提示）。
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"数据文件不存在：{path}")
+
+    cols = None if columns is None else [str(c) for c in columns]
+    if not (use_cache and _parquet_available()):
+        return read_source(path, usecols=cols)
+
+    target = cache_path_for(path, cache_dir)
+    if target.exists():
+        try:
+            if cols is not None:
+                import pyarrow.parquet as pq
+                present = set(pq.read_schema(target).names)
+                cols = [c for c in cols if c in present]
+            return pd.read_parquet(target, columns=cols)
+        except Exception:
+            print("dataset cache unreadable, rebuilding:\n", traceback.format_exc())
+
+    # 缓存未命中：完整解析一次并写入缓存，之后只按列读取
+    df = read_source(path)
+    try:
+        _write_cache(df, target)
+    except Exception:
+        print("dataset cache write failed (continuing without cache):\n", traceback.format_exc())
+    if cols is not None:
+        df = df[[c for c in cols if c in df.columns]]
+    return df
+
+
+# ========= 紧凑的参照人群 =========
+POPULATION_VERSION = 1
+POPULATION_DIR = CACHE_DIR.parent / "population"
+
+
+class ReferencePopulation:
+    """
+    只含模型特征列的参照人群（用于基线、滑块范围、直方图），代替常驻的整表 DataFrame：
+    - 取值全为 int8 范围内整数的列 → int8 codes + 缺失掩码（问卷题几乎都是这种）
+    - 其他数值列 → float32（与 float64 往返无损时）或 float64，NaN 为缺失
+    - 非数值列 → int16 类别编码（-1 为缺失）+ categories
+    三个矩阵各存一个 .npy，可用 mmap 只读打开：同一台机器上的多个 app 进程共享同一份页缓存。
+    """
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.features = list(header["features"])
+        self.kinds = dict(zip(self.features, header["kinds"]))
+        self.categories = header.get("categories", {})
+        self.dataset_sha1 = header.get("dataset_sha1")
+        self.n_rows = int(header["n_rows"])
+        self.codes = arrays["codes"]            # [N, F_int] int8
+        self.missing = arrays["missing"]        # [N, F_int] bool
+        self.floats = arrays["floats"]          # [N, F_float]
+        self.cat_codes = arrays["cat_codes"]    # [N, F_cat] int16
+        self._pos = {}
+        for kind in ("int", "float", "cat"):
+            for j, c in enumerate(c for c in self.features if self.kinds[c] == kind):
+                self._pos[c] = j
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, c):
+        return c in self.kinds
+
+    @property
+    def numeric_features(self):
+        return [c for c in self.features if self.kinds[c] in ("int", "float")]
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.codes, self.missing, self.floats, self.cat_codes))
+
+    # ----- 构建 -----
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, features, dataset_sha1=None):
+        feats = [c for c in features if c in df.columns]
+        kinds, ints, missing, floats, cats, categories = [], [], [], [], [], {}
+        for c in feats:
+            s = df[c]
+            if s.dtype.kind in "biuf":
+                v = s.to_numpy(dtype=float)
+                v = np.where(np.isfinite(v), v, np.nan)
+                ok = ~np.isnan(v)
+                if np.all(v[ok] == np.round(v[ok])) and (not ok.any() or (v[ok].min() >= -128 and v[ok].max() <= 127)):
+                    kinds.append("int")
+                    ints.append(np.where(ok, v, 0).astype(np.int8))
+                    missing.append(~ok)
+                else:
+                    kinds.append("float")
+                    floats.append(v)
+            else:
+                kinds.append("cat")
+                vals = s.where(s.isna(), s.astype(str))
+                codes, uniques = pd.factorize(vals, sort=True)
+                cats.append(codes.astype(np.int16))
+                categories[c] = [str(u) for u in uniques]
+        n = len(df)
+        fl = np.column_stack(floats) if floats else np.zeros((n, 0))
+        if fl.size and np.array_equal(fl.astype(np.float32).astype(float), fl, equal_nan=True):
+            fl = fl.astype(np.float32)
+        arrays = {
+            "codes": np.column_stack(ints) if ints else np.zeros((n, 0), dtype=np.int8),
+            "missing": np.column_stack(missing) if missing else np.zeros((n, 0), dtype=bool),
+            "floats": fl,
+            "cat_codes": np.column_stack(cats) if cats else np.zeros((n, 0), dtype=np.int16),
+        }
+        header = {"version": POPULATION_VERSION, "features": feats, "kinds": kinds, "categories": categories,
+                  "dataset_sha1": dataset_sha1, "n_rows": n}
+        return cls(header, arrays)
+
+    # ----- 读取 -----
+    def column(self, c):
+        """单列：数值列为 float64（缺失 NaN），类别列为 object（缺失 None）。"""
+        kind, j = self.kinds[c], self._pos[c]
+        if kind == "int":
+            return np.where(self.missing[:, j], np.nan, self.codes[:, j].astype(float))
+        if kind == "float":
+            return np.asarray(self.floats[:, j], dtype=float)
+        cats = np.asarray(self.categories[c] + [None], dtype=object)
+        return cats[self.cat_codes[:, j]]           # -1 → 末尾的 None
+
+    def numeric_matrix(self, features=None):
+        """[N, F] float64，缺失为 NaN；只在计算基线时临时展开。"""
+        feats = self.numeric_features if features is None else list(features)
+        X = np.empty((self.n_rows, len(feats)))
+        for i, c in enumerate(feats):
+            X[:, i] = self.column(c)
+        return X
+
+    def choices(self, c, limit=None):
+        """类别列的取值，按频数降序（频数相同按类别顺序）。"""
+        j = self._pos[c]
+        codes = np.asarray(self.cat_codes[:, j])
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.categories[c]))
+        order = np.argsort(-counts, kind="stable")
+        out = [self.categories[c][i] for i in order if counts[i] > 0]
+        return out if limit is None else out[:limit]
+
+    def to_frame(self, columns=None):
+        """兼容旧代码：还原成 DataFrame（整数列为可空 Int8，类别列为 category）。"""
+        data = {}
+        for c in (self.features if columns is None else [c for c in columns if c in self.kinds]):
+            kind, j = self.kinds[c], self._pos[c]
+            if kind == "int":
+                data[c] = pd.arrays.IntegerArray(np.array(self.codes[:, j]), np.array(self.missing[:, j]))
+            elif kind == "float":
+                data[c] = np.asarray(self.floats[:, j])
+            else:
+                data[c] = pd.Categorical.from_codes(np.asarray(self.cat_codes[:, j]), self.categories[c])
+        return pd.DataFrame(data)
+
+    # ----- 持久化 -----
+    def save(self, directory):
+        directory = Path(directory)
+        tmp = directory.with_name(f"{directory.name}.{os.getpid()}.tmp")
+        tmp.mkdir(parents=True, exist_ok=True)
+        for name in ("codes", "missing", "floats", "cat_codes"):
+            np.save(tmp / f"{name}.npy", getattr(self, name))
+        with open(tmp / "header.json", "w", encoding="utf-8") as f:
+            json.dump(self.header, f, ensure_ascii=False)
+        try:
+            os.replace(tmp, directory)          # 整个目录原子发布；已存在（并发构建）时保留先写好的
+        except OSError:
+            import shutil
+            shutil.rmtree(tmp, ignore_errors=True)
+        return directory
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        directory = Path(directory)
+        with open(directory / "header.json", "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("version") != POPULATION_VERSION:
+            raise ValueError(f"{directory}: 参照人群版本 {header.get('version')} 与当前 {POPULATION_VERSION} 不一致")
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r" if mmap else None)
+                  for name in ("codes", "missing", "floats", "cat_codes")}
+        return cls(header, arrays)
+
+
+def population_path_for(path, features, cache_dir: Path = None) -> Path:
+    key = hashlib.sha1(json.dumps([str(c) for c in features]).encode("utf-8")).hexdigest()[:12]
+    base = Path(cache_dir) / "population" if cache_dir else POPULATION_DIR
+    return base / f"{file_fingerprint(path, cache_dir)}-{key}"
+
+
+def load_population(path, features, cache_dir=None, mmap=True) -> ReferencePopulation:
+    """
+    参照人群：缓存目录里已有（数据集 sha1 + 特征列）对应的产物时直接 mmap 打开，
+    否则只读取需要的列构建一次并写入缓存。缓存目录不可写时返回内存中的版本。
+    """
+    target = population_path_for(path, features, cache_dir)
+    if (target / "header.json").exists():
+        try:
+            return ReferencePopulation.load(target, mmap=mmap)
+        except Exception:
+            print("population cache unreadable, rebuilding:\n", traceback.format_exc())
+    df = load_dataset(path, columns=features, cache_dir=cache_dir)
+    pop = ReferencePopulation.from_frame(df, features, dataset_sha1=file_fingerprint(path, cache_dir))
+    del df
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            import shutil
+            shutil.rmtree(target, ignore_errors=True)
+        pop.save(target)
+        return ReferencePopulation.load(target, mmap=mmap)
+    except OSError:
+        print("population cache write failed (continuing in memory):\n", traceback.format_exc())
+        return pop
@@ -0,0 +1,161 @@
+# diary.py — 日历体日记语料（calendar_text_samples_zh.txt）的流式读取、清洗与增量索引
+#
+# 记录格式（与 Notebook Cell 8′ 相同）：
+#   2003-01-01(周三) [label:0]
+#   当天的日记正文（一行）
+#   （空行）
+#
+# - iter_records(path)：生成器，逐行读取，内存占用与文件大小无关；每条记录带字节偏移 offset。
+# - clean_zh2 / clean_series：全角→半角用 str.translate 查表完成，替代逐字符的 _q2b 循环。
+# - DiaryIndex：按日期记录每条记录的字节偏移（只追加的 .idx 文件），文件追加新日记后
+#   update() 只解析新增部分，不必重读整份语料。
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+HEADER_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})\((周[一二三四五六日])\)\s*\[label:(\d)\]\s*$")
+
+
+# ========= 流式读取 =========
+def iter_records(path, start=0, encoding="utf-8"):
+    """
+    逐条产出 {"date", "weekday", "text", "label", "offset"}；offset 为记录头所在行的字节偏移。
+    start 必须是某条记录头（或文件开头）的字节偏移。
+    格式不匹配的行直接跳过（与 Notebook 的容错一致）；文件末尾只有记录头、没有正文的不产出。
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        pending = None          # (header match, header offset)
+        for raw in f:
+            line_pos, pos = pos, pos + len(raw)
+            line = raw.decode(encoding, errors="replace").strip()
+            if pending is not None:
+                m, off = pending
+                pending = None
+                date_str, weekday_str, lab = m.groups()
+                yield {"date": date_str, "weekday": weekday_str, "text": line, "label": int(lab),
+                       "offset": off, "end": pos}
+                continue
+            if not line:
+                continue
+            m = HEADER_RE.match(line)
+            if m:
+                pending = (m, line_pos)
+
+
+def read_records(path, encoding="utf-8"):
+    """整份语料 → DataFrame（列名与 Notebook 的 df_text 相同：date/weekday/TEXT_ALL/label）。"""
+    df = pd.DataFrame(iter_records(path, encoding=encoding), columns=["date", "weekday", "text", "label", "offset", "end"])
+    return df.rename(columns={"text": "TEXT_ALL"})[["date", "weekday", "TEXT_ALL", "label"]]
+
+
+# ========= 清洗 =========
+# 全角 ASCII（U+FF01–U+FF5E）→ 半角，全角空格 U+3000 → 空格
+_Q2B_TABLE = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+_Q2B_TABLE[0x3000] = 0x20
+_WS_RE = re.compile(r"\s+")
+_DISALLOWED_RE = re.compile(r"[^0-9A-Za-z\u4e00-\u9fa5，。？！、；：:,.!?%-/()\[\]（）【】]+")
+
+
+def _q2b(u):
+    return str(u).translate(_Q2B_TABLE)
+
+
+def clean_zh2(s, forbidden=()):
+    """与 Notebook Cell 9′ 的 clean_zh2 结果一致；forbidden 为需要删除的词（默认不删）。"""
+    if s is None or (not isinstance(s, str) and pd.isna(s)):
+        return ""
+    s = _q2b(s).strip()
+    s = _WS_RE.sub(" ", s)
+    s = _DISALLOWED_RE.sub(" ", s)
+    for w in forbidden:
+        s = s.replace(w, "")
+    return s
+
+
+def clean_series(texts: pd.Series, forbidden=()) -> pd.Series:
+    """clean_zh2 的整列版本：用 pandas 字符串方法一次处理整列。"""
+    s = texts.astype("string").fillna("")
+    s = s.str.translate(_Q2B_TABLE).str.strip()
+    s = s.str.replace(_WS_RE, " ", regex=True).str.replace(_DISALLOWED_RE, " ", regex=True)
+    for w in forbidden:
+        s = s.str.replace(w, "", regex=False)
+    return s.astype(object)
+
+
+# ========= 增量索引 =========
+class DiaryIndex:
+    """
+    <corpus>.idx       每行 "date\\toffset"，只追加
+    <corpus>.idx.json  {"committed": 已索引到的字节位置, "head_sha1": 已索引部分开头（≤4KB）的 sha1}
+    语料被替换（变短或开头内容变化）时自动重建索引；否则只解析 committed 之后新增的部分。
+    """
+
+    HEAD_BYTES = 4096
+
+    def __init__(self, path, index_dir=None, encoding="utf-8"):
+        self.path = str(path)
+        base = os.path.join(index_dir, os.path.basename(self.path)) if index_dir else self.path
+        self.idx_path = base + ".idx"
+        self.state_path = base + ".idx.json"
+        self.encoding = encoding
+        self.by_date = {}
+        self.committed = 0
+        self._load()
+
+    def _head_sha1(self, n):
+        with open(self.path, "rb") as f:
+            return hashlib.sha1(f.read(min(n, self.HEAD_BYTES))).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            with open(self.idx_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    date, off = line.rstrip("\n").split("\t")
+                    self.by_date.setdefault(date, []).append(int(off))
+            self.committed = int(state["committed"])
+            self._head = state.get("head_sha1")
+        except (OSError, ValueError, KeyError):
+            self.by_date, self.committed, self._head = {}, 0, None
+
+    def _stale(self):
+        if os.path.getsize(self.path) < self.committed:
+            return True
+        # 只比较已索引部分的开头（最多 4KB），追加内容不会改变它
+        return self.committed > 0 and self._head != self._head_sha1(self.committed)
+
+    def update(self):
+        """索引新增记录；返回新增的 [(date, offset), ...]。"""
+        if self._stale():
+            self.by_date, self.committed = {}, 0
+            open(self.idx_path, "w").close()
+        new = []
+        end = self.committed
+        with open(self.idx_path, "a", encoding="utf-8") as idx:
+            for rec in iter_records(self.path, start=self.committed, encoding=self.encoding):
+                idx.write(f"{rec['date']}\t{rec['offset']}\n")
+                self.by_date.setdefault(rec["date"], []).append(rec["offset"])
+                new.append((rec["date"], rec["offset"]))
+                end = rec["end"]
+        self.committed = end       # 末尾未完成的记录（只有记录头）下次从头重新解析
+        self._head = self._head_sha1(self.committed)
+        tmp = self.state_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"committed": self.committed, "head_sha1": self._head}, f)
+        os.replace(tmp, self.state_path)
+        return new
+
+    def dates(self):
+        return sorted(self.by_date)
+
+    def read_at(self, offset):
+        return next(iter_records(self.path, start=offset, encoding=self.encoding), None)
+
+    def records_for(self, date):
+        return [self.read_at(off) for off in self.by_date.get(date, [])]
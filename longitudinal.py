@@ -0,0 +1,167 @@
+# longitudinal.py — 同一学生多次筛查的纵向记录（SQLite，本地嵌入式）
+#
+# 每次提交写入 submissions，同时在同一事务里增量更新 student_stats：
+#   - 融合风险的 EWMA（按提交次序，alpha 默认 0.3）
+#   - 周均值与环比（本周均值 − 上一个有记录周的均值，周按 ISO 周计）
+#   - 处于各判定区间（safe/warn/high）的累计时长：两次提交之间的时间记到前一次的判定上
+# 查询某个学生的汇总只读一行（主键查找），与历史长度无关。
+# 极少数「补录更早的记录」会对该学生从历史重新累计一次，保证结果与顺序写入一致。
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from scoring import verdict_level
+
+DEFAULT_DB = os.environ.get("DEYU_HISTORY_DB", "screening_history.sqlite3")
+BANDS = ("safe", "warn", "high")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    proba_behavior REAL,
+    proba_text REAL,
+    proba_final REAL NOT NULL,
+    w_behavior REAL,
+    verdict TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_student_ts ON submissions(student_id, ts);
+CREATE TABLE IF NOT EXISTS student_stats (
+    student_id TEXT PRIMARY KEY,
+    n INTEGER NOT NULL,
+    first_ts REAL NOT NULL,
+    last_ts REAL NOT NULL,
+    last_final REAL NOT NULL,
+    last_verdict TEXT NOT NULL,
+    ewma REAL NOT NULL,
+    cur_week TEXT NOT NULL,
+    cur_week_n INTEGER NOT NULL,
+    cur_week_sum REAL NOT NULL,
+    prev_week TEXT,
+    prev_week_mean REAL,
+    time_safe REAL NOT NULL DEFAULT 0,
+    time_warn REAL NOT NULL DEFAULT 0,
+    time_high REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+def iso_week(ts) -> str:
+    y, w, _ = datetime.fromtimestamp(ts, tz=timezone.utc).isocalendar()
+    return f"{y}-W{w:02d}"
+
+
+def _fold(row, ts, final, verdict, alpha):
+    """把一次提交并入汇总行（dict），返回新的汇总行；row 为 None 表示该学生的第一条记录。"""
+    week = iso_week(ts)
+    if row is None:
+        return {"n": 1, "first_ts": ts, "last_ts": ts, "last_final": final, "last_verdict": verdict,
+                "ewma": final, "cur_week": week, "cur_week_n": 1, "cur_week_sum": final,
+                "prev_week": None, "prev_week_mean": None,
+                "time_safe": 0.0, "time_warn": 0.0, "time_high": 0.0}
+    row = dict(row)
+    row[f"time_{row['last_verdict']}"] += max(0.0, ts - row["last_ts"])
+    row["ewma"] = alpha * final + (1.0 - alpha) * row["ewma"]
+    if week == row["cur_week"]:
+        row["cur_week_n"] += 1
+        row["cur_week_sum"] += final
+    else:
+        row["prev_week"] = row["cur_week"]
+        row["prev_week_mean"] = row["cur_week_sum"] / row["cur_week_n"]
+        row["cur_week"], row["cur_week_n"], row["cur_week_sum"] = week, 1, final
+    row["n"] += 1
+    row["last_ts"], row["last_final"], row["last_verdict"] = ts, final, verdict
+    return row
+
+
+class LongitudinalStore:
+    def __init__(self, path=DEFAULT_DB, alpha=0.3):
+        self.path = str(path)
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def _write_stats(self, student_id, row):
+        cols = ["student_id"] + list(row)
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO student_stats ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            [student_id] + list(row.values()))
+
+    def record(self, student_id, proba_final, proba_behavior=None, proba_text=None, w_behavior=None, ts=None):
+        """写入一次提交并增量更新汇总；返回更新后的汇总（同 stats()）。"""
+        ts = time.time() if ts is None else float(ts)
+        final = float(proba_final)
+        verdict = verdict_level(final)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO submissions (student_id, ts, proba_behavior, proba_text, proba_final, w_behavior, verdict)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (student_id, ts, proba_behavior, proba_text, final, w_behavior, verdict))
+            cur = self._conn.execute("SELECT * FROM student_stats WHERE student_id = ?", (student_id,)).fetchone()
+            row = None if cur is None else {k: cur[k] for k in cur.keys() if k != "student_id"}
+            if row is not None and ts < row["last_ts"]:
+                row = self._rebuild(student_id)          # 补录：按时间顺序重新累计该学生
+            else:
+                row = _fold(row, ts, final, verdict, self.alpha)
+            self._write_stats(student_id, row)
+        return self._summarize(student_id, row)
+
+    def _rebuild(self, student_id):
+        row = None
+        for r in self._conn.execute(
+                "SELECT ts, proba_final, verdict FROM submissions WHERE student_id = ? ORDER BY ts, id",
+                (student_id,)):
+            row = _fold(row, r["ts"], r["proba_final"], r["verdict"], self.alpha)
+        return row
+
+    @staticmethod
+    def _summarize(student_id, row):
+        if row is None:
+            return None
+        week_mean = row["cur_week_sum"] / row["cur_week_n"]
+        wow = None if row["prev_week_mean"] is None else week_mean - row["prev_week_mean"]
+        return {
+            "student_id": student_id,
+            "n": row["n"],
+            "first_ts": row["first_ts"],
+            "last_ts": row["last_ts"],
+            "last_final": row["last_final"],
+            "last_verdict": row["last_verdict"],
+            "ewma": row["ewma"],
+            "week": row["cur_week"],
+            "week_mean": week_mean,
+            "prev_week": row["prev_week"],
+            "wow_delta": wow,
+            "time_in_band": {b: row[f"time_{b}"] for b in BANDS},
+        }
+
+    def stats(self, student_id):
+        """某个学生的预计算汇总（一次主键查找）；没有记录时返回 None。"""
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM student_stats WHERE student_id = ?", (student_id,)).fetchone()
+        if cur is None:
+            return None
+        return self._summarize(student_id, {k: cur[k] for k in cur.keys() if k != "student_id"})
+
+    def history(self, student_id, limit=104) -> pd.DataFrame:
+        """最近 limit 次提交（按时间升序），用于画趋势线。"""
+        with self._lock:
+            df = pd.read_sql_query(
+                "SELECT ts, proba_behavior, proba_text, proba_final, verdict FROM submissions"
+                " WHERE student_id = ? ORDER BY ts DESC, id DESC LIMIT ?",
+                self._conn, params=(student_id, int(limit)))
+        df = df.iloc[::-1].reset_index(drop=True)
+        df["time"] = pd.to_datetime(df["ts"], unit="s")
+        return df
@@ -0,0 +1,373 @@
+# registry.py — 模型清单（行为/文本模型）、后台预加载、文件变化热替换、LRU 内存上限
+#
+# 清单 models.json（路径相对清单所在目录）：
+#   {"models": [
+#     {"name": "svm_pca_behavior", "kind": "behavior",
+#      "path": "svm_pca_behavior_pipeline.pkl", "meta": "svm_pca_behavior_meta.json",
+#      "sha1": "…", "sklearn_version": "1.3.0", "preload": true},
+#     {"name": "seq_cnn", "kind": "behavior", "path": "seq_cnn.ts", "preload": true},
+#     {"name": "text_tfidf", "kind": "text", "path": "pipe_text_final.pkl", "preload": false}
+#   ]}
+#
+# - get(name)：已加载的直接返回当前版本；未加载时在调用线程里加载（同名并发只加载一次）。
+# - start()：后台线程先预加载 preload=true 的模型，之后每 poll_interval 秒检查清单与 pkl 的
+#   (mtime, size)；文件变化时在后台加载新版本，校验通过后整体替换引用，正在使用旧版本的会话不受影响。
+# - 已加载模型数超过 max_loaded 时按最近使用顺序淘汰。
+#
+# 生成/更新清单条目（自动计算 sha1，并从 pkl 中读出训练时的 sklearn 版本）：
+#   python registry.py add --name svm_pca_behavior --kind behavior \
+#       --path svm_pca_behavior_pipeline.pkl --meta svm_pca_behavior_meta.json --preload
+import argparse
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+
+from compiled_model import load_compiled_for
+
+DEFAULT_MANIFEST = os.environ.get("DEYU_MODEL_MANIFEST", "models.json")
+MAX_LOADED_MODELS = int(os.environ.get("DEYU_MAX_MODELS", "4"))
+KINDS = ("behavior", "text")
+
+
+def installed_sklearn_version():
+    try:
+        from importlib.metadata import version
+        return version("scikit-learn")
+    except Exception:
+        return None
+
+
+class ModelEntry:
+    """清单中的一条记录；路径已解析为绝对路径。"""
+
+    def __init__(self, name, kind, path, meta=None, sha1=None, sklearn_version=None, preload=False):
+        if kind not in KINDS:
+            raise ValueError(f"未知模型类型 {kind!r}（应为 {'/'.join(KINDS)}）")
+        self.name = name
+        self.kind = kind
+        self.path = str(path)
+        self.meta_path = None if meta is None else str(meta)
+        self.sha1 = sha1
+        self.sklearn_version = sklearn_version
+        self.preload = bool(preload)
+
+    @classmethod
+    def from_dict(cls, d, base_dir):
+        def resolve(p):
+            return None if p is None else str((Path(base_dir) / p).resolve())
+        return cls(d["name"], d.get("kind", "behavior"), resolve(d["path"]), resolve(d.get("meta")),
+                   d.get("sha1"), d.get("sklearn_version"), d.get("preload", False))
+
+    def key(self):
+        return (self.kind, self.path, self.meta_path, self.sha1)
+
+
+class LoadedModel:
+    """一个已加载的模型版本；model/meta 只读，热替换时整体换成新的 LoadedModel。"""
+
+    def __init__(self, entry, model, meta, features, file_key, sha1, load_ms, trained_sklearn=None,
+                 backend="sklearn"):
+        self.entry = entry
+        self.model = model
+        self.backend = backend
+        self.meta = meta
+        self.features = features
+        self.file_key = file_key
+        self.sha1 = sha1
+        self.version = sha1[:12]
+        self.load_ms = load_ms
+        self.loaded_at = time.time()
+        self.trained_sklearn = trained_sklearn or entry.sklearn_version
+        self.warnings = []
+        installed = installed_sklearn_version()
+        if backend == "sklearn" and self.trained_sklearn and installed and self.trained_sklearn != installed:
+            self.warnings.append(f"模型由 scikit-learn {self.trained_sklearn} 训练，当前环境为 {installed}")
+
+
+def _file_key(path):
+    st_ = os.stat(path)
+    return (st_.st_mtime_ns, st_.st_size)
+
+
+def _deserialize(data):
+    """从内存字节反序列化（joblib 优先）；返回 (model, 训练时的 sklearn 版本或 None)。"""
+    trained = None
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        try:
+            import joblib
+            model = joblib.load(io.BytesIO(data))
+        except ImportError:
+            import pickle
+            model = pickle.loads(data)
+    for w in caught:
+        v = getattr(w.message, "original_sklearn_version", None)
+        if v:
+            trained = v
+            break
+    return model, trained
+
+
+def load_entry(entry: ModelEntry) -> LoadedModel:
+    """
+    读取 pkl 字节 → 校验 sha1 → 反序列化。先整体读入内存再解析，
+    保证校验的内容与加载的内容是同一份（文件在读取过程中被覆盖也不会混用）。
+    """
+    t0 = time.perf_counter()
+    key = _file_key(entry.path)
+    with open(entry.path, "rb") as f:
+        data = f.read()
+    sha1 = hashlib.sha1(data).hexdigest()
+    if entry.sha1 and entry.sha1 != sha1:
+        raise ValueError(f"{entry.name}: 文件 sha1 {sha1[:12]} 与清单记录 {entry.sha1[:12]} 不一致")
+    if entry.kind == "behavior" and entry.path.endswith(".ts"):
+        # 序列模型（seq_serving.py）：meta 打包在 .ts 里，加载时已预热
+        from seq_serving import SeqBackend
+        model, trained, backend = SeqBackend.from_bytes(data), None, "torchscript"
+    else:
+        # 行为模型旁边有对应这份 pkl 的编译产物（compiled_model.py）时直接用它，不反序列化 pkl
+        model = load_compiled_for(entry.path, sha1) if entry.kind == "behavior" else None
+        if model is not None:
+            trained, backend = model.header.get("sklearn_version"), "compiled"
+        else:
+            (model, trained), backend = _deserialize(data), "sklearn"
+    meta, features = {}, []
+    if entry.meta_path:
+        with open(entry.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        features = list(meta.get("features", []))
+    elif backend == "torchscript":
+        meta, features = model.meta, list(model.features)
+    return LoadedModel(entry, model, meta, features, key, sha1, (time.perf_counter() - t0) * 1000.0, trained,
+                       backend)
+
+
+# ========= 注册表 =========
+class ModelRegistry:
+    def __init__(self, manifest_path=DEFAULT_MANIFEST, max_loaded=MAX_LOADED_MODELS, poll_interval=2.0):
+        self.manifest_path = str(manifest_path)
+        self.max_loaded = max(1, int(max_loaded))
+        self.poll_interval = poll_interval
+        self.entries = OrderedDict()
+        self.errors = {}
+        self._loaded = OrderedDict()          # name → LoadedModel，按最近使用排序
+        self._lock = threading.Lock()
+        self._name_locks = {}
+        self._failed = {}                     # name → 上次加载失败时的 (entry key, file key)，避免每轮重试
+        self._manifest_key = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.swaps = 0
+        self.reload_manifest()
+
+    # ----- 清单 -----
+    def reload_manifest(self):
+        """重新读取清单；被删除的条目立即卸载，内容变化的条目继续用旧版本，直到后台加载好新版本。"""
+        key = _file_key(self.manifest_path)
+        if key == self._manifest_key:
+            return False
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        base_dir = Path(self.manifest_path).resolve().parent
+        entries = OrderedDict()
+        for d in raw.get("models", []):
+            e = ModelEntry.from_dict(d, base_dir)
+            entries[e.name] = e
+        with self._lock:
+            for name in list(self._loaded):
+                if name not in entries:
+                    del self._loaded[name]
+            self.entries = entries
+            self._manifest_key = key
+        return True
+
+    def is_loaded(self, name):
+        with self._lock:
+            return name in self._loaded
+
+    def names(self, kind=None):
+        return [n for n, e in self.entries.items() if kind is None or e.kind == kind]
+
+    # ----- 加载 -----
+    def _name_lock(self, name):
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def _install(self, name, lm):
+        with self._lock:
+            e = self.entries.get(name)
+            if e is None or e.key() != lm.entry.key():
+                return                         # 加载期间清单已变更，丢弃
+            replaced = name in self._loaded
+            self._loaded[name] = lm
+            self._loaded.move_to_end(name)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+            if replaced:
+                self.swaps += 1
+            self.errors.pop(name, None)
+
+    def get(self, name) -> LoadedModel:
+        """返回该模型当前版本；未加载时同步加载（同名只加载一次）。"""
+        with self._lock:
+            lm = self._loaded.get(name)
+            if lm is not None:
+                self._loaded.move_to_end(name)
+                return lm
+            entry = self.entries.get(name)
+        if entry is None:
+            raise KeyError(f"清单中没有模型 {name!r}")
+        with self._name_lock(name):
+            with self._lock:
+                lm = self._loaded.get(name)
+            if lm is not None:
+                return lm
+            try:
+                lm = load_entry(entry)
+            except Exception as e:
+                self.errors[name] = f"{type(e).__name__}: {e}"
+                raise
+            self._install(name, lm)
+            return lm
+
+    def _refresh(self, name):
+        """文件变化时在后台加载新版本并替换；失败时保留旧版本并记录错误。"""
+        with self._lock:
+            lm = self._loaded.get(name)
+            entry = self.entries.get(name)
+        if lm is None or entry is None:
+            return False
+        try:
+            fkey = _file_key(entry.path)
+        except OSError:
+            return False                       # 文件正被替换（短暂不存在），下一轮再看
+        if fkey == lm.file_key and entry.key() == lm.entry.key():
+            return False
+        if self._failed.get(name) == (entry.key(), fkey):
+            return False
+        with self._name_lock(name):
+            try:
+                new = load_entry(entry)
+            except Exception as e:
+                self.errors[name] = f"{type(e).__name__}: {e}"
+                self._failed[name] = (entry.key(), fkey)
+                return False
+            self._failed.pop(name, None)
+            if new.sha1 == lm.sha1 and entry.key() == lm.entry.key():
+                with self._lock:
+                    lm.file_key = new.file_key     # 仅 mtime 变化（如 touch），内容相同
+                return False
+            self._install(name, new)
+            return True
+
+    # ----- 后台线程 -----
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        for name, e in list(self.entries.items()):
+            if self._stop.is_set():
+                return
+            if e.preload and len(self._loaded) < self.max_loaded:
+                try:
+                    self.get(name)
+                except Exception:
+                    pass                       # 已记录在 errors 里
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload_manifest()
+            except (OSError, ValueError, KeyError) as e:
+                self.errors["<manifest>"] = f"{type(e).__name__}: {e}"
+            for name in list(self._loaded):
+                self._refresh(name)
+
+    def status(self):
+        """每个条目一行：是否已加载、版本、加载耗时、警告/错误（供侧边栏展示）。"""
+        with self._lock:
+            loaded = dict(self._loaded)
+        rows = []
+        for name, e in self.entries.items():
+            lm = loaded.get(name)
+            rows.append({
+                "name": name, "kind": e.kind, "loaded": lm is not None,
+                "version": lm.version if lm else None,
+                "backend": lm.backend if lm else None,
+                "load_ms": round(lm.load_ms, 1) if lm else None,
+                "sklearn": lm.trained_sklearn if lm else e.sklearn_version,
+                "note": "; ".join(([self.errors[name]] if name in self.errors else []) + (lm.warnings if lm else [])),
+            })
+        return rows
+
+
+# ========= CLI：维护清单 =========
+def add_entry(manifest_path, name, kind, path, meta=None, preload=False):
+    """添加/更新清单条目（path/meta 相对清单所在目录）；会实际加载一次以计算 sha1、确认可用。"""
+    manifest_path = Path(manifest_path)
+    raw = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {"models": []}
+    base_dir = manifest_path.resolve().parent
+    entry = ModelEntry(name, kind, (base_dir / path).resolve(),
+                       None if meta is None else (base_dir / meta).resolve())
+    lm = load_entry(entry)
+    d = {"name": name, "kind": kind, "path": str(path)}
+    if meta:
+        d["meta"] = str(meta)
+    d["sha1"] = lm.sha1
+    d["sklearn_version"] = lm.trained_sklearn or installed_sklearn_version()
+    d["preload"] = bool(preload)
+    raw["models"] = [m for m in raw.get("models", []) if m.get("name") != name] + [d]
+    tmp = manifest_path.with_name(manifest_path.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(raw, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    os.replace(tmp, manifest_path)
+    return d
+
+
+def _cmd_add(args):
+    d = add_entry(args.manifest, args.name, args.kind, args.path, args.meta, args.preload)
+    print(f"已写入 {args.manifest}：{args.name}（sha1 {d['sha1'][:12]}，sklearn {d['sklearn_version']}）")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="模型清单维护")
+    ap.add_argument("--manifest", default=DEFAULT_MANIFEST)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_add = sub.add_parser("add", help="添加/更新一个模型条目（计算 sha1）")
+    p_add.add_argument("--name", required=True)
+    p_add.add_argument("--kind", choices=KINDS, default="behavior")
+    p_add.add_argument("--path", required=True, help="pkl 路径（相对清单所在目录）")
+    p_add.add_argument("--meta", default=None, help="meta json 路径（行为模型必填）")
+    p_add.add_argument("--preload", action="store_true")
+    p_list = sub.add_parser("list", help="加载并列出全部条目")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "add":
+        if args.kind == "behavior" and not args.meta:
+            ap.error("行为模型需要 --meta")
+        _cmd_add(args)
+    else:
+        reg = ModelRegistry(args.manifest)
+        for name in reg.names():
+            try:
+                reg.get(name)
+            except Exception:
+                pass
+        for row in reg.status():
+            print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
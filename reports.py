@@ -0,0 +1,452 @@
+# reports.py — 批量生成个人筛查报告（HTML），后台进程池渲染并打包成 zip
+#
+# 用法（命令行）：
+#   python reports.py class_export.csv -o class_reports.zip --id-col student_id
+# 或在 app「批量筛查」页：评分完成后点击「生成个人报告」，进度实时刷新，完成后下载 zip。
+#
+# - 每份报告包含：风险仪表盘、z 分数条形图（Top 15 |z|）、百分位条形图、|z| ≥ 2 的异常指标表，
+#   图表样式与结果页一致；浏览器打开后可直接「打印 → 另存为 PDF」（环境里没有 kaleido 等服务端 PDF 渲染器）。
+# - zip 内 plotly.min.js 与图表模板（report_assets.js）各只有一份，单份报告只含该生的数据（几 KB），离线可看。
+# - 渲染在独立的工作进程中进行（spawn，默认 2 个，可用 DEYU_REPORT_WORKERS 修改，并降低调度优先级），
+#   不占用 Streamlit 进程的 GIL：生成几百份报告时其他用户的页面照常响应。
+#   基线与题干每个任务只写入任务目录一次，工作进程按任务缓存评分器，提交的每块只带记录；
+#   整块（REPORT_CHUNK 份）向量化计算 z / 百分位；图表规格是预先写好的模板，
+#   每份报告只填入数据，不在渲染时构建 plotly Figure。
+# - 任务由后台线程调度：解析上传文件、按块提交、汇总进度、最后写出 index.html 与 zip（原子替换）；
+#   工作进程崩溃导致进程池损坏时丢弃该池，下一个任务重新创建；
+#   产物在 .cache/reports/<任务号>/ 下，只保留最近 MAX_JOBS 个任务。
+import argparse
+import html
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+
+from baseline import save_baseline
+from dataset import CACHE_DIR as _DATASET_CACHE_DIR
+from scoring import RISK_HIGH, RISK_WARN, DeviationScorer, verdict_level, verdict_text
+
+REPORT_WORKERS = int(os.environ.get("DEYU_REPORT_WORKERS", "2"))
+REPORT_CHUNK = 25
+REPORT_DIR = _DATASET_CACHE_DIR.parent / "reports"
+MAX_JOBS = 20
+TOP_K = 15
+FLAG_Z = 2.0       # 与结果页「异常指标（|z| ≥ 2）」一致
+
+VERDICT_COLOR = {"high": "#C62828", "warn": "#F9A825", "safe": "#2E7D32"}
+
+
+# ========= 图表模板 =========
+# 与结果页相同的三张图；模板只描述样式，data 里的 x / y / value 在每份报告中填入
+GAUGE_SPEC = {
+    "data": [{
+        "type": "indicator", "mode": "gauge+number",
+        "number": {"suffix": "%", "font": {"size": 36}},
+        "gauge": {
+            "axis": {"range": [0, 100]},
+            "bar": {"color": "#636EFA"},
+            "steps": [
+                {"range": [0, RISK_WARN * 100], "color": "#E8F5E9"},
+                {"range": [RISK_WARN * 100, RISK_HIGH * 100], "color": "#FFF9C4"},
+                {"range": [RISK_HIGH * 100, 100], "color": "#FFEBEE"},
+            ],
+            "threshold": {"line": {"color": "red", "width": 3}, "thickness": 0.75, "value": RISK_HIGH * 100},
+        },
+        "title": {"text": "行为风险概率"},
+    }],
+    "layout": {"height": 280, "margin": {"l": 30, "r": 30, "t": 60, "b": 10}},
+}
+ZSCORE_SPEC = {
+    "data": [{"type": "bar", "orientation": "h"}],
+    "layout": {"title": {"text": "行为指标 z 分数"}, "xaxis": {"title": {"text": "z 分数"}},
+               "yaxis": {"title": {"text": "特征"}, "automargin": True}, "height": 460, "showlegend": False},
+}
+PERCENTILE_SPEC = {
+    "data": [{"type": "bar", "orientation": "h"}],
+    "layout": {"title": {"text": "行为指标百分位（Top 影响项）"}, "xaxis": {"range": [0, 100], "title": {"text": "percentile"}},
+               "yaxis": {"title": {"text": "特征"}, "automargin": True}, "height": 460, "showlegend": False},
+}
+
+ASSETS_JS = """window.DEYU_TEMPLATE = %s;
+function drawFigure(id, fig) {
+  fig.layout.template = window.DEYU_TEMPLATE;
+  Plotly.newPlot(id, fig.data, fig.layout, {displayModeBar: false, responsive: true});
+}
+"""
+
+PAGE_CSS = """body{font-family:-apple-system,"PingFang SC","Microsoft YaHei",sans-serif;max-width:960px;margin:24px auto;color:#222}
+h1{font-size:22px;margin-bottom:4px}.muted{color:#777;font-size:13px}.verdict{font-size:18px;font-weight:600;margin:8px 0}
+table{border-collapse:collapse;width:100%;font-size:13px}th,td{border:1px solid #ddd;padding:4px 8px;text-align:right}
+th:first-child,td:first-child{text-align:left}.grid{display:grid;grid-template-columns:1fr 1fr;gap:12px}
+@media print{.grid{grid-template-columns:1fr}.fig{page-break-inside:avoid}}"""
+
+
+def _fill(spec, **data):
+    fig = json.loads(json.dumps(spec))
+    fig["data"][0].update(data)
+    return fig
+
+
+def _dumps(obj):
+    # </script> 不能出现在内联脚本里
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/")
+
+
+# ========= 单份报告（工作进程内） =========
+_CONTEXTS = {}      # 任务上下文键 → (DeviationScorer, labels, title)；每个工作进程每个任务只读取一次
+
+
+def _init_worker():
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = "1"
+    try:
+        os.nice(5)          # 报告渲染让位于交互请求
+    except (AttributeError, OSError):
+        pass
+
+
+def _context_for(key, context_dir):
+    """任务上下文（基线 + 题干 + 标题）由调度线程写入任务目录一次，工作进程按键缓存，块里只带键和路径。"""
+    ctx = _CONTEXTS.get(key)
+    if ctx is None:
+        from baseline import load_baseline
+
+        with open(Path(context_dir) / "context.json", "r", encoding="utf-8") as f:
+            extra = json.load(f)
+        baseline = load_baseline(Path(context_dir) / "baseline.npz")
+        if baseline is None:
+            raise RuntimeError(f"无法读取任务基线：{context_dir}")
+        while len(_CONTEXTS) >= 4:  # 只保留最近几个任务，避免常驻进程里无限累积
+            _CONTEXTS.pop(next(iter(_CONTEXTS)))
+        ctx = _CONTEXTS[key] = (DeviationScorer(baseline), extra["labels"], extra["title"])
+    return ctx
+
+
+def _fmt(v, digits=3):
+    if v is None or (isinstance(v, float) and not np.isfinite(v)):
+        return "—"
+    return f"{v:.{digits}f}" if isinstance(v, (float, np.floating)) else html.escape(str(v))
+
+
+def render_report(rec, z, pct, scorer, labels, title=""):
+    """一份报告的 HTML。rec：{"id", "proba", "values"}；z / pct：该生按 scorer.features 顺序的 [F] 向量。"""
+    label = (lambda c: labels.get(c, c)) if labels else (lambda c: c)
+    proba = float(rec["proba"])
+    level = verdict_level(proba)
+    idx = np.flatnonzero(np.isfinite(z) | np.isfinite(pct))
+    idx = idx[np.argsort(-np.nan_to_num(np.abs(z[idx]), nan=-1.0), kind="stable")]
+    top = idx[:TOP_K]
+    names = [label(scorer.features[i]) for i in top]
+    zs = [None if not np.isfinite(z[i]) else round(float(z[i]), 4) for i in top]
+    figs = {
+        "gauge": _fill(GAUGE_SPEC, value=round(proba * 100, 2)),
+        "zscore": _fill(ZSCORE_SPEC, x=zs, y=names,
+                        marker={"color": ["#EF553B" if (v or 0) >= 0 else "#00CC96" for v in zs]}),
+        "percentile": _fill(PERCENTILE_SPEC, x=[None if not np.isfinite(pct[i]) else round(float(pct[i]), 2)
+                                               for i in top], y=names),
+    }
+    figs["zscore"]["layout"]["title"]["text"] = f"行为指标 z 分数（Top {len(top)} |z|）"
+
+    flagged = [i for i in idx if np.isfinite(z[i]) and abs(z[i]) >= FLAG_Z]
+    values = rec.get("values") or {}
+    if flagged:
+        rows = "".join(
+            f"<tr><td>{html.escape(label(scorer.features[i]))}</td><td>{_fmt(values.get(scorer.features[i]))}</td>"
+            f"<td>{_fmt(scorer.mean[i])}</td><td>{_fmt(scorer.std[i])}</td><td>{_fmt(z[i])}</td>"
+            f"<td>{_fmt(pct[i], 1)}</td></tr>" for i in flagged)
+        table = ("<table><tr><th>feature</th><th>value</th><th>mean</th><th>std</th><th>z</th><th>percentile</th></tr>"
+                 f"{rows}</table>")
+    else:
+        table = "<p>未发现 |z| ≥ 2 的异常指标。</p>"
+
+    sid = html.escape(str(rec["id"]))
+    scripts = "".join(f"drawFigure('{k}', {_dumps(v)});" for k, v in figs.items())
+    return (f"<!DOCTYPE html><html lang=\"zh\"><head><meta charset=\"utf-8\"><title>筛查报告 · {sid}</title>"
+            f"<style>{PAGE_CSS}</style><script src=\"../plotly.min.js\"></script>"
+            f"<script src=\"../report_assets.js\"></script></head><body>"
+            f"<h1>行为问卷筛查报告 · {sid}</h1><div class=\"muted\">{html.escape(title)}"
+            f" · 生成于 {time.strftime('%Y-%m-%d %H:%M')}</div>"
+            f"<div class=\"verdict\" style=\"color:{VERDICT_COLOR[level]}\">判定：{html.escape(verdict_text(proba))}</div>"
+            f"<div id=\"gauge\" class=\"fig\"></div><div class=\"grid\"><div id=\"zscore\" class=\"fig\"></div>"
+            f"<div id=\"percentile\" class=\"fig\"></div></div>"
+            f"<h2>异常指标（|z| ≥ {FLAG_Z:g}）</h2>{table}"
+            f"<p class=\"muted\">z 分数与百分位相对于参照人群基线；本报告仅供筛查参考，不构成诊断。</p>"
+            f"<script>{scripts}</script></body></html>")
+
+
+def _safe_name(i, rid):
+    return f"{i:05d}_{re.sub(r'[^0-9A-Za-z_.-]+', '_', str(rid))[:60]}.html"
+
+
+def render_chunk(out_dir, start, records, context_key, context_dir):
+    """工作进程：一块记录整体计算 z / 百分位，逐份写出 HTML；返回 index 用的摘要行。"""
+    scorer, labels, title = _context_for(context_key, context_dir)
+    X = scorer.matrix([r.get("values") or {} for r in records])
+    z, pct = scorer.score(X)
+    out = []
+    for j, rec in enumerate(records):
+        name = _safe_name(start + j, rec["id"])
+        try:
+            page = render_report(rec, z[j], pct[j], scorer, labels, title)
+            with open(Path(out_dir) / name, "w", encoding="utf-8") as f:
+                f.write(page)
+            with np.errstate(invalid="ignore"):
+                n_flagged = int((np.abs(z[j]) >= FLAG_Z).sum())
+            out.append({"file": name, "id": str(rec["id"]), "proba": float(rec["proba"]),
+                        "verdict": verdict_level(float(rec["proba"])), "n_flagged": n_flagged})
+        except Exception as e:
+            out.append({"file": None, "id": str(rec["id"]), "error": f"{type(e).__name__}: {e}"})
+    return out
+
+
+# ========= 任务调度（app 进程内） =========
+class ReportJob:
+    def __init__(self, job_id, total, out_dir, title=""):
+        self.id = job_id
+        self.total = total
+        self.title = title
+        self.out_dir = Path(out_dir)
+        self.zip_path = self.out_dir / "reports.zip"
+        self.done = 0
+        self.failed = 0
+        self.status = "queued"          # queued / parsing / running / done / error / cancelled
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+
+    @property
+    def progress(self):
+        if self.status in ("queued", "parsing"):
+            return 0.0
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def seconds(self):
+        return (self.finished or time.time()) - self.created
+
+    def cancel(self):
+        self._cancel.set()
+
+    def as_dict(self):
+        return {"id": self.id, "status": self.status, "done": self.done, "failed": self.failed, "total": self.total,
+                "seconds": self.seconds, "error": self.error}
+
+
+def _assets_js():
+    import plotly.io as pio
+
+    return ASSETS_JS % _dumps(pio.templates["plotly"].to_plotly_json())
+
+
+def _plotly_js():
+    from plotly.offline import get_plotlyjs
+
+    return get_plotlyjs()
+
+
+class ReportService:
+    """进程级的报告服务：一个共享的工作进程池 + 若干后台调度线程；多个会话提交的任务在池中排队。"""
+
+    def __init__(self, workers=REPORT_WORKERS, out_dir=REPORT_DIR):
+        self.workers = max(1, int(workers))
+        self.out_dir = Path(out_dir)
+        self.jobs = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn：不 fork 带着 Streamlit 线程与大对象的父进程
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker)
+            return self._pool
+
+    def submit(self, records, baseline, labels=None, title=""):
+        """
+        records：[{"id", "proba", "values": {特征: 取值}}]，或返回这样列表的无参函数
+        （在后台线程中调用，用于把上传文件的解析也挪出 Streamlit 脚本线程）。立即返回任务号。
+        """
+        self._prune()
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        job = ReportJob(job_id, 0 if callable(records) else len(records), self.out_dir / job_id, title)
+        with self._lock:
+            self.jobs[job_id] = job
+        threading.Thread(target=self._run, args=(job, records, baseline, dict(labels or {})),
+                         name=f"reports-{job_id}", daemon=True).start()
+        return job_id
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _write_context(self, job, baseline, labels):
+        ctx = job.out_dir / "context"
+        ctx.mkdir(parents=True, exist_ok=True)
+        save_baseline(baseline, ctx / "baseline.npz")
+        with open(ctx / "context.json", "w", encoding="utf-8") as f:
+            json.dump({"labels": labels, "title": job.title}, f, ensure_ascii=False)
+        return ctx
+
+    def _run(self, job, records, baseline, labels):
+        pages = job.out_dir / "reports"
+        try:
+            if callable(records):
+                job.status = "parsing"
+                records = records()
+                job.total = len(records)
+            pages.mkdir(parents=True, exist_ok=True)
+            # 基线与题干每个任务只写一次；块里只带记录、上下文键与目录
+            ctx = self._write_context(job, baseline, labels)
+            job.status = "running"
+            pool = self._executor()
+            futures = [pool.submit(render_chunk, str(pages), s, records[s:s + REPORT_CHUNK], job.id, str(ctx))
+                       for s in range(0, len(records), REPORT_CHUNK)]
+            rows = []
+            for fut in as_completed(futures):
+                if job._cancel.is_set():
+                    for f in futures:
+                        f.cancel()
+                    job.status = "cancelled"
+                    return
+                part = fut.result()
+                rows.extend(part)
+                job.failed += sum(1 for r in part if r.get("file") is None)
+                job.done += len(part)
+            rows.sort(key=lambda r: r["file"] or "")
+            self._write_zip(job, pages, rows)
+            job.status = "done"
+        except BrokenProcessPool as e:
+            # 某个工作进程崩溃（被 OOM 杀掉等）后整个池不可再用：丢弃它，下一个任务重新建池
+            self._reset_pool()
+            job.status = "error"
+            job.error = f"报告工作进程异常退出，请重试（{type(e).__name__}）"
+            print(f"report job {job.id} failed: worker pool broken, resetting")
+        except Exception as e:
+            job.status = "error"
+            job.error = f"{type(e).__name__}: {e}"
+            print(f"report job {job.id} failed:", job.error)
+        finally:
+            job.finished = time.time()
+            shutil.rmtree(pages, ignore_errors=True)     # 单份 HTML 已打进 zip
+            shutil.rmtree(job.out_dir / "context", ignore_errors=True)
+
+    def _reset_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _write_zip(self, job, pages, rows):
+        index = "".join(
+            f"<tr><td><a href=\"reports/{r['file']}\">{html.escape(r['id'])}</a></td><td>{r['proba']:.3f}</td>"
+            f"<td style=\"color:{VERDICT_COLOR[r['verdict']]}\">{r['verdict']}</td><td>{r['n_flagged']}</td></tr>"
+            for r in rows if r.get("file"))
+        errors = "".join(f"<li>{html.escape(r['id'])}：{html.escape(r['error'])}</li>" for r in rows if r.get("error"))
+        index_html = (f"<!DOCTYPE html><html lang=\"zh\"><head><meta charset=\"utf-8\"><title>筛查报告索引</title>"
+                      f"<style>{PAGE_CSS}</style></head><body><h1>筛查报告索引</h1>"
+                      f"<div class=\"muted\">{html.escape(job.title)} · {len(rows) - job.failed} 份</div>"
+                      f"<table><tr><th>编号</th><th>行为风险概率</th><th>判定</th><th>|z| ≥ 2 项数</th></tr>{index}</table>"
+                      + (f"<h2>生成失败</h2><ul>{errors}</ul>" if errors else "") + "</body></html>")
+        tmp = job.zip_path.with_name(f"{job.zip_path.name}.{os.getpid()}.tmp")
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+            zf.writestr("index.html", index_html)
+            zf.writestr("plotly.min.js", _plotly_js())
+            zf.writestr("report_assets.js", _assets_js())
+            for r in rows:
+                if r.get("file"):
+                    zf.write(pages / r["file"], f"reports/{r['file']}")
+        os.replace(tmp, job.zip_path)
+
+    def _prune(self):
+        with self._lock:
+            finished = sorted((j for j in self.jobs.values() if j.finished), key=lambda j: j.created)
+            for job in finished[:max(0, len(self.jobs) - MAX_JOBS)]:
+                shutil.rmtree(job.out_dir, ignore_errors=True)
+                del self.jobs[job.id]
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+
+def records_from_upload(raw_path, scored_path, model_features, id_col=None):
+    """上传文件 + batch.score_upload 的结果 csv（均为临时文件路径）→ 记录（app 在后台线程中调用，见 submit）。"""
+    import pandas as pd
+
+    from batch import iter_chunks
+
+    df = pd.concat(list(iter_chunks(raw_path)), ignore_index=True)
+    proba = pd.read_csv(scored_path, usecols=["proba_behavior"])["proba_behavior"].to_numpy()
+    return build_records(df, proba, model_features, id_col)
+
+
+def build_records(df, proba, model_features, id_col=None):
+    """上传的问卷表 + 行为概率 → submit 用的记录；没有编号列时用行号。"""
+    feats = [c for c in model_features if c in df.columns]
+    values = df[feats].to_dict("records")
+    ids = df[id_col].astype(str).tolist() if id_col and id_col in df.columns else [str(i + 1) for i in range(len(df))]
+    return [{"id": rid, "proba": float(p),
+             "values": {k: v for k, v in vals.items() if v is not None and not (isinstance(v, float) and np.isnan(v))}}
+            for rid, p, vals in zip(ids, proba, values)]
+
+
+# ========= CLI =========
+def main(argv=None):
+    import pandas as pd
+
+    from baseline import artifact_path_for, load_baseline
+    from batch import iter_chunks, model_input
+    from compiled_model import load_serving_model
+
+    ap = argparse.ArgumentParser(description="批量生成个人筛查报告（HTML，打包为 zip）")
+    ap.add_argument("source", help="问卷导出（csv/xls/xlsx）")
+    ap.add_argument("-o", "--out", required=True, help="输出 zip 路径")
+    ap.add_argument("--model", default="svm_pca_behavior_pipeline.pkl")
+    ap.add_argument("--meta", default="svm_pca_behavior_meta.json")
+    ap.add_argument("--id-col", default=None, help="作为报告编号的列（默认行号）")
+    ap.add_argument("--workers", type=int, default=REPORT_WORKERS)
+    ap.add_argument("--title", default=None)
+    args = ap.parse_args(argv)
+
+    with open(args.meta, "r", encoding="utf-8") as f:
+        model_features = json.load(f).get("features", [])
+    base = load_baseline(artifact_path_for(args.meta))
+    if base is None:
+        raise SystemExit(f"未找到基线产物，请先运行 python baseline.py --meta {args.meta}")
+    pipe = load_serving_model(args.model)
+    df = pd.concat(list(iter_chunks(args.source)), ignore_index=True)
+    proba = pipe.predict_proba(model_input(df, model_features, DeviationScorer(base)))[:, 1]
+    records = build_records(df, proba, model_features, args.id_col)
+
+    service = ReportService(args.workers, Path(args.out).resolve().parent / ".reports_tmp")
+    job = service.get(service.submit(records, base, title=args.title or Path(args.source).name))
+    try:
+        while job.finished is None:
+            time.sleep(0.5)
+            print(f"\r{job.done}/{job.total}", end="", flush=True)
+        print()
+        if job.status != "done":
+            raise SystemExit(f"生成失败：{job.error}")
+        shutil.move(str(job.zip_path), args.out)
+        print(f"完成：{job.total - job.failed} 份报告，用时 {job.seconds:.1f}s，"
+              f"{job.total / max(job.seconds, 1e-9):.0f} 份/秒 → {args.out}")
+    finally:
+        service.shutdown()
+        shutil.rmtree(service.out_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# result_cache.py — 模型输出缓存（LRU + TTL），键为「模型版本 + 规范化输入」的哈希
+#
+# 单人页面里同一份问卷常被反复提交（调整融合权重、展开图表、重复点击），
+# 行为概率只取决于 (行为模型, 特征取值)，文本概率只取决于 (文本模型, 规范化文本)，
+# 融合只是加权和：缓存两路概率后，改 w_behavior 只需重算 fuse()。
+#
+# - feature_key(model_id, record, features)：按特征顺序规范化取值（数值统一成 float、缺失统一成 None）后求 sha1，
+#   1 / 1.0 / "1" 得到同一个键；model_id 应包含模型版本（sha1 或 mtime），模型热替换后旧键自然失效。
+# - text_key(model_id, text)：NFKC + 空白折叠 + 去首尾空白后求 sha1。
+# - 条目数上限 DEYU_RESULT_CACHE_SIZE（默认 4096），存活时间 DEYU_RESULT_CACHE_TTL 秒（默认 3600）。
+import hashlib
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
+
+MAX_ENTRIES = int(os.environ.get("DEYU_RESULT_CACHE_SIZE", "4096"))
+TTL_SECONDS = float(os.environ.get("DEYU_RESULT_CACHE_TTL", "3600"))
+
+_MISSING = object()
+_WS = re.compile(r"\s+")
+
+
+def _canon(v):
+    if v is None:
+        return None
+    if isinstance(v, str):
+        try:
+            f = float(v)
+        except ValueError:
+            return v.strip()
+    else:
+        try:
+            f = float(v)
+        except (TypeError, ValueError):
+            return str(v)
+    return f if math.isfinite(f) else None
+
+
+def _digest(obj):
+    return hashlib.sha1(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def feature_key(model_id, record, features):
+    """行为模型输出的缓存键。"""
+    return _digest(["behavior", str(model_id), [_canon(record.get(c)) for c in features]])
+
+
+def normalize_text(text):
+    return _WS.sub(" ", unicodedata.normalize("NFKC", "" if text is None else str(text))).strip()
+
+
+def text_key(model_id, text):
+    """文本模型输出的缓存键。"""
+    return _digest(["text", str(model_id), normalize_text(text)])
+
+
+class ResultCache:
+    """线程安全的 LRU + TTL 缓存；记录命中/未命中次数。"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, clock=time.monotonic):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl)
+        self._clock = clock
+        self._data = OrderedDict()        # key → (写入时间, value)
+        self._lock = Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def get(self, key, default=None):
+        now = self._clock()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and now - item[0] > self.ttl:
+                del self._data[key]
+                self.expired += 1
+                item = _MISSING
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (self._clock(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, fn):
+        """返回 (value, hit)。计算在锁外进行；并发未命中时可能重复计算，结果相同，后写覆盖先写。"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value, True
+        value = fn()
+        self.put(key, value)
+        return value, False
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._data), "max_entries": self.max_entries, "ttl_s": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else None,
+                    "evictions": self.evictions, "expired": self.expired}
@@ -0,0 +1,273 @@
+# scoring.py — 偏差评分引擎：z 分数与经验百分位（单人或批量，纯 numpy，与 Streamlit 无关）
+#
+# 基线以矩阵形式保存（见 baseline.Baseline）：mean/std 为 [F]，quantiles 为 [F, 99]。
+# 输入 X 的列顺序与 baseline.num_features 一致，形状 [N, F]（单人即 N=1）。
+#
+# 另含模型读取、概率融合与风险判定，以及供 service.py / 批量脚本复用的 ScoringCore。
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+REPORT_COLUMNS = ["feature", "value", "mean", "std", "z", "percentile"]
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class DeviationScorer:
+    def __init__(self, baseline):
+        self.features = list(baseline.num_features)
+        self.mean = np.asarray(baseline.mean, dtype=float)
+        self.std = np.asarray(baseline.std, dtype=float)
+        self.quantiles = np.asarray(baseline.quantiles, dtype=float)     # [F, 99]，每行单调不减
+        self._n_q = self.quantiles.shape[1]
+        # std 为 0/NaN 的特征 z 记为 NaN（与旧版 zscore 一致）
+        sd_ok = np.isfinite(self.std) & (self.std != 0)
+        self._inv_std = np.where(sd_ok, 1.0 / np.where(sd_ok, self.std, 1.0), np.nan)
+        self._q_ok = np.isfinite(self.quantiles).all(axis=1)
+
+    # ---------- 输入整理 ----------
+    def matrix(self, data) -> np.ndarray:
+        """DataFrame / dict / list[dict] → [N, F] float 矩阵；缺失或非数值记为 NaN。"""
+        if isinstance(data, dict):
+            # 单人快速路径：不经过 DataFrame
+            X = np.array([[_to_float(data.get(c)) for c in self.features]], dtype=float)
+            X[~np.isfinite(X)] = np.nan
+            return X
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data))
+        df = df.reindex(columns=self.features)
+        X = df.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+        X[~np.isfinite(X)] = np.nan
+        return X
+
+    # ---------- 核心计算 ----------
+    def zscores(self, X) -> np.ndarray:
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return (X - self.mean) * self._inv_std
+
+    def percentiles(self, X) -> np.ndarray:
+        """
+        按 1..99 分位网格线性插值的经验百分位，结果落在 [1, 99]：
+        低于 1% 分位记 1，不低于 99% 分位记 99；与旧版 empirical_percentile 数值一致。
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        out = np.full(X.shape, np.nan)
+        Q = self.quantiles
+        last = self._n_q
+        for j in range(len(self.features)):     # 循环只在特征维度；每个特征对整批样本一次 searchsorted
+            if not self._q_ok[j]:
+                continue
+            x = X[:, j]
+            k = np.searchsorted(Q[j], x, side="right")   # 满足 q_v <= x 的分位个数
+            inner = (k > 0) & (k < last)
+            kk = np.clip(k, 1, last - 1)
+            v_lo, v_hi = Q[j, kk - 1], Q[j, kk]
+            span = v_hi - v_lo
+            with np.errstate(divide="ignore", invalid="ignore"):
+                interp = np.where(span > 0, kk + (x - v_lo) / span, kk)
+            pct = np.where(inner, interp, np.where(k == 0, 1.0, float(last)))
+            pct = np.clip(pct, 1, last)
+            pct[np.isnan(x)] = np.nan
+            out[:, j] = pct
+        return out
+
+    def score(self, X):
+        """返回 (z, percentile)，形状均为 [N, F]。"""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        return self.zscores(X), self.percentiles(X)
+
+    # ---------- 单人报告 ----------
+    def report(self, values: dict) -> pd.DataFrame:
+        """单个受访者的偏差表（按 |z| 降序），列同旧版 rows：feature/value/mean/std/z/percentile。"""
+        X = self.matrix(values)
+        z, pct = self.score(X)
+        keep = np.isfinite(X[0])
+        idx = np.flatnonzero(keep)
+        rep = pd.DataFrame({
+            "feature": [self.features[i] for i in idx],
+            "value": [values.get(self.features[i]) for i in idx],
+            "mean": self.mean[idx],
+            "std": self.std[idx],
+            "z": z[0, idx],
+            "percentile": pct[0, idx],
+        }, columns=REPORT_COLUMNS)
+        return rep.sort_values("z", key=lambda s: np.abs(s), ascending=False)
+
+
+# ========= 风险判定（阈值与结果页仪表盘分段一致） =========
+RISK_WARN = 0.3
+RISK_HIGH = 0.6
+VERDICT_TEXT = {
+    "high": "🔴 高风险（建议尽快联系专业人士/学校心理中心）",
+    "warn": "🟡 预警（建议进行线上随访或干预）",
+    "safe": "🟢 安全（建议维持良好作息与支持）",
+}
+
+
+def verdict_level(proba):
+    """概率 → 'high' / 'warn' / 'safe'；标量返回 str，数组返回同形状的 object 数组。"""
+    p = np.asarray(proba, dtype=float)
+    level = np.where(p >= RISK_HIGH, "high", np.where(p >= RISK_WARN, "warn", "safe")).astype(object)
+    return str(level) if level.ndim == 0 else level
+
+
+def verdict_text(proba) -> str:
+    return VERDICT_TEXT[verdict_level(proba)]
+
+
+def fuse(proba_behavior, proba_text=None, w_behavior=0.7):
+    """行为/文本概率加权融合；没有文本概率时直接返回行为概率。"""
+    if proba_text is None:
+        return proba_behavior
+    return w_behavior * proba_behavior + (1.0 - w_behavior) * proba_text
+
+
+# ========= 模型与元数据读取（不依赖 Streamlit；app 中再包一层 st.cache_*） =========
+def load_meta_file(meta_path):
+    """返回 (meta, features)；读取失败直接抛异常。"""
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return meta, list(meta.get("features", []))
+
+
+def load_model_file(model_path):
+    """joblib 优先；环境里没有 joblib 时回退到 pickle。"""
+    try:
+        import joblib
+    except Exception:
+        joblib = None
+    if joblib is not None:
+        return joblib.load(model_path)
+    import pickle
+    with open(model_path, "rb") as f:
+        return pickle.load(f)
+
+
+class ScoringCore:
+    """
+    无界面的评分核心：模型、特征列表、人群基线在进程内只加载一次，
+    predict_records 对一批记录只调用一次 predict_proba（文本通道同理）。
+
+    记录格式（dict）：
+        {"id": ..., "features": {"Q1": 3, ...}, "text": "...", "w_behavior": 0.7}
+    没有 "features" 键时，记录本身的键即视为特征。
+    """
+
+    def __init__(self, pipe, model_features, baseline, text_model=None, default_w_behavior=0.7):
+        self.pipe = pipe
+        self.model_features = list(model_features)
+        self.baseline = baseline
+        self.scorer = DeviationScorer(baseline)
+        self.text_model = text_model
+        self.default_w_behavior = default_w_behavior
+
+    @classmethod
+    def from_paths(cls, model_path="svm_pca_behavior_pipeline.pkl", meta_path="svm_pca_behavior_meta.json",
+                   data_path="CNAH2003_public_use.xls", text_model_path=None, **kwargs):
+        from baseline import artifact_path_for, build_baseline, load_baseline
+        from dataset import file_fingerprint, load_population
+
+        from compiled_model import load_serving_model
+
+        _, features = load_meta_file(meta_path)
+        pipe = load_serving_model(model_path)     # 有编译产物时不需要 sklearn
+        sha1 = file_fingerprint(data_path) if data_path and os.path.exists(data_path) else None
+        base = load_baseline(artifact_path_for(meta_path), sha1, features)
+        if base is None:
+            if sha1 is None:
+                raise FileNotFoundError(f"基线产物缺失且数据文件不存在：{data_path}")
+            base = build_baseline(load_population(data_path, features), features, dataset_sha1=sha1)
+        text_model = None
+        if text_model_path:
+            from text_model import load_text_model
+            text_model = load_text_model(text_model_path)
+        return cls(pipe, features, base, text_model=text_model, **kwargs)
+
+    @staticmethod
+    def _features_of(rec):
+        return rec.get("features", rec) if isinstance(rec, dict) else {}
+
+    def check_record(self, rec):
+        """
+        校验并规范化一条记录；返回 (记录, None) 或 (None, 错误信息)。
+        features 必须是对象；w_behavior 缺省或为 null 时取默认值，否则必须是 [0, 1] 内的数字；text 必须是字符串。
+        """
+        if not isinstance(rec, dict):
+            return None, "记录必须是 JSON 对象"
+        feats = self._features_of(rec)
+        if not isinstance(feats, dict):
+            return None, "features 必须是 JSON 对象（特征名 → 取值）"
+        w = rec.get("w_behavior")
+        if w is None:
+            w = self.default_w_behavior
+        elif isinstance(w, bool) or not np.isfinite(_to_float(w)) or not 0.0 <= _to_float(w) <= 1.0:
+            return None, f"w_behavior 必须是 0–1 之间的数字：{w!r}"
+        text = rec.get("text")
+        if text is not None and not isinstance(text, str):
+            return None, "text 必须是字符串"
+        return dict(rec, w_behavior=float(w)), None
+
+    def predict_records(self, records, top_k=5):
+        """
+        成批评分。不合法的记录只在自己的位置返回 {"id", "error"}，不影响同批其他记录；
+        整批计算仍然出错时逐条重试，把异常限定在出错的那一条。
+        """
+        records = list(records)
+        checked = [self.check_record(r) for r in records]
+        out = [{"id": r.get("id") if isinstance(r, dict) else None, "error": err} if err else None
+               for r, (_, err) in zip(records, checked)]
+        valid = [i for i, (rec, _) in enumerate(checked) if rec is not None]
+        if not valid:
+            return out
+        batch = [checked[i][0] for i in valid]
+        try:
+            results = self._predict_valid(batch, top_k)
+        except Exception:
+            results = []
+            for rec in batch:
+                try:
+                    results.extend(self._predict_valid([rec], top_k))
+                except Exception as e:
+                    results.append({"id": rec.get("id"), "error": f"{type(e).__name__}: {e}"})
+        for i, res in zip(valid, results):
+            out[i] = res
+        return out
+
+    def _predict_valid(self, records, top_k):
+        feats = [self._features_of(r) for r in records]
+        X = pd.DataFrame([{c: f.get(c, np.nan) for c in self.model_features} for f in feats],
+                         columns=self.model_features)
+        for c in self.scorer.features:      # 数值特征统一转成数字（JSON 里可能是字符串）
+            X[c] = pd.to_numeric(X[c], errors="coerce")
+        proba_b = self.pipe.predict_proba(X)[:, 1]
+
+        proba_t = [None] * len(records)
+        if self.text_model is not None:
+            from text_model import predict_text_proba
+            probs = predict_text_proba(self.text_model, [r.get("text") for r in records])
+            proba_t = [None if np.isnan(p) else float(p) for p in probs]
+
+        z, pct = self.scorer.score(self.scorer.matrix(feats))
+        out = []
+        for i, rec in enumerate(records):
+            final = float(fuse(float(proba_b[i]), proba_t[i], rec["w_behavior"]))
+            abs_z = np.where(np.isfinite(z[i]), np.abs(z[i]), -1.0)
+            order = np.argsort(-abs_z, kind="stable")[:top_k]
+            out.append({
+                "id": rec.get("id"),
+                "proba_behavior": float(proba_b[i]),
+                "proba_text": proba_t[i],
+                "proba_final": final,
+                "verdict": verdict_level(final),
+                "top_deviations": [
+                    {"feature": self.scorer.features[j], "z": float(z[i, j]), "percentile": float(pct[i, j])}
+                    for j in order if abs_z[j] >= 0
+                ],
+            })
+        return out
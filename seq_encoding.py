@@ -0,0 +1,239 @@
+# seq_encoding.py — 行为特征 → 索引序列（CNN1D / BiGRU 的输入），以及 notebook G1 的选列与标签规则
+#
+# 只依赖 numpy / pandas：训练（train_runner.py）和线上推理共用同一份编码器，
+# 编码器参数（类别取值、分箱边界）随模型一起保存为 JSON，推理时不需要原始训练表。
+#
+# 编码规则（每列一个 vocab，0 = 缺失/未知/padding）：
+#   - 取值个数 2..max_card 的列按类别编码：排序后的取值 → 1..k；推理时与最近类别相差不超过 SNAP_TOLERANCE
+#     的数值输入对齐到该类别（滑块的 0.1 步长不会落到 0），超出范围或无法对应的取值按未知（0）编码并计数
+#   - 取值更多的数值列按分位数分箱：nbins 个等频箱 → 1..nbins
+#   - 其他列（常数列、高基数文本列）丢弃
+# notebook 原实现里 np.digitize 返回 ndarray 却调用了 .fillna，数值分箱分支从未生效，
+# 实际全部走 pd.factorize，且缺失值（-1）被并进了第一个类别；这里两处都按原意修正。
+import json
+
+import numpy as np
+import pandas as pd
+
+ENCODER_VERSION = 1
+LEAKS = ("Q38", "QN24", "Q39", "QN25", "Q40", "QN26")
+EXCLUDE_KW = ("height", "身高", "weight", "体重", "bmi", "age", "年龄", "sex", "gender", "性别",
+              "grade", "年级", "id", "name", "uuid", "uid")
+YES_TOKENS_TEXT = {"yes", "y", "true", "是", "有"}
+LABEL_MAP = {"yes_token": "2", "no_token": "1", "invalid": {"3", "4"}}
+SNAP_TOLERANCE = 0.5    # 数值输入离最近类别超过该距离（如 1..5 量表上的 50、-7）时不对齐，按未知处理
+
+
+# ========= notebook G1：行为特征自动筛选 =========
+def _numeric_values(series):
+    return pd.to_numeric(series, errors="coerce").dropna()
+
+
+def _looks_like_likert(series):
+    s = _numeric_values(series)
+    if s.empty:
+        return False
+    vals = s.unique()
+    return bool(np.all((vals >= 0) & (vals <= 7) & (np.mod(vals, 1) == 0))) and 3 <= len(vals) <= 7
+
+
+def _looks_like_small_count(series, max_value=12):
+    s = _numeric_values(series)
+    if s.empty:
+        return False
+    vals = s.unique()
+    return bool(np.all((vals >= 0) & (vals <= max_value) & (np.mod(vals, 1) == 0))) and len(vals) >= 3
+
+
+def _looks_like_small_category(series, max_card=12):
+    return (series.dtype == "object" or series.dtype.name == "category") \
+        and 2 <= series.nunique(dropna=True) <= max_card
+
+
+def _is_anthro_by_value(series):
+    s = _numeric_values(series)
+    if s.empty or s.nunique() < 15:
+        return False
+    med = s.median()
+    if 120 <= med <= 190 or 30 <= med <= 120 or 8 <= med <= 20:   # 身高 / 体重 / 年龄
+        return True
+    return 12 <= med <= 40 and s.mean() < 50 and s.std() < 20     # 可能是 BMI
+
+
+def select_behavior_features(df: pd.DataFrame, max_card=12, limit=120):
+    """按取值模式筛选行为题列（Likert / 小计数 / 小类别），排除标签泄漏列与人口学、体测列。"""
+    n = len(df)
+
+    def candidates(card):
+        out = []
+        for c in df.columns:
+            if c in LEAKS or any(k in str(c).lower() for k in EXCLUDE_KW):
+                continue
+            col = df[c]
+            if col.notna().sum() <= 0.02 * n or col.nunique(dropna=True) <= 1:
+                continue
+            if col.nunique(dropna=True) > 0.9 * n or _is_anthro_by_value(col):
+                continue
+            if _looks_like_likert(col) or _looks_like_small_count(col) or _looks_like_small_category(col, card):
+                out.append(c)
+        return out
+
+    cols = candidates(max_card) or candidates(20)   # 一列都没有时放宽类别基数上限
+    return cols[:limit]
+
+
+# ========= notebook G1：二分类标签 =========
+def _norm_token(x):
+    s = str(x).strip().lower()
+    try:
+        f = float(s)
+        return str(int(f)) if float(int(f)) == f else s
+    except (ValueError, OverflowError):
+        return s
+
+
+def _is_yes(series):
+    def one(v):
+        if pd.isna(v):
+            return False
+        s = _norm_token(v)
+        if s in LABEL_MAP["invalid"]:
+            return False
+        return s in YES_TOKENS_TEXT or s == LABEL_MAP["yes_token"]
+    return series.map(one).astype(bool)
+
+
+def make_labels(df: pd.DataFrame, strategy="Q38_or_Q39"):
+    """1 = 风险：Q39（或 Q38）回答“是”；3/4 等无效回答记为 0。strategy 可选 'Q39_only'。"""
+    q38 = "Q38" if "Q38" in df.columns else "QN24"
+    q39 = "Q39" if "Q39" in df.columns else "QN25"
+    if q39 not in df.columns:
+        raise KeyError("数据中没有 Q39/QN25 列，无法生成标签")
+    y = _is_yes(df[q39])
+    if strategy != "Q39_only" and q38 in df.columns:
+        y = y | _is_yes(df[q38])
+    return y.astype(int).to_numpy()
+
+
+# ========= 编码器 =========
+class SeqEncoder:
+    def __init__(self, columns):
+        # columns: [{"name", "mode": "cat"|"num", "categories" | "edges", "vocab_size"}, ...]
+        self.columns = list(columns)
+
+    @property
+    def names(self):
+        return [c["name"] for c in self.columns]
+
+    @property
+    def vocab_sizes(self):
+        return [int(c["vocab_size"]) for c in self.columns]
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, features, nbins=5, max_card=12, min_count=50):
+        cols = []
+        for name in features:
+            if name not in df.columns:
+                continue
+            s = df[name]
+            uniq = pd.unique(s.dropna())
+            if 2 <= len(uniq) <= max_card:
+                cats = sorted(uniq.tolist(), key=lambda v: (isinstance(v, str), v))
+                cols.append({"name": name, "mode": "cat", "categories": [_jsonable(v) for v in cats],
+                             "vocab_size": len(cats) + 1})
+                continue
+            num = _numeric_values(s)
+            if len(num) < min_count:
+                continue
+            bins = np.unique(np.quantile(num.to_numpy(dtype=float), np.linspace(0, 1, nbins + 1)))
+            if len(bins) <= 2:
+                continue
+            cols.append({"name": name, "mode": "num", "edges": bins[1:-1].tolist(),
+                         "vocab_size": len(bins)})
+        if not cols:
+            raise ValueError("没有任何行为列能被分箱/类别编码")
+        return cls(cols)
+
+    def transform(self, df: pd.DataFrame, return_unknown=False):
+        """
+        [N, T] int64 索引矩阵；缺列和缺失值编码为 0（padding）。
+        类别列的数值输入在 SNAP_TOLERANCE 内对齐到最近的已知类别（滑块的 0.1 步长、3.0 与 3 之类的差异不会被当成缺失）；
+        超出范围或无法对应的取值（没见过的文字选项）编码为 0。
+        return_unknown=True 时返回 (索引矩阵, {列名: 未知取值个数})；编码器在各会话、服务线程间共享，不在实例上累计状态。
+        """
+        n = len(df)
+        out = np.zeros((n, len(self.columns)), dtype=np.int64)
+        unknown_counts = {}
+        for j, c in enumerate(self.columns):
+            if c["name"] not in df.columns:
+                continue
+            s = df[c["name"]]
+            if c["mode"] == "num":
+                v = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float)
+                idx = np.digitize(v, np.asarray(c["edges"], dtype=float)) + 1
+                out[:, j] = np.where(np.isnan(v), 0, idx)
+            else:
+                idx, unknown = _category_index(c["categories"], s)
+                out[:, j] = idx
+                if unknown:
+                    unknown_counts[c["name"]] = unknown
+        return (out, unknown_counts) if return_unknown else out
+
+    def transform_record(self, record: dict):
+        """单条问卷（列名 → 值）编码成 [1, T]。"""
+        return self.transform(pd.DataFrame([{n: record.get(n) for n in self.names}]))
+
+    def unknown_columns(self, record: dict):
+        """单条问卷中无法对应到任何已知类别的列（超出取值范围或没见过的选项，按缺失编码），供界面提示。"""
+        return [c["name"] for c in self.columns
+                if c["mode"] == "cat" and record.get(c["name"]) is not None
+                and _category_index(c["categories"], pd.Series([record.get(c["name"])], dtype=object))[1]]
+
+    def to_dict(self):
+        return {"version": ENCODER_VERSION, "columns": self.columns}
+
+    @classmethod
+    def from_dict(cls, d):
+        if int(d.get("version", 0)) != ENCODER_VERSION:
+            raise ValueError(f"编码器版本不匹配：{d.get('version')} != {ENCODER_VERSION}")
+        return cls(d["columns"])
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def _category_index(categories, s: pd.Series):
+    """类别列 → (1..k 的索引，0 为缺失/未知；未知的非缺失取值个数)。"""
+    lookup = {v: i + 1 for i, v in enumerate(categories)}
+    num_pos = [i for i, v in enumerate(categories) if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    missing = (s.isna() | s.map(lambda v: isinstance(v, str) and not v.strip())).to_numpy()
+    idx = np.array([lookup.get(_jsonable(v), 0) if not m else 0 for v, m in zip(s, missing)], dtype=np.int64)
+    if num_pos:
+        # 数值类别：没有精确命中的数值输入取最近的类别（与两侧等距时取较小者），距离超过 SNAP_TOLERANCE 的仍为未知
+        cat_vals = np.array([categories[i] for i in num_pos], dtype=float)
+        order = np.argsort(cat_vals)
+        cat_vals, cat_idx = cat_vals[order], np.asarray(num_pos)[order] + 1
+        v = pd.to_numeric(s, errors="coerce").to_numpy(dtype=float)
+        todo = (idx == 0) & np.isfinite(v)
+        if todo.any():
+            vt = v[todo]
+            right = np.clip(np.searchsorted(cat_vals, vt), 0, len(cat_vals) - 1)
+            left = np.maximum(right - 1, 0)
+            near = np.where(np.abs(vt - cat_vals[left]) <= np.abs(cat_vals[right] - vt), left, right)
+            idx[todo] = np.where(np.abs(vt - cat_vals[near]) <= SNAP_TOLERANCE, cat_idx[near], 0)
+    return idx, int(((idx == 0) & ~missing).sum())
+
+
+def _jsonable(v):
+    """numpy 标量 → Python 原生类型；整数值的浮点统一成 float，保证 JSON 往返后查表一致。"""
+    if isinstance(v, (np.integer, int)) and not isinstance(v, bool):
+        return float(v)
+    if isinstance(v, np.floating):
+        return float(v)
+    return v
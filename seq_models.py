@@ -0,0 +1,324 @@
+# seq_models.py — 行为序列模型（notebook G2–G7）：列嵌入 + CNN1D / BiGRU、单折训练、全量拟合与推理
+#
+# 输入是 seq_encoding.SeqEncoder 编码出的 [N, T] 索引矩阵（每列一个 vocab，0 = padding）。
+# 训练循环与 notebook 的 train_eval_cv / fit_full_model 一致：
+#   AdamW + BCEWithLogits(pos_weight=neg/pos) + 梯度裁剪 3.0；
+#   有验证集时按验证 F1 调度学习率（ReduceLROnPlateau）并早停，恢复最佳权重；
+#   无验证集（全量拟合）时按训练损失早停。
+# 只在 CPU 上跑；线程数由调用方（train_runner 的进程池初始化函数）通过 torch.set_num_threads 控制。
+# 列嵌入是融合实现（一张拼接表 + 分组投影），与 notebook 的逐列版本输出一致，可用下面的命令核对：
+#   python seq_models.py --encoder .cache/train/behavior-<key>/encoder.json
+import json
+import math
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+ARCHS = ("cnn", "rnn")
+
+
+def compute_embed_dims(vocab_sizes):
+    """常用启发式：min(32, max(4, round(1.6*sqrt(v))))。"""
+    return [int(min(32, max(4, round(1.6 * math.sqrt(v))))) for v in vocab_sizes]
+
+
+def default_d_model(vocab_sizes):
+    """统一投影维度：各列嵌入维度的中位数（notebook 的 EMB_DIM_MAX）。"""
+    return int(np.median(compute_embed_dims(vocab_sizes)))
+
+
+# ========= 模型 =========
+class ColumnEmbedding(nn.Module):
+    """
+    每个列一个 vocab，嵌入后投影到统一维度，输出 [B, T, D]。
+    所有列共用一张拼接的嵌入表（按列偏移取行），投影是按列分组的批量矩阵乘：
+    一次前向只有一次查表和一次 einsum，而不是每列各一次 Embedding + Linear 再 stack。
+    各列嵌入维度 e_i 不同，表宽取 e_max；超出 e_i 的部分和各列 padding 行由 mask 固定为 0
+    （梯度也为 0），因此与逐列实现数学上等价。旧版（embs.i / proj.i）state_dict 加载时自动转换。
+    """
+
+    def __init__(self, vocab_sizes, out_dim, padding_idx=0, p_drop=0.1):
+        super().__init__()
+        self.T = len(vocab_sizes)
+        self.vocab_sizes = [int(v) for v in vocab_sizes]
+        self.dims = compute_embed_dims(self.vocab_sizes)
+        self.padding_idx = padding_idx
+        e_max = max(self.dims)
+        offsets = [0] + np.cumsum(self.vocab_sizes)[:-1].tolist()
+        mask = torch.zeros(sum(self.vocab_sizes), e_max)
+        for off, v, d in zip(offsets, self.vocab_sizes, self.dims):
+            mask[off:off + v, :d] = 1.0
+            if padding_idx is not None:
+                mask[off + padding_idx] = 0.0
+        # 偏移和 mask 由结构参数决定，不进 state_dict
+        self.register_buffer("offsets", torch.tensor(offsets, dtype=torch.long), persistent=False)
+        self.register_buffer("mask", mask, persistent=False)
+        self.weight = nn.Parameter(torch.empty(sum(self.vocab_sizes), e_max))   # 拼接嵌入表
+        self.proj_weight = nn.Parameter(torch.empty(self.T, e_max, out_dim))     # 按列投影 [T, e_max, D]
+        self.proj_bias = nn.Parameter(torch.empty(self.T, out_dim))
+        self.dropout = nn.Dropout(p_drop)
+        self.reset_parameters()
+
+    @torch.no_grad()
+    def reset_parameters(self):
+        """与逐列 nn.Embedding / nn.Linear 的默认初始化同分布：嵌入 N(0,1)，投影 U(±1/sqrt(e_i))。"""
+        self.weight.zero_()
+        self.proj_weight.zero_()
+        for i, (off, v, d) in enumerate(zip(self.offsets.tolist(), self.vocab_sizes, self.dims)):
+            self.weight[off:off + v, :d].normal_()
+            bound = 1.0 / math.sqrt(d)
+            self.proj_weight[i, :d].uniform_(-bound, bound)
+            self.proj_bias[i].uniform_(-bound, bound)
+        self.weight.mul_(self.mask)
+
+    def forward(self, x):                       # x: [B, T] (long)，各列取值须在 [0, vocab_i) 内
+        E = F.embedding(x + self.offsets, self.weight * self.mask)             # [B, T, e_max]
+        out = torch.einsum("bte,ted->btd", E, self.proj_weight) + self.proj_bias
+        return self.dropout(out)                                               # [B, T, D]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        if prefix + "embs.0.weight" in state_dict:
+            self._convert_legacy(state_dict, prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    @torch.no_grad()
+    def _convert_legacy(self, state_dict, prefix):
+        """逐列版本的 embs.i.weight [v_i, e_i] / proj.i.weight [D, e_i] / proj.i.bias → 拼接表与分组投影。"""
+        w = torch.zeros_like(self.weight)
+        pw = torch.zeros_like(self.proj_weight)
+        pb = torch.zeros_like(self.proj_bias)
+        for i, (off, v, d) in enumerate(zip(self.offsets.tolist(), self.vocab_sizes, self.dims)):
+            w[off:off + v, :d] = state_dict.pop(f"{prefix}embs.{i}.weight")
+            pw[i, :d] = state_dict.pop(f"{prefix}proj.{i}.weight").t()
+            pb[i] = state_dict.pop(f"{prefix}proj.{i}.bias")
+        state_dict[prefix + "weight"] = w * self.mask
+        state_dict[prefix + "proj_weight"] = pw
+        state_dict[prefix + "proj_bias"] = pb
+
+
+class LoopColumnEmbedding(nn.Module):
+    """notebook 原版逐列实现（embs.i / proj.i），只用于核对融合版本的输出与加载旧权重。"""
+
+    def __init__(self, vocab_sizes, out_dim, padding_idx=0, p_drop=0.1):
+        super().__init__()
+        self.T = len(vocab_sizes)
+        dims = compute_embed_dims(vocab_sizes)
+        self.embs = nn.ModuleList([nn.Embedding(v, d, padding_idx=padding_idx) for v, d in zip(vocab_sizes, dims)])
+        self.proj = nn.ModuleList([nn.Linear(d, out_dim) for d in dims])
+        self.dropout = nn.Dropout(p_drop)
+
+    def forward(self, x):
+        outs = [self.proj[i](self.embs[i](x[:, i])) for i in range(self.T)]
+        return self.dropout(torch.stack(outs, dim=1))
+
+
+class CNN1DClassifier(nn.Module):
+    def __init__(self, vocab_sizes, d_model=None, channels=64, kernel_sizes=(3, 5, 7), n_classes=1):
+        super().__init__()
+        d_model = d_model or default_d_model(vocab_sizes)
+        self.embed = ColumnEmbedding(vocab_sizes, out_dim=d_model, p_drop=0.1)
+        # Conv1d 需要 [B, C, T]，把 D 当通道数
+        self.convs = nn.ModuleList([nn.Conv1d(d_model, channels, kernel_size=k, padding=k // 2)
+                                    for k in kernel_sizes])
+        self.bn = nn.BatchNorm1d(channels * len(kernel_sizes))
+        self.fc = nn.Sequential(
+            nn.Linear(channels * len(kernel_sizes), 128),
+            nn.ReLU(),
+            nn.Dropout(0.2),
+            nn.Linear(128, n_classes),
+        )
+
+    def forward(self, x):
+        X = self.embed(x).transpose(1, 2)       # [B, D, T]
+        feats = [F.adaptive_max_pool1d(F.relu(conv(X)), 1).squeeze(-1) for conv in self.convs]
+        return self.fc(self.bn(torch.cat(feats, dim=1))).squeeze(-1)   # [B]
+
+
+class BiGRUClassifier(nn.Module):
+    def __init__(self, vocab_sizes, d_model=None, hidden=96, n_layers=1, bidir=True, n_classes=1):
+        super().__init__()
+        d_model = d_model or default_d_model(vocab_sizes)
+        self.embed = ColumnEmbedding(vocab_sizes, out_dim=d_model, p_drop=0.1)
+        self.gru = nn.GRU(input_size=d_model, hidden_size=hidden, num_layers=n_layers,
+                          bidirectional=bidir, batch_first=True, dropout=0.0)
+        self.fc = nn.Sequential(
+            nn.Linear(hidden * (2 if bidir else 1), 128),
+            nn.ReLU(),
+            nn.Dropout(0.2),
+            nn.Linear(128, n_classes),
+        )
+
+    def forward(self, x):
+        H, _ = self.gru(self.embed(x))          # [B, T, 2H]
+        # 每个位置都有取值（缺失也编码成 0），直接 mean-pool
+        return self.fc(H.mean(dim=1)).squeeze(-1)
+
+
+def build_model(arch, vocab_sizes, **kwargs):
+    if arch == "cnn":
+        return CNN1DClassifier(vocab_sizes, **kwargs)
+    if arch == "rnn":
+        return BiGRUClassifier(vocab_sizes, **kwargs)
+    raise ValueError(f"未知模型结构：{arch}（可选 {ARCHS}）")
+
+
+# ========= 训练 / 推理 =========
+def _batches(n, batch_size, generator=None):
+    order = torch.randperm(n, generator=generator) if generator is not None else torch.arange(n)
+    for i in range(0, n, batch_size):
+        yield order[i:i + batch_size]
+
+
+@torch.no_grad()
+def predict_logits(model, X_idx, batch_size=256):
+    model.eval()
+    X = torch.as_tensor(np.asarray(X_idx), dtype=torch.long)
+    if len(X) == 0:
+        return np.zeros(0)
+    return torch.cat([model(X[b]) for b in _batches(len(X), batch_size)]).numpy().astype(float)
+
+
+def predict_proba(model, X_idx, batch_size=256):
+    return 1.0 / (1.0 + np.exp(-predict_logits(model, X_idx, batch_size)))
+
+
+def _f1(y, pred):
+    tp = float(((pred == 1) & (y == 1)).sum())
+    denom = float((pred == 1).sum() + (y == 1).sum())
+    return 2.0 * tp / denom if denom > 0 else 0.0
+
+
+def train_model(arch, vocab_sizes, X_tr, y_tr, X_va=None, y_va=None, max_epochs=20, batch_size=128,
+                lr=1e-3, weight_decay=1e-4, patience=3, seed=42, model_kwargs=None):
+    """
+    训练一个序列模型，返回 (model, info)。
+    给了 X_va/y_va：按验证 F1 调度学习率与早停（train_eval_cv 的单折）；
+    否则按训练损失早停（fit_full_model）。info 含实际轮数与最佳指标。
+    """
+    torch.manual_seed(seed)
+    gen = torch.Generator().manual_seed(seed)
+    X = torch.as_tensor(np.asarray(X_tr), dtype=torch.long)
+    y = torch.as_tensor(np.asarray(y_tr), dtype=torch.float32)
+    pos, neg = float((y == 1).sum()), float((y == 0).sum())
+    loss_fn = nn.BCEWithLogitsLoss(pos_weight=torch.tensor(neg / pos if pos > 0 else 1.0))
+
+    model = build_model(arch, vocab_sizes, **(model_kwargs or {}))
+    opt = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=weight_decay)
+    validate = X_va is not None and y_va is not None
+    sched = torch.optim.lr_scheduler.ReduceLROnPlateau(opt, mode="max", factor=0.5, patience=1) if validate else None
+    y_va = None if y_va is None else np.asarray(y_va).astype(int)
+
+    best, best_state, no_improve, epochs = (-1.0 if validate else 1e9), None, 0, 0
+    for epoch in range(1, max_epochs + 1):
+        epochs = epoch
+        model.train()
+        loss_tr = 0.0
+        for b in _batches(len(X), batch_size, gen):
+            if len(b) < 2:           # BatchNorm 在单样本批次上无法训练
+                continue
+            opt.zero_grad()
+            loss = loss_fn(model(X[b]), y[b])
+            loss.backward()
+            nn.utils.clip_grad_norm_(model.parameters(), 3.0)
+            opt.step()
+            loss_tr += loss.item() * len(b)
+        loss_tr /= max(len(X), 1)
+
+        if validate:
+            score = _f1(y_va, (predict_proba(model, X_va) >= 0.5).astype(int))
+            sched.step(score)
+            improved = score > best + 1e-4
+        else:
+            score = loss_tr
+            improved = score < best - 1e-4
+        if improved:
+            best, no_improve = score, 0
+            best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        else:
+            no_improve += 1
+            if no_improve >= patience:
+                break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    model.eval()
+    return model, {"epochs": epochs, ("best_val_f1" if validate else "best_train_loss"): float(best)}
+
+
+# ========= 核对融合嵌入 =========
+@torch.no_grad()
+def check_fused_embedding(vocab_sizes, out_dim=None, batch=256, repeats=50, seed=0):
+    """随机初始化逐列版本 → 转换加载进融合版本，比较同一批输入的输出与前向耗时。"""
+    import time
+
+    torch.manual_seed(seed)
+    out_dim = out_dim or default_d_model(vocab_sizes)
+    loop = LoopColumnEmbedding(vocab_sizes, out_dim).eval()
+    fused = ColumnEmbedding(vocab_sizes, out_dim).eval()
+    fused.load_state_dict(loop.state_dict())
+    x = torch.stack([torch.randint(0, v, (batch,)) for v in vocab_sizes], dim=1)
+    diff = float((loop(x) - fused(x)).abs().max())
+    timings = {}
+    for name, m in (("loop", loop), ("fused", fused)):
+        m(x)
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            m(x)
+        timings[name] = (time.perf_counter() - t0) / repeats * 1000.0
+    return {"max_abs_diff": diff, "loop_ms": timings["loop"], "fused_ms": timings["fused"]}
+
+
+# ========= 保存 / 加载 =========
+def save_checkpoint(model, path, arch, encoder, model_kwargs=None, extra=None):
+    """state_dict 存 .pt；同名 _meta.json 记录结构参数、特征列与编码器（推理时据此重建模型与输入）。"""
+    torch.save(model.state_dict(), path)
+    meta = {"arch": arch, "model_kwargs": model_kwargs or {}, "features": encoder.names,
+            "vocab_sizes": encoder.vocab_sizes, "encoder": encoder.to_dict(), **(extra or {})}
+    meta_path = meta_path_for(path)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta_path
+
+
+def meta_path_for(path):
+    base = str(path)
+    return (base[:-3] if base.endswith(".pt") else base) + "_meta.json"
+
+
+def load_checkpoint(path):
+    """返回 (model, meta)；model 已切到 eval。"""
+    with open(meta_path_for(path), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    model = build_model(meta["arch"], meta["vocab_sizes"], **meta.get("model_kwargs", {}))
+    model.load_state_dict(torch.load(path, map_location="cpu"))
+    model.eval()
+    return model, meta
+
+
+def main(argv=None):
+    import argparse
+
+    from seq_encoding import SeqEncoder
+
+    ap = argparse.ArgumentParser(description="核对融合列嵌入与逐列实现的输出一致性与耗时")
+    ap.add_argument("--encoder", required=True, help="encoder.json 或 seq_*_meta.json")
+    ap.add_argument("--batch", type=int, default=256)
+    ap.add_argument("--threads", type=int, default=1)
+    ap.add_argument("--tol", type=float, default=1e-5)
+    args = ap.parse_args(argv)
+
+    torch.set_num_threads(args.threads)
+    with open(args.encoder, "r", encoding="utf-8") as f:
+        d = json.load(f)
+    enc = SeqEncoder.from_dict(d.get("encoder", d))
+    r = check_fused_embedding(enc.vocab_sizes, batch=args.batch)
+    print(f"{len(enc.vocab_sizes)} 列，batch {args.batch}：最大误差 {r['max_abs_diff']:.2e}；"
+          f"逐列 {r['loop_ms']:.3f} ms → 融合 {r['fused_ms']:.3f} ms")
+    if r["max_abs_diff"] > args.tol:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
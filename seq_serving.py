@@ -0,0 +1,190 @@
+# seq_serving.py — 序列模型（CNN1D / BiGRU）的 TorchScript 导出与线上推理后端
+#
+#   python seq_serving.py --checkpoint seq_cnn.pt --check CNAH2003_public_use.xls   # → seq_cnn.ts
+#
+# - 导出：train_runner.py 写出的 state_dict（seq_<变体>.pt + _meta.json）→ torch.jit.trace + freeze，
+#   meta（结构参数、特征列、编码器）作为 extra file 打进 .ts，线上只需要这一个文件，不需要 seq_models。
+#   导出后用不同批大小与 eager 模型逐行比对，超出容差直接报错。
+# - 推理：SeqBackend 与 sklearn pipeline / CompiledSVM 同接口（features / classes_ / predict_proba / predict），
+#   app、batch.py、registry 按 .ts 扩展名自动选用。加载时设置 torch 线程数并做一次预热调用，
+#   把首次调用的图优化开销挪到加载阶段；批量输入按 BATCH_ROWS 分块推理。
+# - 线程数：环境变量 DEYU_TORCH_THREADS（默认 1；torch 线程池是进程级的，多会话并发时每次请求用少量线程更稳）。
+import argparse
+import io
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from seq_encoding import SeqEncoder
+
+TORCH_THREADS = int(os.environ.get("DEYU_TORCH_THREADS", "1"))
+BATCH_ROWS = 1024
+META_FILE = "meta.json"
+
+
+def torchscript_path_for(checkpoint_path) -> Path:
+    """seq_cnn.pt → seq_cnn.ts"""
+    p = Path(checkpoint_path)
+    return p.with_suffix(".ts")
+
+
+def set_threads(n):
+    import torch
+
+    if n and torch.get_num_threads() != n:
+        torch.set_num_threads(n)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:                      # 已有并行任务运行过时不允许再改
+        pass
+
+
+# ========= 导出 =========
+def export_torchscript(checkpoint_path, out_path=None, tol=1e-5):
+    """state_dict → 冻结的 TorchScript；返回输出路径。"""
+    import torch
+
+    from seq_models import load_checkpoint
+
+    model, meta = load_checkpoint(checkpoint_path)
+    T = len(meta["vocab_sizes"])
+    with torch.no_grad():
+        example = torch.zeros((4, T), dtype=torch.long)
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+        # 批大小是动态维度：用与 trace 时不同的批大小核对
+        gen = torch.Generator().manual_seed(0)
+        for n in (1, 7, 300):
+            x = torch.stack([torch.randint(0, v, (n,), generator=gen) for v in meta["vocab_sizes"]], dim=1)
+            diff = float((traced(x) - model(x)).abs().max())
+            if diff > tol:
+                raise ValueError(f"TorchScript 与 eager 输出不一致（batch {n}，最大误差 {diff:.2e}）")
+    out_path = Path(out_path) if out_path else torchscript_path_for(checkpoint_path)
+    tmp = out_path.with_name(f"{out_path.name}.{os.getpid()}.tmp")
+    torch.jit.save(traced, str(tmp), _extra_files={META_FILE: json.dumps(meta, ensure_ascii=False)})
+    os.replace(tmp, out_path)
+    return out_path
+
+
+# ========= 推理 =========
+class SeqBackend:
+    """TorchScript 序列模型 + 编码器；输入为问卷记录（dict / DataFrame），输出风险概率。"""
+
+    backend = "torchscript"
+
+    def __init__(self, module, meta, threads=None, warmup=True):
+        self.module = module
+        self.meta = meta
+        self.arch = meta.get("arch")
+        self.encoder = SeqEncoder.from_dict(meta["encoder"])
+        self.features = list(meta.get("features") or self.encoder.names)
+        self.feature_names_in_ = np.asarray(self.features, dtype=object)
+        self.classes_ = np.array([0, 1])
+        self.threads = threads or TORCH_THREADS
+        self.warmup_ms = None
+        set_threads(self.threads)
+        if warmup:
+            self.warmup()
+
+    @classmethod
+    def load(cls, path, threads=None, warmup=True):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read(), threads, warmup)
+
+    @classmethod
+    def from_bytes(cls, data, threads=None, warmup=True):
+        import torch
+
+        extra = {META_FILE: ""}
+        module = torch.jit.load(io.BytesIO(data), map_location="cpu", _extra_files=extra)
+        module.eval()
+        return cls(module, json.loads(extra[META_FILE]), threads, warmup)
+
+    def warmup(self):
+        """单条与整批各跑一次：冻结图的首次执行会做融合/分配，不计入第一次真实请求。"""
+        t0 = time.perf_counter()
+        T = len(self.encoder.columns)
+        self._run(np.zeros((1, T), dtype=np.int64))
+        self._run(np.zeros((min(BATCH_ROWS, 64), T), dtype=np.int64))
+        self.warmup_ms = (time.perf_counter() - t0) * 1000.0
+        return self.warmup_ms
+
+    def _run(self, X_idx):
+        import torch
+
+        with torch.inference_mode():
+            X = torch.from_numpy(np.ascontiguousarray(X_idx, dtype=np.int64))
+            return np.concatenate([self.module(X[i:i + BATCH_ROWS]).numpy()
+                                   for i in range(0, len(X), BATCH_ROWS)]).astype(float)
+
+    def encode(self, X):
+        if isinstance(X, dict):
+            return self.encoder.transform_record(X)
+        if hasattr(X, "columns"):
+            return self.encoder.transform(X)
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != len(self.encoder.columns):
+            raise ValueError(f"需要 [n, {len(self.encoder.columns)}] 的索引矩阵")
+        return X.astype(np.int64)
+
+    def predict_proba(self, X):
+        X_idx = self.encode(X)
+        if len(X_idx) == 0:
+            return np.zeros((0, 2))
+        p1 = 1.0 / (1.0 + np.exp(-self._run(X_idx)))
+        return np.column_stack([1.0 - p1, p1])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] >= 0.5).astype(int)
+
+
+def is_torchscript_path(path):
+    return str(path).endswith(".ts")
+
+
+def load_seq_model(path, threads=None):
+    return SeqBackend.load(path, threads)
+
+
+# ========= CLI =========
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="导出序列模型（CNN1D / BiGRU）的 TorchScript 推理产物")
+    ap.add_argument("--checkpoint", required=True, help="train_runner.py --full 写出的 seq_*.pt")
+    ap.add_argument("--out", default=None, help="默认与 .pt 同目录：seq_*.ts")
+    ap.add_argument("--check", default=None, help="用该数据集比对 eager 与 TorchScript 输出，并测单行/批量延迟")
+    ap.add_argument("--threads", type=int, default=TORCH_THREADS)
+    ap.add_argument("--tol", type=float, default=1e-5)
+    args = ap.parse_args(argv)
+
+    set_threads(args.threads)
+    out = export_torchscript(args.checkpoint, args.out, tol=args.tol)
+    backend = SeqBackend.load(out, threads=args.threads)
+    print(f"已导出：{out}（{backend.arch}，{len(backend.features)} 列，预热 {backend.warmup_ms:.1f} ms）")
+
+    if args.check:
+        from dataset import load_dataset
+        from seq_models import load_checkpoint, predict_proba
+
+        df = load_dataset(args.check, columns=backend.features)
+        model, _ = load_checkpoint(args.checkpoint)
+        ref = predict_proba(model, backend.encode(df))
+        got = backend.predict_proba(df)[:, 1]
+        diff = float(np.abs(ref - got).max())
+        rec = df.iloc[0].to_dict()
+        t0 = time.perf_counter()
+        for _ in range(200):
+            backend.predict_proba(rec)
+        single = (time.perf_counter() - t0) / 200 * 1000.0
+        t0 = time.perf_counter()
+        backend.predict_proba(df)
+        batch = time.perf_counter() - t0
+        print(f"比对 {len(df)} 行：最大概率误差 {diff:.2e}；单行 {single:.3f} ms；"
+              f"批量 {len(df) / batch:.0f} 行/秒（{args.threads} 线程）")
+        if diff > args.tol:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# service.py — 无界面评分服务：本地 HTTP 接口 + JSONL 命令行
+#
+# 模型、基线（以及可选的文本模型）在进程启动时加载一次，之后常驻内存。
+#
+# 命令行（stdin 读 JSONL，stdout 写 JSONL，按 --batch-size 成批调用 predict_proba）：
+#   python service.py predict < respondents.jsonl > predictions.jsonl
+#
+# HTTP（需要 pip install aiohttp）：
+#   python service.py serve --port 8800
+#   POST /predict   body 为单条记录或记录列表（JSON），返回同结构的预测
+#   GET  /healthz
+# 并发请求在 --max-delay-ms 时间窗内合并成一次 predict_proba（micro-batching）。
+#
+# 记录格式：{"id": "s001", "features": {"Q1": 3, ...}, "text": "（可选）", "w_behavior": 0.7}
+# 不合法的记录（features 不是对象、w_behavior 不是 0–1 的数字等）只对自己返回 {"id": ..., "error": ...}，
+# 同一批合并的其他记录照常评分。
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from scoring import ScoringCore
+
+
+# ========= micro-batching =========
+class MicroBatcher:
+    """
+    把并发到达的单条请求合并成批：第一条到达后最多等待 max_delay 秒或凑满 max_batch 条，
+    然后在工作线程里调用一次 core.predict_records，避免阻塞事件循环。
+    """
+
+    def __init__(self, core: ScoringCore, max_batch=256, max_delay=0.005):
+        self.core = core
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = None
+        self._worker = None
+        self.batches = 0
+        self.records = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, record):
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            records = [r for r, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.core.predict_records, records)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.records += len(batch)
+            for (_, fut), res in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(res)
+
+
+# ========= HTTP =========
+def make_app(core: ScoringCore, max_batch=256, max_delay=0.005):
+    try:
+        from aiohttp import web
+    except ImportError as e:
+        raise SystemExit("HTTP 模式需要 aiohttp：pip install aiohttp") from e
+
+    batcher = MicroBatcher(core, max_batch=max_batch, max_delay=max_delay)
+
+    async def predict(request):
+        try:
+            body = await request.json()
+        except Exception:
+            return web.json_response({"error": "请求体不是合法 JSON"}, status=400)
+        if isinstance(body, list):
+            if not all(isinstance(r, dict) for r in body):
+                return web.json_response({"error": "列表元素必须是 JSON 对象"}, status=400)
+            results = await asyncio.gather(*(batcher.submit(r) for r in body))
+            return web.json_response(list(results))
+        if not isinstance(body, dict):
+            return web.json_response({"error": "请求体必须是 JSON 对象或对象列表"}, status=400)
+        return web.json_response(await batcher.submit(body))
+
+    async def healthz(request):
+        return web.json_response({"ok": True, "features": len(core.model_features),
+                                  "batches": batcher.batches, "records": batcher.records})
+
+    async def on_startup(app):
+        await batcher.start()
+
+    async def on_cleanup(app):
+        await batcher.stop()
+
+    app = web.Application()
+    app.router.add_post("/predict", predict)
+    app.router.add_get("/healthz", healthz)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app["batcher"] = batcher
+    return app
+
+
+# ========= CLI：JSONL → JSONL =========
+def predict_stream(core: ScoringCore, fin, fout, batch_size=512):
+    """逐行读取 JSONL，按 batch_size 成批评分后逐行写出；无法解析的行输出 {"error": ...}。"""
+    n = 0
+    t0 = time.perf_counter()
+    pending = []
+
+    def flush():
+        nonlocal pending
+        if not pending:
+            return
+        results = core.predict_records(pending)
+        for res in results:
+            fout.write(json.dumps(res, ensure_ascii=False) + "\n")
+        pending = []
+
+    for lineno, line in enumerate(fin, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+            if not isinstance(rec, dict):
+                raise ValueError("每行必须是 JSON 对象")
+        except ValueError as e:
+            flush()
+            fout.write(json.dumps({"line": lineno, "error": str(e)}, ensure_ascii=False) + "\n")
+            continue
+        pending.append(rec)
+        n += 1
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    fout.flush()
+    return n, time.perf_counter() - t0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="无界面评分服务（HTTP / JSONL）")
+    ap.add_argument("--model", default="svm_pca_behavior_pipeline.pkl")
+    ap.add_argument("--meta", default="svm_pca_behavior_meta.json")
+    ap.add_argument("--data", default="CNAH2003_public_use.xls", help="仅在基线产物缺失/过期时用于现算")
+    ap.add_argument("--text-model", default=None)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_pred = sub.add_parser("predict", help="stdin JSONL → stdout JSONL")
+    p_pred.add_argument("--batch-size", type=int, default=512)
+    p_srv = sub.add_parser("serve", help="启动本地 HTTP 服务")
+    p_srv.add_argument("--host", default="127.0.0.1")
+    p_srv.add_argument("--port", type=int, default=8800)
+    p_srv.add_argument("--max-batch", type=int, default=256)
+    p_srv.add_argument("--max-delay-ms", type=float, default=5.0)
+    args = ap.parse_args(argv)
+
+    core = ScoringCore.from_paths(args.model, args.meta, args.data, text_model_path=args.text_model)
+    if args.cmd == "predict":
+        n, secs = predict_stream(core, sys.stdin, sys.stdout, batch_size=args.batch_size)
+        print(f"scored {n} records in {secs:.2f}s", file=sys.stderr)
+    else:
+        app = make_app(core, args.max_batch, args.max_delay_ms / 1000.0)
+        from aiohttp import web
+        web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
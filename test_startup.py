@@ -0,0 +1,23 @@
+# test_startup.py — app 冷启动回归测试：顶层导入耗时预算 + 重依赖必须推迟导入
+#
+#   python -m pytest -q test_startup.py
+#
+# 测量沿用 bench.measure_app_imports（每次在全新子进程里执行 app_V3.py 的全部顶层 import），
+# 预算与 bench.py --import-check 相同，可用 DEYU_IMPORT_BUDGET_MS 调整。
+import numpy as np
+
+from bench import DEFERRED_MODULES, IMPORT_BUDGET_MS, measure_app_imports
+
+# 画图（plotly.express）、行为/文本模型（sklearn、joblib、scipy）与序列模型（torch）只能在用到的分支里导入
+REQUIRED_DEFERRED = ("sklearn", "plotly.express", "joblib", "scipy", "torch")
+
+
+def test_deferred_list_covers_heavy_modules():
+    assert set(REQUIRED_DEFERRED) <= set(DEFERRED_MODULES)
+
+
+def test_app_import_budget_and_deferred_modules():
+    times, rss, loaded = measure_app_imports(runs=3)
+    p50 = float(np.median(times))
+    assert not loaded, f"启动阶段提前导入了应推迟的模块：{loaded}"
+    assert p50 <= IMPORT_BUDGET_MS, f"app 顶层导入 p50 {p50:.0f} ms 超出预算 {IMPORT_BUDGET_MS:.0f} ms"
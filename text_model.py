@@ -0,0 +1,87 @@
+# text_model.py — 文本通道（TF-IDF + LogisticRegression）的加载缓存与批量打分
+#
+# - load_text_model(path)：进程内 LRU 缓存，键为 (绝对路径, mtime, size)，pkl 被覆盖后自动重新加载；
+#   joblib 以 mmap_mode="r" 打开，idf/coef 等大数组按需映射而不是整体拷贝进内存。
+# - predict_text_proba(model, texts)：一批文本只做一次向量化 transform；空文本返回 NaN。
+# - tokenize_zh(s)：训练时 word 通道的分词器。放在这里是为了让 pickle 里的引用在 app 端可导入。
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+MAX_CACHED_MODELS = 4
+
+_cache = OrderedDict()
+_lock = Lock()
+
+
+def _file_key(path):
+    st_ = os.stat(path)
+    return (os.path.abspath(path), st_.st_mtime_ns, st_.st_size)
+
+
+def _load_uncached(path):
+    try:
+        import joblib
+    except Exception:
+        joblib = None
+    if joblib is not None:
+        try:
+            return joblib.load(path, mmap_mode="r")
+        except Exception:
+            # 压缩过的 joblib 文件不支持 mmap，退回普通加载
+            return joblib.load(path)
+    import pickle
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_text_model(path):
+    """按 (路径, mtime, size) 缓存的文本模型；最多保留 MAX_CACHED_MODELS 个。"""
+    key = _file_key(path)
+    with _lock:
+        model = _cache.get(key)
+        if model is not None:
+            _cache.move_to_end(key)
+            return model
+    model = _load_uncached(path)
+    with _lock:
+        # 同一路径的旧版本直接丢弃
+        for k in [k for k in _cache if k[0] == key[0]]:
+            del _cache[k]
+        _cache[key] = model
+        while len(_cache) > MAX_CACHED_MODELS:
+            _cache.popitem(last=False)
+    return model
+
+
+def tokenize_zh(s):
+    """有 jieba 用 jieba 分词；否则整句作为一个 token（char 通道兜底）。"""
+    try:
+        import jieba
+    except ImportError:
+        return [str(s)]
+    return [w for w in jieba.lcut(str(s)) if w.strip()]
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+def predict_text_proba(model, texts, clean=None):
+    """
+    批量文本风险概率：texts 为字符串序列（如一名学生多天的日记）。
+    clean: 可选的清洗函数（如 diary.clean_zh2），在向量化前逐条应用。
+    返回 float 数组，空文本位置为 NaN。
+    """
+    texts = ["" if t is None else str(t) for t in texts]
+    if clean is not None:
+        texts = [clean(t) for t in texts]
+    out = np.full(len(texts), np.nan)
+    idx = [i for i, t in enumerate(texts) if t.strip()]
+    if idx:
+        out[idx] = model.predict_proba(pd.Series([texts[i] for i in idx]))[:, 1]
+    return out
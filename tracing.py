@@ -0,0 +1,267 @@
+# tracing.py — 热路径计时：耗时、缓存命中/未命中、内存增量（每次 rerun 一份记录）
+#
+#   run = tracing.begin_run(enabled)        # 脚本开头
+#   with tracing.span("predict_behavior"):  # 或 @tracing.traced("load_model", cached=True)
+#       ...
+#   tracing.end_run()                       # 脚本末尾：写结构化日志、累加 Prometheus 指标
+#
+# - 缓存命中判断：被 st.cache_* 包住的函数体里调用 note_miss()；函数体真正执行了就是未命中。
+# - 内存增量读 /proc/self/statm 的 RSS（非 Linux 时为 None）。
+# - 未启用时 span() 返回共享的空上下文管理器，traced() 直接调用原函数，开销只有一次属性判断。
+# - 启用方式：环境变量 DEYU_TRACE=1，或页面侧边栏勾选；DEYU_TRACE_LOG 指定 JSONL 日志文件
+#   （默认写 stderr），DEYU_TRACE_PROM 指定 Prometheus textfile 输出路径。
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+ENV_ENABLED = os.environ.get("DEYU_TRACE", "").strip().lower() in ("1", "true", "yes", "on")
+LOG_PATH = os.environ.get("DEYU_TRACE_LOG") or None
+PROM_PATH = os.environ.get("DEYU_TRACE_PROM") or None
+
+logger = logging.getLogger("deyu.trace")
+
+_local = threading.local()
+_metrics_lock = threading.Lock()
+_metrics = OrderedDict()       # span 名 → {"count", "seconds", "hits", "misses", "rss_growth_bytes", "rss_shrink_bytes"}
+_runs_total = 0
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+
+def rss_bytes():
+    """当前进程常驻内存（字节）；不可用时返回 None。"""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# ========= 每次 rerun 的记录 =========
+class Run:
+    def __init__(self):
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.rss_start = rss_bytes()
+        self.spans = []
+        self.stack = []
+        self.total_ms = None
+        self.rss_end = None
+
+    def summary(self):
+        """按 span 名聚合：调用次数、总/最大耗时、命中/未命中次数、内存增量。"""
+        out = OrderedDict()
+        for s in self.spans:
+            a = out.setdefault(s["name"], {"span": s["name"], "calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                           "hits": 0, "misses": 0, "rss_delta_mb": 0.0})
+            a["calls"] += 1
+            a["total_ms"] += s["ms"]
+            a["max_ms"] = max(a["max_ms"], s["ms"])
+            if s.get("cache") == "hit":
+                a["hits"] += 1
+            elif s.get("cache") == "miss":
+                a["misses"] += 1
+            if s.get("rss_delta_mb") is not None:
+                a["rss_delta_mb"] += s["rss_delta_mb"]
+        return list(out.values())
+
+    def to_dict(self):
+        return {"ts": self.started, "total_ms": self.total_ms,
+                "rss_mb": None if self.rss_end is None else self.rss_end / 2**20,
+                "spans": self.spans}
+
+
+def begin_run(enabled=None):
+    """开始一次 rerun 的记录；enabled 为 None 时由 DEYU_TRACE 决定。未启用时返回 None。"""
+    enabled = ENV_ENABLED if enabled is None else bool(enabled)
+    _local.run = Run() if enabled else None
+    return _local.run
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+def enabled():
+    return getattr(_local, "run", None) is not None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("run", "rec", "_t0", "_rss0")
+
+    def __init__(self, run, name, attrs):
+        self.run = run
+        self.rec = {"name": name, **attrs}
+
+    def set(self, **attrs):
+        self.rec.update(attrs)
+
+    def __enter__(self):
+        self.rec["depth"] = len(self.run.stack)
+        self.rec["start_ms"] = (time.perf_counter() - self.run._t0) * 1000.0
+        self.run.stack.append(self)
+        self._rss0 = rss_bytes()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.rec["ms"] = (time.perf_counter() - self._t0) * 1000.0
+        rss1 = rss_bytes()
+        self.rec["rss_delta_mb"] = None if rss1 is None or self._rss0 is None else (rss1 - self._rss0) / 2**20
+        if exc_type is not None:
+            self.rec["error"] = exc_type.__name__
+        if self.run.stack and self.run.stack[-1] is self:
+            self.run.stack.pop()
+        self.run.spans.append(self.rec)
+        return False
+
+
+def span(name, **attrs):
+    """计时上下文管理器；attrs 会原样写进记录（如 chart="gauge"）。"""
+    run = getattr(_local, "run", None)
+    if run is None:
+        return _NULL_SPAN
+    return _Span(run, name, attrs)
+
+
+def note_miss():
+    """在被缓存的函数体内调用：标记当前 span 为缓存未命中。"""
+    run = getattr(_local, "run", None)
+    if run is not None and run.stack:
+        run.stack[-1].rec["cache"] = "miss"
+
+
+def traced(name=None, cached=False):
+    """
+    装饰器版本的 span。cached=True 时记录缓存命中情况：
+    函数体内（st.cache_* 之内）调用了 note_miss() 记为 miss，否则记为 hit。
+    """
+    def deco(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            run = getattr(_local, "run", None)
+            if run is None:
+                return fn(*args, **kwargs)
+            with _Span(run, label, {"cache": "hit"} if cached else {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def end_run():
+    """结束本次 rerun：写一行 JSON 日志、累加进程级指标；返回 Run（未启用时为 None）。"""
+    global _runs_total
+    run = getattr(_local, "run", None)
+    if run is None:
+        return None
+    run.total_ms = (time.perf_counter() - run._t0) * 1000.0
+    run.rss_end = rss_bytes()
+    with _metrics_lock:
+        _runs_total += 1
+        for s in run.spans:
+            m = _metrics.setdefault(s["name"], {"count": 0, "seconds": 0.0, "hits": 0, "misses": 0,
+                                                "rss_growth_bytes": 0.0, "rss_shrink_bytes": 0.0})
+            m["count"] += 1
+            m["seconds"] += s["ms"] / 1000.0
+            if s.get("cache") == "hit":
+                m["hits"] += 1
+            elif s.get("cache") == "miss":
+                m["misses"] += 1
+            if s.get("rss_delta_mb") is not None:
+                # 单次增量可正可负；Prometheus counter 必须单调，增长与回落分别累加
+                delta = s["rss_delta_mb"] * 2**20
+                m["rss_growth_bytes" if delta >= 0 else "rss_shrink_bytes"] += abs(delta)
+    _emit_log(run)
+    if PROM_PATH:
+        _write_atomic(PROM_PATH, prometheus_text())
+    return run
+
+
+# ========= 导出 =========
+def _emit_log(run):
+    line = json.dumps({"event": "rerun", **run.to_dict()}, ensure_ascii=False)
+    if LOG_PATH:
+        try:
+            with open(LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            return
+        except OSError:
+            pass
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler(sys.stderr))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    logger.info(line)
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _label(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    """进程启动以来的累计指标（Prometheus 文本格式）。"""
+    with _metrics_lock:
+        items = [(k, dict(v)) for k, v in _metrics.items()]
+        runs = _runs_total
+    lines = [
+        "# HELP deyu_reruns_total Traced script reruns.",
+        "# TYPE deyu_reruns_total counter",
+        f"deyu_reruns_total {runs}",
+    ]
+    rss = rss_bytes()
+    if rss is not None:
+        lines += ["# HELP deyu_process_rss_bytes Resident set size.",
+                  "# TYPE deyu_process_rss_bytes gauge",
+                  f"deyu_process_rss_bytes {rss}"]
+    for metric, key, help_, typ in (
+            ("deyu_span_seconds_sum", "seconds", "Total wall time per span.", "counter"),
+            ("deyu_span_seconds_count", "count", "Calls per span.", "counter"),
+            ("deyu_span_cache_hits_total", "hits", "Cache hits per span.", "counter"),
+            ("deyu_span_cache_misses_total", "misses", "Cache misses per span.", "counter"),
+            ("deyu_span_rss_growth_bytes_total", "rss_growth_bytes", "Summed RSS growth per span.", "counter"),
+            ("deyu_span_rss_shrink_bytes_total", "rss_shrink_bytes", "Summed RSS shrink per span.", "counter")):
+        lines += [f"# HELP {metric} {help_}", f"# TYPE {metric} {typ}"]
+        for name, m in items:
+            lines.append(f'{metric}{{span="{_label(name)}"}} {m[key]:.6g}')
+    return "\n".join(lines) + "\n"
+
+
+def log_lines(run):
+    """单次 rerun 的 span 记录（JSONL），供页面下载。"""
+    return "".join(json.dumps(s, ensure_ascii=False) + "\n" for s in run.spans)
@@ -0,0 +1,488 @@
+# train_runner.py — notebook 模型的并行交叉验证与重训（CPU）
+#
+#   python train_runner.py                                     # svm / text / cnn / rnn 各做 5 折 CV
+#   python train_runner.py --models svm cnn cnn:lr=5e-4,batch_size=256 rnn --workers 4 --torch-threads 2
+#   python train_runner.py --models svm text --full            # CV 之后全量拟合，导出 app 使用的产物
+#
+# - 每个 (模型变体, 折) 是进程池里的一个任务，--full 的全量拟合也作为任务一起并行。
+#   worker 启动时用 torch.set_num_threads 和 threadpoolctl 限制各自的线程数，
+#   避免「进程数 × 全部核心」的线程互相抢占；默认 workers = CPU 核数 // torch-threads。
+# - 预处理结果（X_idx / y_arr / 编码器）按「数据集 sha1 + 特征列 + 编码参数」缓存在
+#   .cache/train/<key>/（DEYU_CACHE_DIR 可改根目录），worker 以 mmap 读取，不随任务传输；
+#   数据集或参数不变时第二次运行直接复用。
+# - 折划分与 notebook 一致：StratifiedKFold(folds, shuffle=True, random_state=42)，
+#   每个 worker 用同一种子自行重建划分，任务里只传折号。
+# - --full 产物（写到 --out-dir，先写临时文件再 os.replace，app 端注册表可直接热替换）：
+#     svm      → svm_pca_behavior_pipeline.pkl + svm_pca_behavior_meta.json
+#                （并重建 _compiled.npz 纯 NumPy 推理产物与 _baseline.npz 人群基线）
+#     text     → pipe_text_final2.pkl
+#     cnn/rnn  → seq_<变体>.pt + seq_<变体>_meta.json（结构参数、特征列、编码器分箱边界/类别）
+#                + seq_<变体>.ts（TorchScript，app 端的 cnn/rnn 推理后端，见 seq_serving.py）
+#   清单（models.json）里已有条目指向这些文件时，同步更新其 sha1。
+# - CV 汇总（每折与 OOF 的 Acc/F1/AUC、各任务耗时）写到 <out-dir>/cv_report.json。
+import argparse
+import ast
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.util import find_spec
+from pathlib import Path
+
+import numpy as np
+
+from dataset import CACHE_DIR as _DATASET_CACHE_DIR
+from dataset import file_fingerprint, load_dataset
+from seq_encoding import ENCODER_VERSION, SeqEncoder, make_labels, select_behavior_features
+
+CACHE_DIR = _DATASET_CACHE_DIR.parent / "train"
+SEED = 42
+ARCHS = ("svm", "text", "cnn", "rnn")
+SEQ_TRAIN_KEYS = ("max_epochs", "batch_size", "lr", "weight_decay", "patience")
+OUT_SVM = "svm_pca_behavior_pipeline.pkl"
+OUT_SVM_META = "svm_pca_behavior_meta.json"
+OUT_TEXT = "pipe_text_final2.pkl"
+
+
+# ========= 模型变体 =========
+def parse_variant(spec):
+    """'cnn' / 'cnn:lr=5e-4,batch_size=256' → {"name", "arch", "params"}。"""
+    arch, _, rest = spec.partition(":")
+    arch = arch.strip().lower()
+    if arch not in ARCHS:
+        raise ValueError(f"未知模型：{arch}（可选 {ARCHS}）")
+    params = {}
+    for kv in filter(None, (p.strip() for p in rest.split(","))):
+        k, _, v = kv.partition("=")
+        try:
+            params[k.strip()] = ast.literal_eval(v.strip())
+        except (ValueError, SyntaxError):
+            params[k.strip()] = v.strip()
+    name = arch + "".join(f"-{k}{v}" for k, v in sorted(params.items()))
+    return {"name": name, "arch": arch, "params": params}
+
+
+def build_svm_pipeline(df, features, C=2.0, gamma="scale", n_components=0.95):
+    """notebook SAVE_BEHAVIOR_MODEL 的 SVM+PCA 管道：数值列中位数填补+标准化，其余列众数填补+独热。"""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.decomposition import PCA
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+    from sklearn.svm import SVC
+
+    num_cols = df[features].select_dtypes(include=["int64", "float64", "int32", "float32"]).columns.tolist()
+    cat_cols = [c for c in features if c not in num_cols]
+    pre = ColumnTransformer([
+        ("num", Pipeline([("impute", SimpleImputer(strategy="median")),
+                          ("scale", StandardScaler())]), num_cols),
+        ("cat", Pipeline([("impute", SimpleImputer(strategy="most_frequent")),
+                          ("ohe", OneHotEncoder(handle_unknown="ignore"))]), cat_cols),
+    ], remainder="drop")
+    return Pipeline([
+        ("prep", pre),
+        ("pca", PCA(n_components=n_components, svd_solver="full", random_state=SEED)),
+        ("svc", SVC(kernel="rbf", probability=True, class_weight="balanced", C=C, gamma=gamma,
+                    random_state=SEED)),
+    ])
+
+
+def build_text_pipeline(C=1.0, max_iter=5000):
+    """notebook Cell 10_fix′：word（jieba，可缺省）+ char(2,5) TF-IDF → 平衡权重的 LogisticRegression。"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import FeatureUnion, Pipeline
+
+    from text_model import tokenize_zh
+
+    union = FeatureUnion([
+        ("word", TfidfVectorizer(tokenizer=tokenize_zh, token_pattern=None, ngram_range=(1, 2),
+                                 min_df=1, max_df=1.0, sublinear_tf=True)),
+        ("char", TfidfVectorizer(analyzer="char", ngram_range=(2, 5), min_df=1, max_df=1.0, sublinear_tf=True)),
+    ])
+    return Pipeline([("tfidf", union),
+                     ("clf", LogisticRegression(solver="saga", class_weight="balanced", C=C, max_iter=max_iter))])
+
+
+# ========= 预处理缓存 =========
+def _cache_key(parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _publish_dir(tmp, target):
+    """整目录原子发布；并发运行时另一个进程抢先写好了就丢弃自己的。"""
+    try:
+        os.replace(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def prepare_behavior(data_path, features=None, label_strategy="Q38_or_Q39", nbins=5, max_card=12,
+                     cache_dir=CACHE_DIR, use_cache=True):
+    """行为数据 → 缓存目录（X_idx.npy / y.npy / encoder.json / info.json）；返回目录路径。"""
+    data_sha1 = file_fingerprint(data_path)
+    if features is None:
+        features = select_behavior_features(load_dataset(data_path))
+    key = _cache_key({"data": data_sha1, "features": list(features), "label": label_strategy,
+                      "nbins": nbins, "max_card": max_card, "encoder": ENCODER_VERSION})
+    target = Path(cache_dir) / f"behavior-{key}"
+    if use_cache and (target / "info.json").exists():
+        return target
+
+    df = load_dataset(data_path)
+    enc = SeqEncoder.fit(df, features, nbins=nbins, max_card=max_card)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    tmp.mkdir(parents=True, exist_ok=True)
+    np.save(tmp / "X_idx.npy", enc.transform(df))
+    np.save(tmp / "y.npy", make_labels(df, label_strategy))
+    enc.save(tmp / "encoder.json")
+    (tmp / "info.json").write_text(json.dumps({
+        "data": str(Path(data_path).resolve()), "data_sha1": data_sha1, "features": list(features),
+        "label": label_strategy, "rows": len(df)}, ensure_ascii=False, indent=2), encoding="utf-8")
+    if target.exists():
+        shutil.rmtree(target, ignore_errors=True)
+    _publish_dir(tmp, target)
+    return target
+
+
+def prepare_text(diary_path, cache_dir=CACHE_DIR, use_cache=True):
+    """日记文本（清洗后）与标签 → 缓存目录（texts.json / y.npy）。"""
+    from diary import clean_series, read_records
+
+    key = _cache_key({"diary": file_fingerprint(diary_path)})
+    target = Path(cache_dir) / f"text-{key}"
+    if use_cache and (target / "texts.json").exists():
+        return target
+    df = read_records(diary_path)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    tmp.mkdir(parents=True, exist_ok=True)
+    np.save(tmp / "y.npy", df["label"].astype(int).to_numpy())
+    (tmp / "texts.json").write_text(json.dumps(clean_series(df["TEXT_ALL"].astype(str)).tolist(),
+                                               ensure_ascii=False), encoding="utf-8")
+    if target.exists():
+        shutil.rmtree(target, ignore_errors=True)
+    _publish_dir(tmp, target)
+    return target
+
+
+# ========= worker =========
+def _init_worker(threads):
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)      # numpy/sklearn 已加载的 BLAS、OpenMP 线程池
+    except ImportError:
+        pass
+    if find_spec("torch") is not None:
+        import torch
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:                  # 已有并行任务运行过时不允许再改
+            pass
+
+
+@functools.lru_cache(maxsize=4)
+def _behavior_arrays(cache):
+    cache = Path(cache)
+    info = json.loads((cache / "info.json").read_text(encoding="utf-8"))
+    return (np.load(cache / "X_idx.npy", mmap_mode="r"), np.load(cache / "y.npy"),
+            SeqEncoder.load(cache / "encoder.json"), info)
+
+
+@functools.lru_cache(maxsize=2)
+def _behavior_frame(data_path, features):
+    return load_dataset(data_path, columns=list(features))
+
+
+@functools.lru_cache(maxsize=2)
+def _text_arrays(cache):
+    cache = Path(cache)
+    texts = json.loads((cache / "texts.json").read_text(encoding="utf-8"))
+    return np.asarray(texts, dtype=object), np.load(cache / "y.npy")
+
+
+@functools.lru_cache(maxsize=8)
+def _splits(y_bytes, folds):
+    from sklearn.model_selection import StratifiedKFold
+
+    y = np.frombuffer(y_bytes, dtype=np.int64)
+    skf = StratifiedKFold(n_splits=folds, shuffle=True, random_state=SEED)
+    return list(skf.split(np.zeros(len(y)), y))
+
+
+def _fold_indices(y, folds, fold):
+    return _splits(np.ascontiguousarray(y, dtype=np.int64).tobytes(), folds)[fold]
+
+
+def _fit_predict(arch, params, job, tr, va):
+    """在 tr 上拟合，返回 (模型, va 上的风险概率)；va 为空时只拟合。"""
+    if arch == "text":
+        texts, y = _text_arrays(job["text_cache"])
+        model = build_text_pipeline(**params).fit(texts[tr], y[tr])
+        return model, (model.predict_proba(texts[va])[:, 1] if len(va) else None)
+
+    X_idx, y, enc, info = _behavior_arrays(job["behavior_cache"])
+    if arch == "svm":
+        features = tuple(info["features"])
+        df = _behavior_frame(info["data"], features)
+        model = build_svm_pipeline(df, list(features), **params).fit(df.iloc[tr], y[tr])
+        return model, (model.predict_proba(df.iloc[va])[:, 1] if len(va) else None)
+
+    from seq_models import predict_proba, train_model
+
+    train_kw = {k: v for k, v in params.items() if k in SEQ_TRAIN_KEYS}
+    model_kw = {k: v for k, v in params.items() if k not in SEQ_TRAIN_KEYS}
+    seed = SEED + (job["fold"] if job["fold"] is not None else 0)
+    if len(va):
+        model, _ = train_model(arch, enc.vocab_sizes, X_idx[tr], y[tr], X_idx[va], y[va],
+                               seed=seed, model_kwargs=model_kw, **train_kw)
+        return model, predict_proba(model, X_idx[va])
+    train_kw.setdefault("max_epochs", 25)
+    train_kw.setdefault("patience", 4)
+    model, _ = train_model(arch, enc.vocab_sizes, X_idx[tr], y[tr], seed=seed, model_kwargs=model_kw, **train_kw)
+    return model, None
+
+
+def run_job(job):
+    """worker 入口：job["fold"] 为折号时做 CV，为 None 时全量拟合并写产物。"""
+    t0 = time.perf_counter()
+    v = job["variant"]
+    cache = job["text_cache"] if v["arch"] == "text" else job["behavior_cache"]
+    y = _text_arrays(cache)[1] if v["arch"] == "text" else _behavior_arrays(cache)[1]
+    out = {"variant": v["name"], "arch": v["arch"], "fold": job["fold"], "pid": os.getpid()}
+    if job["fold"] is None:
+        model, _ = _fit_predict(v["arch"], v["params"], job, np.arange(len(y)), np.arange(0))
+        out["artifacts"] = _write_artifacts(v, model, job)
+    else:
+        tr, va = _fold_indices(y, job["folds"], job["fold"])
+        _, prob = _fit_predict(v["arch"], v["params"], job, tr, va)
+        out["va"], out["prob"] = va, prob
+    out["seconds"] = time.perf_counter() - t0
+    return out
+
+
+# ========= 产物 =========
+def _dump_atomic(obj, path):
+    import joblib
+
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    joblib.dump(obj, tmp)
+    os.replace(tmp, path)
+
+
+def _sha1_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _write_json_atomic(obj, path):
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _write_artifacts(v, model, job):
+    out_dir = Path(job["out_dir"])
+    arch = v["arch"]
+    if arch == "text":
+        path = out_dir / (OUT_TEXT if v["name"] == "text" else f"pipe_text_{v['name']}.pkl")
+        _dump_atomic(model, path)
+        return [{"kind": "text", "path": str(path)}]
+
+    _, _, enc, info = _behavior_arrays(job["behavior_cache"])
+    if arch == "svm":
+        return _write_svm(model, info, out_dir, "" if v["name"] == "svm" else v["name"])
+
+    from seq_models import save_checkpoint
+    from seq_serving import export_torchscript
+
+    path = out_dir / f"seq_{v['name']}.pt"
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    meta_tmp = save_checkpoint(model, tmp, arch, enc,
+                               model_kwargs={k: x for k, x in v["params"].items() if k not in SEQ_TRAIN_KEYS},
+                               extra={"variant": v["name"], "data_sha1": info["data_sha1"], "label": info["label"]})
+    os.replace(meta_tmp, path.with_name(f"seq_{v['name']}_meta.json"))
+    os.replace(tmp, path)
+    # 线上用的 TorchScript 产物（seq_serving.py）；与 eager 输出不一致时 export 会报错
+    return [{"kind": "seq", "path": str(path)}, {"kind": "torchscript", "path": str(export_torchscript(path))}]
+
+
+def _write_svm(pipe, info, out_dir, suffix):
+    from sklearn import __version__ as sklearn_version
+
+    from baseline import artifact_path_for, build_baseline, save_baseline
+    from compiled_model import compiled_path_for, export_pipeline
+
+    pkl = out_dir / (OUT_SVM if not suffix else f"svm_pca_behavior_{suffix}_pipeline.pkl")
+    meta = out_dir / (OUT_SVM_META if not suffix else f"svm_pca_behavior_{suffix}_meta.json")
+    # meta 的特征列从 ColumnTransformer 还原（与 notebook 一致，保证和模型输入顺序相同）
+    features = list(dict.fromkeys(c for _, _, cols in pipe.named_steps["prep"].transformers_
+                                  if isinstance(cols, list) for c in cols))
+    _write_json_atomic({"features": features}, meta)
+    _dump_atomic(pipe, pkl)
+    out = [{"kind": "behavior", "path": str(pkl), "meta": str(meta)}]
+    try:
+        out.append({"kind": "compiled", "path": str(export_pipeline(
+            pipe, compiled_path_for(pkl), source_sha1=_sha1_bytes(pkl.read_bytes()), sklearn_version=sklearn_version))})
+    except ValueError as e:                   # 管道含独热列等不支持导出的结构：app 端回退 sklearn
+        out.append({"kind": "compiled", "path": None, "note": str(e)})
+    base = build_baseline(_behavior_frame(info["data"], tuple(features)), features, dataset_sha1=info["data_sha1"])
+    save_baseline(base, artifact_path_for(meta))
+    out.append({"kind": "baseline", "path": str(artifact_path_for(meta))})
+    return out
+
+
+def sync_manifest(manifest_path, artifacts):
+    """清单里 path 指向刚写出的 pkl 的条目：重新计算 sha1（否则注册表会因校验失败拒绝加载）。"""
+    from registry import add_entry
+
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return []
+    base_dir = manifest_path.resolve().parent
+    written = {str(Path(a["path"]).resolve()) for a in artifacts
+               if a["kind"] in ("behavior", "text", "torchscript")}
+    updated = []
+    for m in json.loads(manifest_path.read_text(encoding="utf-8")).get("models", []):
+        if str((base_dir / m["path"]).resolve()) in written:
+            add_entry(manifest_path, m["name"], m.get("kind", "behavior"), m["path"], m.get("meta"),
+                      m.get("preload", False))
+            updated.append(m["name"])
+    return updated
+
+
+# ========= 汇总 =========
+def fold_metrics(y, prob):
+    from sklearn.metrics import accuracy_score, f1_score, roc_auc_score
+
+    pred = (prob >= 0.5).astype(int)
+    try:
+        auc = float(roc_auc_score(y, prob))
+    except ValueError:                        # 验证折里只有一个类别
+        auc = float("nan")
+    return {"acc": float(accuracy_score(y, pred)), "f1": float(f1_score(y, pred, zero_division=0)), "auc": auc}
+
+
+def summarize(results, labels):
+    """按变体汇总：每折指标、均值±标准差、OOF 整体指标。"""
+    report = {}
+    for name in sorted({r["variant"] for r in results if r["fold"] is not None}):
+        rs = sorted((r for r in results if r["variant"] == name and r["fold"] is not None), key=lambda r: r["fold"])
+        y = labels[rs[0]["arch"]]
+        oof = np.full(len(y), np.nan)
+        folds = []
+        for r in rs:
+            oof[r["va"]] = r["prob"]
+            folds.append({"fold": r["fold"], "seconds": round(r["seconds"], 2), **fold_metrics(y[r["va"]], r["prob"])})
+        entry = {"arch": rs[0]["arch"], "folds": folds}
+        for k in ("acc", "f1", "auc"):
+            vals = np.array([f[k] for f in folds])
+            entry[k] = {"mean": float(np.nanmean(vals)), "std": float(np.nanstd(vals))}
+        mask = ~np.isnan(oof)
+        entry["oof"] = fold_metrics(y[mask], oof[mask])
+        report[name] = entry
+    return report
+
+
+def default_workers(torch_threads):
+    return max(1, (os.cpu_count() or 1) // max(1, torch_threads))
+
+
+# ========= CLI =========
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="并行交叉验证 / 重训 notebook 中的行为与文本模型")
+    ap.add_argument("--data", default="CNAH2003_public_use.xls")
+    ap.add_argument("--diary", default="calendar_text_samples_zh (1).txt")
+    ap.add_argument("--features", default="svm_pca_behavior_meta.json",
+                    help="取其中的 features 作为行为特征列；文件不存在时按 notebook G1 规则自动筛选")
+    ap.add_argument("--models", nargs="+", default=["svm", "text", "cnn", "rnn"],
+                    help="模型变体：svm / text / cnn / rnn，可带参数，如 cnn:lr=5e-4,batch_size=256")
+    ap.add_argument("--folds", type=int, default=5)
+    ap.add_argument("--no-cv", action="store_true", help="跳过交叉验证（配合 --full 只重训）")
+    ap.add_argument("--full", action="store_true", help="全量拟合并导出产物")
+    ap.add_argument("--label", default="Q38_or_Q39", choices=["Q38_or_Q39", "Q39_only"])
+    ap.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数 // torch-threads")
+    ap.add_argument("--torch-threads", type=int, default=1, help="每个 worker 的 torch / BLAS 线程数")
+    ap.add_argument("--out-dir", default=".")
+    ap.add_argument("--manifest", default="models.json", help="重训后同步 sha1 的模型清单")
+    ap.add_argument("--no-cache", action="store_true", help="忽略已有的预处理缓存")
+    args = ap.parse_args(argv)
+
+    try:
+        variants = [parse_variant(s) for s in args.models]
+    except ValueError as e:
+        ap.error(str(e))
+    if any(v["arch"] in ("cnn", "rnn") for v in variants) and find_spec("torch") is None:
+        ap.error("cnn / rnn 需要 PyTorch：pip install torch")
+    if args.no_cv and not args.full:
+        ap.error("--no-cv 需要配合 --full")
+    Path(args.out_dir).mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    job_base = {"folds": args.folds, "out_dir": str(Path(args.out_dir).resolve())}
+    labels = {}
+    if any(v["arch"] != "text" for v in variants):
+        features = None
+        if args.features and Path(args.features).exists():
+            with open(args.features, "r", encoding="utf-8") as f:
+                features = json.load(f).get("features") or None
+        cache = prepare_behavior(args.data, features, args.label, use_cache=not args.no_cache)
+        job_base["behavior_cache"] = str(cache)
+        labels.update({a: np.load(cache / "y.npy") for a in ("svm", "cnn", "rnn")})
+        print(f"行为数据：{cache}（{labels['svm'].shape[0]} 行，阳性 {int(labels['svm'].sum())}）")
+    if any(v["arch"] == "text" for v in variants):
+        cache = prepare_text(args.diary, use_cache=not args.no_cache)
+        job_base["text_cache"] = str(cache)
+        labels["text"] = np.load(cache / "y.npy")
+        print(f"文本数据：{cache}（{labels['text'].shape[0]} 条）")
+    prep_s = time.perf_counter() - t0
+
+    jobs = []
+    for v in variants:
+        if not args.no_cv:
+            jobs += [{**job_base, "variant": v, "fold": k} for k in range(args.folds)]
+        if args.full:
+            jobs.append({**job_base, "variant": v, "fold": None})
+    # 慢任务先提交，减少最后只剩一个长任务在跑的尾部等待
+    jobs.sort(key=lambda j: ("rnn", "cnn", "svm", "text").index(j["variant"]["arch"]))
+    workers = min(args.workers or default_workers(args.torch_threads), len(jobs))
+    print(f"{len(jobs)} 个任务，{workers} 个进程 × {args.torch_threads} 线程")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(args.torch_threads,)) as ex:
+        futures = {ex.submit(run_job, j): j for j in jobs}
+        for fut in as_completed(futures):
+            r = fut.result()
+            results.append(r)
+            what = "全量拟合" if r["fold"] is None else f"fold {r['fold'] + 1}/{args.folds}"
+            print(f"  [{len(results)}/{len(jobs)}] {r['variant']} {what}：{r['seconds']:.1f}s")
+    wall = time.perf_counter() - t0
+
+    report = {"prepare_seconds": round(prep_s, 2), "wall_seconds": round(wall, 2),
+              "task_seconds": round(sum(r["seconds"] for r in results), 2), "workers": workers,
+              "torch_threads": args.torch_threads, "models": summarize(results, labels)}
+    artifacts = [a for r in results if r["fold"] is None for a in r["artifacts"]]
+    if artifacts:
+        report["artifacts"] = artifacts
+        report["manifest_updated"] = sync_manifest(args.manifest, artifacts)
+    _write_json_atomic(report, Path(args.out_dir) / "cv_report.json")
+
+    for name, m in report["models"].items():
+        print(f"{name:>24}  Acc {m['acc']['mean']:.4f}±{m['acc']['std']:.4f}  "
+              f"F1 {m['f1']['mean']:.4f}±{m['f1']['std']:.4f}  AUC {m['auc']['mean']:.4f}±{m['auc']['std']:.4f}")
+    for a in artifacts:
+        print(f"产物 [{a['kind']}] {a['path']}" + (f"  （{a['note']}）" if a.get("note") else ""))
+    if report.get("manifest_updated"):
+        print(f"已更新清单 {args.manifest}：{', '.join(report['manifest_updated'])}")
+    print(f"总耗时 {wall:.1f}s（任务累计 {report['task_seconds']:.1f}s，预处理 {prep_s:.1f}s）")
+
+
+if __name__ == "__main__":
+    main()